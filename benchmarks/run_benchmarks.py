@@ -0,0 +1,206 @@
+"""
+    Benchmarks of the FlowRunner, FlowService and FlowRepository hot paths.
+
+    Run from the repository root with:
+        python -m benchmarks.run_benchmarks [--output results.json] [--history-sizes 10000 100000 1000000]
+
+    Results are written as JSON so that they can be compared between releases.
+"""
+from datetime import datetime, timezone
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from src.model.flow import ExecutionContext, FlowStatus, FlowTemplate, PersistenceMode, Task
+from src.repositories.flow_repository import FlowRepository
+from src.runner.flow_runner import FlowRunner
+from src.services.flow_service import FlowService
+
+DEFAULT_CONTEXT_SIZES = [0, 1024, 100 * 1024]
+DEFAULT_HISTORY_SIZES = [10000, 100000]
+PERSISTENCE_MODES = [PersistenceMode.TRANSIENT, PersistenceMode.PERSISTENT]
+
+class PassThroughTask(Task):
+    def run(self, context: ExecutionContext) -> ExecutionContext:
+        return context
+
+def create_context(context_size: int) -> ExecutionContext:
+    execution_context = ExecutionContext()
+    if context_size > 0:
+        execution_context.set("payload", "x" * context_size)
+
+    return execution_context
+
+def create_repository(persistence: PersistenceMode, storage_directory: str) -> FlowRepository:
+    if persistence is PersistenceMode.TRANSIENT:
+        return FlowRepository.from_persistence_mode(persistence)
+
+    storage_file_name = os.path.join(storage_directory, f"benchmark_{time.monotonic_ns()}.db")
+    return FlowRepository(storage_file_name)
+
+def create_service(persistence: PersistenceMode, storage_directory: str) -> FlowService:
+    flow_service = FlowService(PersistenceMode.TRANSIENT)
+    flow_service.flow_repository = create_repository(persistence, storage_directory)
+
+    return flow_service
+
+def benchmark_run_flow(persistence: PersistenceMode, context_size: int, flows: int, tasks_per_flow: int, storage_directory: str) -> dict:
+    flow_template = FlowTemplate("benchmark")
+    for _ in range(tasks_per_flow):
+        flow_template.add_task(PassThroughTask())
+
+    flow_runner = FlowRunner(create_service(persistence, storage_directory))
+    flow_runner.register_flow_template(flow_template)
+
+    for _ in range(flows):
+        flow_runner.schedule_flow("benchmark", create_context(context_size))
+
+    start = time.perf_counter()
+    while flow_runner.run_flow(FlowStatus.SCHEDULED) is not None:
+        pass
+    elapsed = time.perf_counter() - start
+
+    return {
+        "benchmark": "run_flow",
+        "persistence": persistence.name,
+        "context_size": context_size,
+        "flows": flows,
+        "tasks_per_flow": tasks_per_flow,
+        "seconds": elapsed,
+        "flows_per_second": flows / elapsed,
+        "per_task_overhead_us": elapsed / (flows * tasks_per_flow) * 1e6
+    }
+
+def benchmark_update_flow_status(persistence: PersistenceMode, context_size: int, flows: int, storage_directory: str) -> dict:
+    flow_service = create_service(persistence, storage_directory)
+    execution_context = create_context(context_size)
+
+    flow_ids = []
+    for _ in range(flows):
+        flow_execution = flow_service.create_flow_execution("benchmark", execution_context)
+        flow_service.update_flow_status(flow_execution.execution_id, FlowStatus.SCHEDULED, execution_context)
+        flow_ids.append(flow_execution.execution_id)
+
+    latencies = []
+    for flow_id in flow_ids:
+        for target_flow_status in [FlowStatus.RUNNING, FlowStatus.RUNNING, FlowStatus.SUCCEEDED]:
+            start = time.perf_counter()
+            flow_service.update_flow_status(flow_id, target_flow_status, execution_context)
+            latencies.append(time.perf_counter() - start)
+
+    return {
+        "benchmark": "update_flow_status",
+        "persistence": persistence.name,
+        "context_size": context_size,
+        "operations": len(latencies),
+        **summarize_latencies(latencies)
+    }
+
+def prefill_history(flow_repository: FlowRepository, history_size: int, context_size: int, steps_per_flow: int = 10) -> int:
+    """
+        Writes history_size flow_executions rows, spread over flows of steps_per_flow steps, straight into the storage
+    """
+    context_payload = create_context(context_size).to_json()
+    flow_count = max(1, history_size // steps_per_flow)
+
+    history_rows = ((flow_id, step, FlowStatus.RUNNING.value, "benchmark", step, context_payload, step, 0)
+                        for flow_id in range(1, flow_count + 1) for step in range(steps_per_flow))
+    state_rows = ((flow_id, steps_per_flow - 1, FlowStatus.RUNNING.value, "benchmark", steps_per_flow - 1, context_payload, steps_per_flow - 1)
+                        for flow_id in range(1, flow_count + 1))
+
+    with flow_repository.transaction():
+        flow_repository.connection.executemany("""
+            INSERT INTO flow_executions(execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp, context_is_delta)
+            VALUES (?,?,?,?,?,?,?,?)""", history_rows)
+        flow_repository.connection.executemany("""
+            INSERT INTO flow_states(execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp)
+            VALUES (?,?,?,?,?,?,?)""", state_rows)
+
+    return flow_count
+
+def benchmark_repository(persistence: PersistenceMode, context_size: int, history_size: int, operations: int, storage_directory: str) -> list[dict]:
+    flow_repository = create_repository(persistence, storage_directory)
+    flow_count = prefill_history(flow_repository, history_size, context_size)
+    flow_ids = random.sample(range(1, flow_count + 1), min(operations, flow_count))
+
+    get_latencies = []
+    flows = []
+    for flow_id in flow_ids:
+        start = time.perf_counter()
+        flows.append(flow_repository.get_flow(flow_id))
+        get_latencies.append(time.perf_counter() - start)
+
+    save_latencies = []
+    for flow_execution in flows:
+        flow_execution.execution_step += 1
+        flow_execution.execution_context.set("step", flow_execution.execution_step)
+
+        start = time.perf_counter()
+        flow_repository.save_flow(flow_execution)
+        save_latencies.append(time.perf_counter() - start)
+
+    common = {"persistence": persistence.name, "context_size": context_size, "history_size": history_size, "operations": len(flow_ids)}
+    return [
+        {"benchmark": "get_flow", **common, **summarize_latencies(get_latencies)},
+        {"benchmark": "save_flow", **common, **summarize_latencies(save_latencies)}
+    ]
+
+def summarize_latencies(latencies: list[float]) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "mean_us": sum(ordered) / len(ordered) * 1e6,
+        "p50_us": ordered[len(ordered) // 2] * 1e6,
+        "p99_us": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6,
+        "max_us": ordered[-1] * 1e6
+    }
+
+def get_metadata() -> dict:
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python_version": platform.python_version(),
+        "sqlite_version": sqlite3.sqlite_version,
+        "platform": platform.platform()
+    }
+
+def run_benchmarks(arguments: argparse.Namespace) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory() as storage_directory:
+        for persistence in PERSISTENCE_MODES:
+            for context_size in arguments.context_sizes:
+                results.append(benchmark_run_flow(persistence, context_size, arguments.flows, arguments.tasks_per_flow, storage_directory))
+                results.append(benchmark_update_flow_status(persistence, context_size, arguments.flows, storage_directory))
+
+                for history_size in arguments.history_sizes:
+                    results.extend(benchmark_repository(persistence, context_size, history_size, arguments.operations, storage_directory))
+
+    return {"metadata": get_metadata(), "results": results}
+
+def parse_arguments(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks the FlowRunner, FlowService and FlowRepository hot paths.")
+    parser.add_argument("--output", help="File to write the JSON results to, defaults to the standard output")
+    parser.add_argument("--flows", type=int, default=200, help="Flows run per run_flow/update_flow_status benchmark")
+    parser.add_argument("--tasks-per-flow", type=int, default=10, help="Tasks of the run_flow benchmark template")
+    parser.add_argument("--operations", type=int, default=1000, help="get_flow/save_flow calls per history size")
+    parser.add_argument("--context-sizes", type=int, nargs="+", default=DEFAULT_CONTEXT_SIZES, help="Execution context payload sizes, in bytes")
+    parser.add_argument("--history-sizes", type=int, nargs="+", default=DEFAULT_HISTORY_SIZES, help="flow_executions rows written before measuring the repository")
+
+    return parser.parse_args(argv)
+
+def main(argv: list[str]) -> None:
+    arguments = parse_arguments(argv)
+    results = json.dumps(run_benchmarks(arguments), indent=2)
+
+    if arguments.output is None:
+        print(results)
+    else:
+        with open(arguments.output, "w", encoding="utf8") as output:
+            output.write(results)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
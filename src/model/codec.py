@@ -0,0 +1,228 @@
+import json
+import pickle
+import zlib
+
+from src.model.metrics import timed
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CODEC_NAME_SEPARATOR: bytes = b"\0"
+MAX_CODEC_NAME_LENGTH: int = 64
+BLOB_REFERENCE_MARKER: str = "$blob"
+
+class BlobReference:
+    """
+        Stands for a large value kept in the content addressed blob store instead of in the encoded context
+    """
+    hash: str
+    size: int
+
+    def __init__(self, hash: str, size: int):
+        self.hash = hash
+        self.size = size
+
+    def __eq__(self, __o: object) -> bool:
+        return type(__o) == type(self) and self.hash == __o.hash
+
+    def __hash__(self) -> int:
+        return hash(self.hash)
+
+    def __repr__(self) -> str:
+        return f"BlobReference('{self.hash}',{self.size})"
+
+"""
+    Keys starting with MARKER_PREFIX are reserved for markers such as BLOB_REFERENCE_MARKER.
+    JSON like codecs escape user keys starting with it by doubling the prefix, so a user dict never decodes as a marker.
+"""
+MARKER_PREFIX: str = "$"
+
+def blob_reference_to_dict(value) -> dict:
+    if isinstance(value, BlobReference):
+        return {BLOB_REFERENCE_MARKER: value.hash, "size": value.size}
+
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+def blob_reference_from_dict(value: dict):
+    if BLOB_REFERENCE_MARKER in value:
+        return BlobReference(value[BLOB_REFERENCE_MARKER], value["size"])
+
+    if any(isinstance(key, str) and key.startswith(MARKER_PREFIX) for key in value):
+        return {(key[1:] if isinstance(key, str) and key.startswith(MARKER_PREFIX) else key): item for (key, item) in value.items()}
+
+    return value
+
+def has_marker_like_keys(value) -> bool:
+    if isinstance(value, dict):
+        return any((isinstance(key, str) and key.startswith(MARKER_PREFIX)) or has_marker_like_keys(item) for (key, item) in value.items())
+
+    if isinstance(value, (list, tuple)):
+        return any(has_marker_like_keys(item) for item in value)
+
+    return False
+
+def escape_marker_like_keys(value):
+    """
+        Copy of the value whose dict keys starting with MARKER_PREFIX get one more. Values without such keys are returned as is.
+    """
+    if not has_marker_like_keys(value):
+        return value
+
+    if isinstance(value, dict):
+        return {(MARKER_PREFIX + key if isinstance(key, str) and key.startswith(MARKER_PREFIX) else key): escape_marker_like_keys(item)
+                    for (key, item) in value.items()}
+
+    return [escape_marker_like_keys(item) for item in value]
+
+class ExecutionContextCodec:
+    """
+        Encodes an ExecutionContext dict into the payload that is persisted and decodes it back.
+        Text codecs return a str, binary codecs return bytes.
+    """
+    name: str = None
+
+    def encode(self, context: dict):
+        raise NotImplementedError()
+
+    def decode(self, payload) -> dict:
+        raise NotImplementedError()
+
+class JsonCodec(ExecutionContextCodec):
+    name = "json"
+
+    def encode(self, context: dict) -> str:
+        return json.dumps(escape_marker_like_keys(context), default=blob_reference_to_dict)
+
+    def decode(self, payload) -> dict:
+        return json.loads(payload, object_hook=blob_reference_from_dict)
+
+class PickleCodec(ExecutionContextCodec):
+    """
+        Supports any picklable Python object. Only decode payloads coming from a trusted storage.
+    """
+    name = "pickle"
+
+    def encode(self, context: dict) -> bytes:
+        return pickle.dumps(context, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, payload) -> dict:
+        return pickle.loads(payload)
+
+class MsgpackCodec(ExecutionContextCodec):
+    """
+        Compact binary encoding of JSON like data. Needs the optional msgpack package.
+    """
+    name = "msgpack"
+
+    def encode(self, context: dict) -> bytes:
+        return self.__msgpack().packb(escape_marker_like_keys(context), use_bin_type=True, default=blob_reference_to_dict)
+
+    def decode(self, payload) -> dict:
+        return self.__msgpack().unpackb(payload, raw=False, object_hook=blob_reference_from_dict)
+
+    def __msgpack(self):
+        if msgpack is None:
+            raise ValueError("The msgpack codec needs the 'msgpack' package to be installed")
+
+        return msgpack
+
+class ZlibCodec(ExecutionContextCodec):
+    """
+        Compresses the payload of another codec
+    """
+    codec: ExecutionContextCodec
+    level: int
+
+    def __init__(self, codec: ExecutionContextCodec, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        self.codec = codec
+        self.level = level
+        self.name = f"{codec.name}+zlib"
+
+    def encode(self, context: dict) -> bytes:
+        payload = self.codec.encode(context)
+        if isinstance(payload, str):
+            payload = payload.encode("utf8")
+
+        return zlib.compress(payload, self.level)
+
+    def decode(self, payload) -> dict:
+        return self.codec.decode(zlib.decompress(payload))
+
+JSON_CODEC = JsonCodec()
+PICKLE_CODEC = PickleCodec()
+MSGPACK_CODEC = MsgpackCodec()
+
+_codecs: dict[str, ExecutionContextCodec] = {}
+
+def register_codec(codec: ExecutionContextCodec) -> None:
+    if codec.name is None or len(codec.name) > MAX_CODEC_NAME_LENGTH:
+        raise ValueError(f"Codec name must be set and have at most {MAX_CODEC_NAME_LENGTH} characters, got '{codec.name}'")
+
+    _codecs[codec.name] = codec
+
+def get_codec(name: str) -> ExecutionContextCodec:
+    codec = _codecs.get(name)
+    if codec is None:
+        raise ValueError(f"There is no registered execution context codec named '{name}'")
+
+    return codec
+
+for _codec in [JSON_CODEC, PICKLE_CODEC, MSGPACK_CODEC]:
+    register_codec(_codec)
+    register_codec(ZlibCodec(_codec))
+
+"""
+    Persisted payloads are self describing: JSON is stored as plain text, as it always was,
+    while binary payloads are prefixed with the name of the codec that produced them.
+"""
+@timed("flow_context_encode_seconds")
+def encode_payload(codec: ExecutionContextCodec, context: dict):
+    payload = codec.encode(context)
+    if isinstance(codec, JsonCodec):
+        return payload
+
+    if isinstance(payload, str):
+        payload = payload.encode("utf8")
+
+    return codec.name.encode("ascii") + CODEC_NAME_SEPARATOR + payload
+
+def get_payload_codec(stored_payload) -> ExecutionContextCodec:
+    if isinstance(stored_payload, str):
+        return JSON_CODEC
+
+    separator_index = stored_payload.find(CODEC_NAME_SEPARATOR, 0, MAX_CODEC_NAME_LENGTH + 1)
+    if separator_index < 0:
+        raise ValueError("Stored execution context payload has no codec header")
+
+    return get_codec(bytes(stored_payload[:separator_index]).decode("ascii"))
+
+@timed("flow_context_decode_seconds")
+def decode_payload(stored_payload) -> dict:
+    codec = get_payload_codec(stored_payload)
+    if isinstance(stored_payload, str):
+        return codec.decode(stored_payload)
+
+    header_length = len(codec.name) + len(CODEC_NAME_SEPARATOR)
+    return codec.decode(memoryview(stored_payload)[header_length:])
+
+"""
+    Key level deltas between two versions of an ExecutionContext dict
+"""
+def diff_contexts(previous: dict, current: dict) -> dict:
+    """
+        Key level changes from previous to current. Keys are compared as they are, so both contexts must be keyed the same way, e.g. by strings.
+    """
+    changed = {key: value for key, value in current.items() if key not in previous or previous[key] != value}
+    removed = [key for key in previous if key not in current]
+
+    return {"set": changed, "unset": removed}
+
+def apply_context_delta(context: dict, delta: dict) -> dict:
+    patched_context = dict(context)
+    patched_context.update(delta["set"])
+    for key in delta["unset"]:
+        patched_context.pop(key, None)
+
+    return patched_context
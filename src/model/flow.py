@@ -1,26 +1,111 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 from enum import Enum
+from types import MappingProxyType
+from typing import Callable
+import hashlib
 import json
+import random
+import threading
+
+from src.model.codec import JSON_CODEC, BlobReference, ExecutionContextCodec, decode_payload, encode_payload, get_payload_codec
 
 class PersistenceMode(Enum):
     TRANSIENT = 0,
     PERSISTENT = 1
 
+class Durability(Enum):
+    """
+        FULL: write ahead log and synchronous=FULL, every unit of work is committed (and fsynced) on its own.
+        WAL: write ahead log and synchronous=NORMAL, every unit of work is committed but fsyncs only happen on checkpoints.
+        GROUP_COMMIT: same as WAL but units of work from several flows are grouped in a single commit.
+            Meant for a single writer process as the storage stays write locked until the group is committed.
+    """
+    FULL = 0
+    WAL = 1
+    GROUP_COMMIT = 2
+
 class ExecutionContext:
-    context: dict
+    """
+        The context can be built from a persisted payload, in which case it is only decoded the first time its content is accessed.
+        As long as the content isn't changed, encoding it again with the same codec reuses the persisted payload.
+
+        Large binary values are kept by the repository in a blob store and only referenced by the context.
+        get() loads them on first access, through the blob_loader, and returns them as read only memoryviews.
+    """
+    __slots__ = ("_context", "_payload", "_blobs", "blob_loader")
+
+    _context: dict
+    _payload: tuple[ExecutionContextCodec, object]
+    _blobs: dict[str, memoryview]
+    blob_loader: Callable[[str], bytes]
 
     def __init__(self):
-        self.context = {}
+        self._context = {}
+        self._payload = None
+        # Only contexts holding blobs need the dictionary
+        self._blobs = None
+        self.blob_loader = None
+
+    @property
+    def context(self) -> dict:
+        self.__decode()
+        # The caller might change the dictionary in place, so the persisted payload can't be trusted anymore
+        self._payload = None
+        return self._context
+
+    @context.setter
+    def context(self, context: dict) -> None:
+        self._context = context
+        self._payload = None
 
     def set(self, key: str, value) -> None:
         self.context[key] = value
 
     def get(self, key: str):
-        return self.context[key]
+        self.__decode()
+        value = self._context[key]
+
+        if isinstance(value, BlobReference):
+            return self.__load_blob(value)
+
+        return value
+
+    def replace_with_blob_reference(self, key: str, blob_reference: BlobReference) -> None:
+        """
+            Swaps a large value for its reference in the blob store. get() keeps returning the value without reloading it.
+        """
+        value = self.as_dict()[key]
+        if self._blobs is None:
+            self._blobs = {}
+
+        self._blobs[blob_reference.hash] = memoryview(value).toreadonly()
+        self.context[key] = blob_reference
+
+    def as_dict(self) -> MappingProxyType:
+        """
+            Read only view of the content that, unlike the context property, keeps the persisted payload reusable
+        """
+        self.__decode()
+        return MappingProxyType(self._context)
+
+    def is_decoded(self) -> bool:
+        return self._context is not None
 
     def to_json(self) -> str:
         return json.dumps(self.context)
 
+    def to_payload(self, codec: ExecutionContextCodec):
+        if self._payload is not None and self._payload[0].name == codec.name:
+            return self._payload[1]
+
+        self.__decode()
+        payload = encode_payload(codec, self._context)
+        self._payload = (codec, payload)
+
+        return payload
+
     """ 
         Returns a new instance of an ExecutionContext from a Json String representation
     """
@@ -31,6 +116,44 @@ class ExecutionContext:
         
         return ec  
 
+    """
+        Returns a new instance of an ExecutionContext that lazily decodes a persisted payload
+    """
+    @staticmethod
+    def from_payload(stored_payload):
+        ec = ExecutionContext()
+        ec._context = None
+        ec._payload = (get_payload_codec(stored_payload), stored_payload)
+
+        return ec
+
+    def __decode(self) -> None:
+        if self._context is None:
+            self._context = decode_payload(self._payload[1])
+
+    def __load_blob(self, blob_reference: BlobReference) -> memoryview:
+        blob = None if self._blobs is None else self._blobs.get(blob_reference.hash)
+        if blob is None:
+            if self.blob_loader is None:
+                raise ValueError(f"Execution context has no blob loader to load {blob_reference}")
+
+            blob = memoryview(self.blob_loader(blob_reference.hash)).toreadonly()
+            if self._blobs is None:
+                self._blobs = {}
+
+            self._blobs[blob_reference.hash] = blob
+
+        return blob
+
+    def __copy__(self):
+        ec = ExecutionContext()
+        ec._context = None if self._context is None else dict(self._context)
+        ec._payload = self._payload
+        ec._blobs = self._blobs
+        ec.blob_loader = self.blob_loader
+
+        return ec
+
 class FlowStatus(Enum):
     CREATED = 0
     SCHEDULED = 1
@@ -45,8 +168,10 @@ class TaskStatus(Enum):
     SUCCEEDED = 3
 
 class TaskDataItem():
-    key: str = None
-    type: type = None
+    __slots__ = ("key", "typ")
+
+    key: str
+    typ: type
 
     def __init__(self, key:str, typ: type):
         self.key = key
@@ -55,9 +180,182 @@ class TaskDataItem():
     def __eq__(self, __o: object) -> bool:
         return type(__o) == type(self) and self.key == __o.key and self.typ == __o.typ
 
+    def __hash__(self) -> int:
+        return hash((self.key, self.typ))
+
     def __repr__(self) -> str:
         return f"'{self.key}',{self.typ}"
 
+class TaskExecutionMode(Enum):
+    INLINE = 0
+    PROCESS = 1
+
+class TaskTimeoutError(Exception):
+    timeout: float
+
+    def __init__(self, timeout: float):
+        super().__init__(f"Task timed out after {timeout} seconds")
+        self.timeout = timeout
+
+class TaskCancelledError(Exception):
+    pass
+
+_current_cancellation_token: ContextVar = ContextVar("cancellation_token", default=None)
+
+class CancellationToken:
+    """
+        Tells a running task that its outcome is no longer awaited, e.g. because it timed out.
+        Cancellation is cooperative: long running tasks should poll CancellationToken.current() and stop early once it's cancelled.
+    """
+    cancelled: threading.Event
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self.cancelled.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self.is_cancelled():
+            raise TaskCancelledError("Task was cancelled")
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+            Sleeps up to timeout seconds, waking up as soon as the token is cancelled. Returns whether it's cancelled.
+        """
+        return self.cancelled.wait(timeout)
+
+    @contextmanager
+    def activate(self):
+        reset_token = _current_cancellation_token.set(self)
+        try:
+            yield self
+        finally:
+            _current_cancellation_token.reset(reset_token)
+
+    @staticmethod
+    def current() -> "CancellationToken":
+        """
+            The token of the task being run, a token that is never cancelled when not called from a task run by a FlowRunner
+        """
+        token = _current_cancellation_token.get()
+        return CancellationToken() if token is None else token
+
+_current_task_checkpoint: ContextVar = ContextVar("task_checkpoint", default=None)
+
+class TaskCheckpoint:
+    """
+        Partial progress of a long running task. A task that saves a checkpoint now and then can load the latest one when it is run
+        again, e.g. after its flow was rescheduled following a failure, and resume from it instead of starting over.
+        The FlowRunner persists every saved state right away and drops the checkpoints of a flow once it SUCCEEDED.
+        Once the runner is done with the task, e.g. because it timed out, later saves are only kept in memory.
+        Tasks run in a worker process, and tasks not run by a FlowRunner, get a checkpoint that is only kept in memory.
+    """
+    __slots__ = ("loader", "saver", "state", "loaded", "lock")
+
+    loader: Callable[[], object]
+    saver: Callable[[object], None]
+    state: object
+    loaded: bool
+    lock: threading.Lock
+
+    def __init__(self, loader: Callable[[], object] = None, saver: Callable[[object], None] = None):
+        self.loader = loader
+        self.saver = saver
+        self.state = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+            The latest saved state, None when the task never saved one. The storage is only read the first time.
+        """
+        if not self.loaded:
+            self.state = None if self.loader is None else self.loader()
+            self.loaded = True
+
+        return self.state
+
+    def save(self, state) -> None:
+        """
+            Persists the state, which must be encodable by the codec of the flow context
+        """
+        with self.lock:
+            if self.saver is not None:
+                self.saver(state)
+
+        self.state = state
+        self.loaded = True
+
+    def close(self) -> None:
+        """
+            Detaches the checkpoint from the storage, waiting for a save in progress. Saves of an abandoned task no longer reach the storage.
+        """
+        with self.lock:
+            self.saver = None
+
+    @contextmanager
+    def activate(self):
+        reset_token = _current_task_checkpoint.set(self)
+        try:
+            yield self
+        finally:
+            _current_task_checkpoint.reset(reset_token)
+
+    @staticmethod
+    def current() -> "TaskCheckpoint":
+        """
+            The checkpoint of the task being run, a new in memory one when not called from a task run by a FlowRunner
+        """
+        checkpoint = _current_task_checkpoint.get()
+        return TaskCheckpoint() if checkpoint is None else checkpoint
+
+class RetryPolicy:
+    """
+        How failed flows are retried: a flow is run at most max_attempts times, the first run included.
+        The n-th retry waits backoff * multiplier^(n-1) seconds, up to max_backoff, give or take a random jitter fraction of it
+        so that flows that failed together don't all retry at the same time.
+    """
+    __slots__ = ("max_attempts", "backoff", "multiplier", "max_backoff", "jitter")
+
+    max_attempts: int
+    backoff: float
+    multiplier: float
+    max_backoff: float
+    jitter: float
+
+    def __init__(self, max_attempts: int = 3, backoff: float = 1.0, multiplier: float = 2.0, max_backoff: float = 300.0, jitter: float = 0.1):
+        if max_attempts < 1:
+            raise ValueError(f"A retry policy needs at least one attempt, got {max_attempts}")
+
+        if backoff < 0 or multiplier < 1 or max_backoff < backoff:
+            raise ValueError(f"Invalid retry backoff {backoff} with multiplier {multiplier} up to {max_backoff}")
+
+        if not 0 <= jitter <= 1:
+            raise ValueError(f"Retry jitter must be a fraction between 0 and 1, got {jitter}")
+
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def can_retry(self, attempt: int) -> bool:
+        """
+            Whether a flow whose attempt-th run failed is retried
+        """
+        return attempt < self.max_attempts
+
+    def get_delay(self, attempt: int) -> float:
+        """
+            Seconds to wait before retrying a flow whose attempt-th run failed
+        """
+        delay = min(self.backoff * self.multiplier ** (attempt - 1), self.max_backoff)
+        return max(delay * (1 + random.uniform(-self.jitter, self.jitter)), 0)
+
 #TODO: How to make it an abstract class so that we can enforce method implementation
 class Task:
     def run(self, context: ExecutionContext) -> ExecutionContext:
@@ -69,13 +367,93 @@ class Task:
     def outputs(self) -> list[TaskDataItem]:
         return []
 
+    """
+        Seconds the task is allowed to run before its execution is FAILED, None to use the timeout of the flow template
+    """
+    def timeout(self) -> float:
+        return None
+
+    """
+        Where the FlowRunner calls run(): INLINE in the runner's process or PROCESS in a worker process of its process pool
+    """
+    def execution_mode(self) -> TaskExecutionMode:
+        return TaskExecutionMode.INLINE
+
+    """
+        How the flow is retried when the task fails, None to use the retry policy of the flow template
+    """
+    def retry_policy(self) -> RetryPolicy:
+        return None
+
+    """
+        Whether the outputs of the task only depend on the values of its inputs(). The FlowRunner then reuses the outputs() of any earlier run
+        of the same task of the template, in any flow, with the very same input values instead of running the task again.
+    """
+    def memoize(self) -> bool:
+        return False
+
+def hash_task_inputs(task: Task, context: ExecutionContext, template_name: str = None, task_index: int = None) -> str:
+    """
+        Memoization key of a run of the task on the context: a hash of where the task stands in its template, of its class, of its outputs() keys
+        and of the values of its inputs(). Blobs are hashed by reference, without being loaded.
+        None when an input value can't be hashed, such a run isn't memoized.
+    """
+    task_class = type(task)
+    output_keys = ",".join(sorted(data_item.key for data_item in task.outputs()))
+    digest = hashlib.sha256(f"{template_name}\0{task_index}\0{task_class.__module__}.{task_class.__qualname__}\0{output_keys}".encode("utf8"))
+    values = context.as_dict()
+
+    for key in sorted(data_item.key for data_item in task.inputs()):
+        value = values.get(key)
+        if key not in values:
+            # Unlike any JSON document, so a missing input doesn't hash like a None one
+            value_digest = ""
+        elif isinstance(value, BlobReference):
+            value_digest = value.hash
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            value_digest = hashlib.sha256(value).hexdigest()
+        else:
+            try:
+                value_digest = json.dumps(value, sort_keys=True)
+            except (TypeError, ValueError):
+                return None
+
+        digest.update(b"\0" + key.encode("utf8") + b"\0" + value_digest.encode("utf8"))
+
+    return digest.hexdigest()
+
+class AsyncTask(Task):
+    """
+        Task for I/O bound work. The AsyncFlowRunner awaits it on its event loop so that many flows can wait on I/O concurrently.
+    """
+    async def run(self, context: ExecutionContext) -> ExecutionContext:
+        return ExecutionContext()
+
+class ProcessTask(Task):
+    """
+        Task for CPU bound work. The FlowRunner runs it in a worker process so that several of them use several cores instead of sharing the GIL.
+        The task must be picklable and, as run() works on a copy of the task, changes it makes to its own attributes are not seen by the runner.
+        CancellationToken.current() is never cancelled in a worker process: a timed out process task is stopped by terminating its worker.
+    """
+    def execution_mode(self) -> TaskExecutionMode:
+        return TaskExecutionMode.PROCESS
+
+class FlowTemplateMode(Enum):
+    """
+        LINEAR: tasks run one after the other, in the order they were added.
+        DAG: a task runs as soon as the tasks producing its inputs succeeded, independent tasks run concurrently.
+            Inputs that no task produces are expected in the context the flow is scheduled with.
+    """
+    LINEAR = 0
+    DAG = 1
+
 class FlowTemplateIntegrityChecker:
     tasks: list[Task]
-    task_data_items: list[TaskDataItem]
+    task_data_items: set[TaskDataItem]
     
     def __init__(self, tasks: list[Task]):
         self.tasks = tasks
-        self.task_data_items = []
+        self.task_data_items = set()
 
     #TODO: implement and call before run
     def verify_can_be_started(self, start_execution_context: ExecutionContext) ->bool:
@@ -85,7 +463,7 @@ class FlowTemplateIntegrityChecker:
         # If we are the first task we add all of the items
         if(len(self.tasks) == 0):
             for input_item in task.inputs():
-                self.task_data_items.append(input_item)
+                self.task_data_items.add(input_item)
 
         # If we aren't the first task we are going to check if we have our inputs in the current 'bag' of task_data_items
         # AKA: can_task_be_run
@@ -102,24 +480,50 @@ class FlowTemplateIntegrityChecker:
 
         # Add outputs to the 'bag' of task_data_items
         for output_item in task.outputs():
-                self.task_data_items.append(output_item)
+                self.task_data_items.add(output_item)
+
+        return True
+
+    def verify_dag_task_integrity(self, task: Task) -> bool:
+        # Tasks can be added in any order, only a single task may produce a given data item
+        for output_item in task.outputs():
+            if(output_item in self.task_data_items):
+                raise ValueError(f"Task {task} output {output_item} is already produced by another task of the flow")
+
+        for output_item in task.outputs():
+            self.task_data_items.add(output_item)
 
         return True
 
 class FlowTemplate:
     name: str
     tasks: list[Task]
+    codec: ExecutionContextCodec
+    task_timeout: float
+    mode: FlowTemplateMode
+    retry_policy: RetryPolicy
 
     integrity_checker: FlowTemplateIntegrityChecker
 
-    def __init__(self, name):
+    def __init__(self, name, codec: ExecutionContextCodec = JSON_CODEC, task_timeout: float = None, mode: FlowTemplateMode = FlowTemplateMode.LINEAR,
+                 retry_policy: RetryPolicy = None):
+        if task_timeout is not None and task_timeout <= 0:
+            raise ValueError(f"Task timeout must be positive, got {task_timeout}")
+
         self.name = name
         self.tasks = []
+        self.codec = codec
+        self.task_timeout = task_timeout
+        self.mode = mode
+        self.retry_policy = retry_policy
 
         self.integrity_checker = FlowTemplateIntegrityChecker(self.tasks)
 
     def add_task(self, task: Task) -> None:
-        self.integrity_checker.verify_tasks_integrity(task)
+        if(self.mode is FlowTemplateMode.DAG):
+            self.integrity_checker.verify_dag_task_integrity(task)
+        else:
+            self.integrity_checker.verify_tasks_integrity(task)
         self.tasks.append(task)
 
     def get_task(self, index: int) -> Task:
@@ -128,7 +532,96 @@ class FlowTemplate:
 
         return self.tasks[index]
 
+    def compile(self) -> "ExecutionPlan":
+        return ExecutionPlan(self)
+
+class ExecutionPlan:
+    """
+        Immutable snapshot of a FlowTemplate that the FlowRunner walks when running flows.
+        Every per task lookup (task, inputs, outputs, timeout, retry policy, dependencies) is precomputed and costs O(1).
+        Task dependencies are derived from the data items: a task depends on the tasks producing its inputs, or on the previous task in LINEAR mode.
+    """
+    template_name: str
+    codec: ExecutionContextCodec
+    mode: FlowTemplateMode
+    tasks: tuple[Task, ...]
+    task_inputs: tuple[frozenset[TaskDataItem], ...]
+    task_outputs: tuple[frozenset[TaskDataItem], ...]
+    task_timeouts: tuple[float, ...]
+    task_retry_policies: tuple[RetryPolicy, ...]
+    task_dependencies: tuple[frozenset[int], ...]
+
+    def __init__(self, flow_template: FlowTemplate):
+        self.template_name = flow_template.name
+        self.codec = flow_template.codec
+        self.mode = flow_template.mode
+        self.tasks = tuple(flow_template.tasks)
+        self.task_inputs = tuple(frozenset(task.inputs()) for task in self.tasks)
+        self.task_outputs = tuple(frozenset(task.outputs()) for task in self.tasks)
+        self.task_timeouts = tuple(flow_template.task_timeout if task.timeout() is None else task.timeout() for task in self.tasks)
+        self.task_retry_policies = tuple(flow_template.retry_policy if task.retry_policy() is None else task.retry_policy() for task in self.tasks)
+
+        if(self.mode is FlowTemplateMode.DAG):
+            data_item_producers = {output_item: index for (index, outputs) in enumerate(self.task_outputs) for output_item in outputs}
+            self.task_dependencies = tuple(frozenset(data_item_producers[input_item] for input_item in inputs if input_item in data_item_producers)
+                                           for inputs in self.task_inputs)
+            self.__check_task_dependencies()
+        else:
+            self.task_dependencies = tuple(frozenset() if index == 0 else frozenset([index - 1]) for index in range(len(self.tasks)))
+
+    def __check_task_dependencies(self) -> None:
+        """
+            Walks the tasks in topological order, which only reaches every task when the dependencies have no cycle
+        """
+        dependents = [[] for _ in self.tasks]
+        pending_dependencies = [len(dependencies) for dependencies in self.task_dependencies]
+        for (index, dependencies) in enumerate(self.task_dependencies):
+            for dependency in dependencies:
+                dependents[dependency].append(index)
+
+        ready_tasks = [index for (index, count) in enumerate(pending_dependencies) if count == 0]
+        sorted_task_count = 0
+
+        while ready_tasks:
+            index = ready_tasks.pop()
+            sorted_task_count += 1
+
+            for dependent in dependents[index]:
+                pending_dependencies[dependent] -= 1
+                if pending_dependencies[dependent] == 0:
+                    ready_tasks.append(dependent)
+
+        if sorted_task_count != len(self.tasks):
+            raise ValueError(f"Flow template {self.template_name} tasks have circular data dependencies")
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def get_task(self, index: int) -> Task:
+        if(index >= len(self.tasks)):
+            return None
+
+        return self.tasks[index]
+
+    def get_task_timeout(self, index: int) -> float:
+        return self.task_timeouts[index]
+
+    def get_retry_policy(self, index: int) -> RetryPolicy:
+        return self.task_retry_policies[index]
+
+    def is_dag(self) -> bool:
+        return self.mode is FlowTemplateMode.DAG
+
+    def get_ready_tasks(self, completed_tasks: frozenset[int], started_tasks: set[int]) -> list[int]:
+        """
+            Tasks that didn't start yet and whose dependencies all completed
+        """
+        return [index for (index, dependencies) in enumerate(self.task_dependencies)
+                    if index not in completed_tasks and index not in started_tasks and dependencies <= completed_tasks]
+
 class TaskExecution:
+    __slots__ = ("flow_execution_id", "flow_execution_step", "name", "status", "output", "timestamp")
+
     flow_execution_id: int
     flow_execution_step: int
     name: str
@@ -147,7 +640,41 @@ class TaskExecution:
     def __repr__(self) -> str:
         return f"{self.flow_execution_id} - {self.flow_execution_step} - {self.name} - '{self.output}' - '{self.status}' - {datetime.fromtimestamp(self.timestamp, tz= None)}"
 
+class FlowSummary:
+    """
+        What is kept of the history of a compacted flow, besides its final history row
+    """
+    __slots__ = ("execution_id", "template_name", "status", "steps", "task_executions", "created_at", "finished_at", "archive_file_name")
+
+    execution_id: int
+    template_name: str
+    status: FlowStatus
+    steps: int
+    task_executions: int
+    created_at: float
+    finished_at: float
+    archive_file_name: str
+
+    def __init__(self):
+        self.execution_id = None
+        self.template_name = None
+        self.status = None
+        self.steps = 0
+        self.task_executions = 0
+        self.created_at = None
+        self.finished_at = None
+        self.archive_file_name = None
+
+    def __repr__(self) -> str:
+        return f"{self.template_name} - {self.execution_id} - '{self.status}' - {self.steps} steps - {self.task_executions} task executions"
+
 class FlowExecution:
+    """
+        Flows are copied on every status change and tens of thousands of them can be in flight, hence the slots
+    """
+    __slots__ = ("execution_id", "template_name", "status", "execution_step", "current_task_index", "execution_context", "timestamp",
+                 "priority", "context_codec", "completed_tasks", "attempt", "not_before")
+
     execution_id: int
     template_name: str
     status: FlowStatus
@@ -155,15 +682,44 @@ class FlowExecution:
     current_task_index: int
     execution_context: ExecutionContext
     timestamp: float
+    priority: int
+    context_codec: ExecutionContextCodec
+    completed_tasks: frozenset[int]
+    # Number of times the flow was run, and the time before which a queued flow must not be run, None to run it right away
+    attempt: int
+    not_before: float
          
-    def __init__(self):
+    def __init__(self, execution_context: ExecutionContext = None):
         self.template_name = "" 
         self.execution_id = -1
         self.execution_step = 0
         self.status = None
         self.current_task_index = -1
-        self.execution_context = ExecutionContext()
+        self.execution_context = ExecutionContext() if execution_context is None else execution_context
         self.timestamp = None
+        self.priority = 0
+        self.context_codec = JSON_CODEC
+        self.completed_tasks = frozenset()
+        self.attempt = 0
+        self.not_before = None
+
+    def __copy__(self):
+        # Skips __init__, every slot is set right below
+        flow_execution = FlowExecution.__new__(FlowExecution)
+        flow_execution.execution_context = self.execution_context
+        flow_execution.template_name = self.template_name
+        flow_execution.execution_id = self.execution_id
+        flow_execution.execution_step = self.execution_step
+        flow_execution.status = self.status
+        flow_execution.current_task_index = self.current_task_index
+        flow_execution.timestamp = self.timestamp
+        flow_execution.priority = self.priority
+        flow_execution.context_codec = self.context_codec
+        flow_execution.completed_tasks = self.completed_tasks
+        flow_execution.attempt = self.attempt
+        flow_execution.not_before = self.not_before
+
+        return flow_execution
 
     def __repr__(self) -> str:
         return f"{self.template_name} - {self.execution_id} - {self.execution_step} - {self.current_task_index} - '{self.status}' - {datetime.fromtimestamp(self.timestamp, tz= None)}"
\ No newline at end of file
@@ -0,0 +1,217 @@
+from contextlib import nullcontext
+from enum import Enum
+from typing import Callable
+import functools
+import threading
+import time
+
+"""
+    Labels are tuples of (name, value) pairs, so that call sites with fixed labels pass a constant instead of building a dict
+"""
+Labels = tuple[tuple[str, str], ...]
+
+class MetricType(Enum):
+    COUNTER = "counter"
+    GAUGE = "gauge"
+    # Timers are exported as summaries: the number of observations and the total of the observed seconds
+    TIMER = "summary"
+
+class MetricSample:
+    name: str
+    type: MetricType
+    labels: Labels
+    value: float
+    count: int
+
+    def __init__(self, name: str, type: MetricType, labels: Labels, value: float, count: int = None):
+        self.name = name
+        self.type = type
+        self.labels = labels
+        self.value = value
+        self.count = count
+
+    def __repr__(self) -> str:
+        return f"MetricSample('{self.name}',{self.type.name},{self.labels},{self.value},{self.count})"
+
+class Metrics:
+    """
+        Disabled metrics, every method does nothing. Instrumented code checks enabled before doing any work of its own.
+    """
+    enabled: bool = False
+
+    def increment(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        pass
+
+    def observe(self, name: str, seconds: float, labels: Labels = ()) -> None:
+        pass
+
+    def set_gauge(self, name: str, value: float, labels: Labels = ()) -> None:
+        pass
+
+    def timer(self, name: str, labels: Labels = ()):
+        return _null_timer
+
+_null_timer = nullcontext()
+
+class Timer:
+    metrics: Metrics
+    name: str
+    labels: Labels
+    start: float
+
+    def __init__(self, metrics: Metrics, name: str, labels: Labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.metrics.observe(self.name, time.perf_counter() - self.start, self.labels)
+
+class MetricsRegistry(Metrics):
+    """
+        In memory counters, gauges and timers keyed by name and labels.
+
+        Collectors are called on every snapshot to set gauges whose value is only worth computing when read, e.g. queue depths.
+        Exporters receive the snapshot every time export() is called; to_prometheus_text() renders it in the Prometheus text format.
+    """
+    enabled = True
+    counters: dict[tuple[str, Labels], float]
+    gauges: dict[tuple[str, Labels], float]
+    timers: dict[tuple[str, Labels], list]
+    collectors: list[Callable[["MetricsRegistry"], None]]
+    exporters: list[Callable[[list[MetricSample]], None]]
+    lock: threading.Lock
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+        self.collectors = []
+        self.exporters = []
+        self.lock = threading.Lock()
+
+    def increment(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, labels: Labels = ()) -> None:
+        key = (name, labels)
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [1, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+
+    def set_gauge(self, name: str, value: float, labels: Labels = ()) -> None:
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def timer(self, name: str, labels: Labels = ()) -> Timer:
+        return Timer(self, name, labels)
+
+    def add_collector(self, collector: Callable[["MetricsRegistry"], None]) -> None:
+        self.collectors.append(collector)
+
+    def add_exporter(self, exporter: Callable[[list[MetricSample]], None]) -> None:
+        self.exporters.append(exporter)
+
+    def snapshot(self) -> list[MetricSample]:
+        for collector in list(self.collectors):
+            collector(self)
+
+        with self.lock:
+            samples = [MetricSample(name, MetricType.COUNTER, labels, value) for ((name, labels), value) in self.counters.items()]
+            samples.extend(MetricSample(name, MetricType.GAUGE, labels, value) for ((name, labels), value) in self.gauges.items())
+            samples.extend(MetricSample(name, MetricType.TIMER, labels, total, count) for ((name, labels), (count, total)) in self.timers.items())
+
+        return sorted(samples, key=lambda sample: (sample.name, sample.labels))
+
+    def export(self) -> list[MetricSample]:
+        samples = self.snapshot()
+        for exporter in list(self.exporters):
+            exporter(samples)
+
+        return samples
+
+    def to_prometheus_text(self) -> str:
+        return format_prometheus_text(self.snapshot())
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+
+def format_prometheus_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+
+    escaped_labels = []
+    for (name, value) in labels:
+        escaped_value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        escaped_labels.append(f"{name}=\"{escaped_value}\"")
+
+    return "{" + ",".join(escaped_labels) + "}"
+
+def format_prometheus_text(samples: list[MetricSample]) -> str:
+    lines = []
+    typed_names = set()
+
+    for sample in samples:
+        if sample.name not in typed_names:
+            lines.append(f"# TYPE {sample.name} {sample.type.value}")
+            typed_names.add(sample.name)
+
+        labels = format_prometheus_labels(sample.labels)
+        if sample.type is MetricType.TIMER:
+            lines.append(f"{sample.name}_count{labels} {sample.count}")
+            lines.append(f"{sample.name}_sum{labels} {sample.value!r}")
+        else:
+            lines.append(f"{sample.name}{labels} {float(sample.value)!r}")
+
+    return "\n".join(lines) + "\n"
+
+NULL_METRICS = Metrics()
+
+_metrics: Metrics = NULL_METRICS
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+def enable_metrics(registry: MetricsRegistry = None) -> MetricsRegistry:
+    """
+        Instruments the runners, the repositories and the codecs of the process with the registry, a new one if none is given
+    """
+    global _metrics
+    _metrics = registry if registry is not None else MetricsRegistry()
+
+    return _metrics
+
+def disable_metrics() -> None:
+    global _metrics
+    _metrics = NULL_METRICS
+
+def timed(name: str, labels: Labels = ()):
+    """
+        Times every call of the decorated function. While metrics are disabled the only overhead is the enabled check.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = _metrics
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+
+            with metrics.timer(name, labels):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,47 +1,551 @@
+from contextlib import contextmanager
 from sqlite3 import Error
+import functools
+import hashlib
+import os
 import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable, Iterable, Iterator
 
-from src.model.flow import ExecutionContext, FlowExecution, FlowStatus, PersistenceMode, TaskExecution, TaskStatus
+from src.model.codec import BLOB_REFERENCE_MARKER, BlobReference, ExecutionContextCodec, apply_context_delta, decode_payload, diff_contexts, encode_payload, get_payload_codec
+from src.model.flow import Durability, ExecutionContext, FlowExecution, FlowStatus, FlowSummary, PersistenceMode, TaskExecution, TaskStatus
+from src.model.metrics import get_metrics, timed
 
 DEFAULT_PERSISTENT_STORAGE_FILENAME: str = "flow_store.db"
+DEFAULT_SNAPSHOT_INTERVAL: int = 16
+DEFAULT_BLOB_THRESHOLD: int = 64 * 1024
+DEFAULT_GROUP_COMMIT_SIZE: int = 64
+DEFAULT_GROUP_COMMIT_INTERVAL: float = 0.05
+DEFAULT_PAGE_SIZE: int = 500
+DEFAULT_COMPACTION_BATCH_SIZE: int = 100
+DEFAULT_IDLE_READER_COUNT: int = 8
+SCHEMA_DEFINITION_FILENAME: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+LEGACY_SCHEMA_DEFINITION_FILENAME: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "legacy_schema.sql")
+
+_queued_flow_statuses = (FlowStatus.SCHEDULED, FlowStatus.RESCHEDULED)
 
 _db_names = {
         PersistenceMode.TRANSIENT : ":memory:",
         PersistenceMode.PERSISTENT : DEFAULT_PERSISTENT_STORAGE_FILENAME
 }
 
+TRANSIENT_DB_NAME: str = _db_names[PersistenceMode.TRANSIENT]
+
+class WriterLock:
+    """
+        Reentrant lock that knows whether the calling thread holds it
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._owner = None
+        self._depth = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._owner = threading.get_ident()
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._depth -= 1
+        if(self._depth == 0):
+            self._owner = None
+        self._lock.release()
+
+    def is_owned(self) -> bool:
+        return self._owner == threading.get_ident()
+
+def synchronized(method):
+    """
+        Serializes the access to the writer connection so that a repository can be used from several threads
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+def timed_query(method):
+    """
+        Times the calls of the query method, labelled with its name, while metrics are enabled
+    """
+    return timed("flow_repository_query_seconds", (("query", method.__name__),))(method)
+
+def iterate_pages(get_page: Callable[[object], tuple[list, object]]) -> Iterator:
+    """
+        Lazily walks a keyset paginated query, only one page is held in memory and no lock or read transaction is kept between pages
+    """
+    next_page_cursor = None
+    while True:
+        (items, next_page_cursor) = get_page(next_page_cursor)
+        yield from items
+
+        if(next_page_cursor is None):
+            return
+
+def add_blob_hashes(value, blob_hashes: set[str]) -> None:
+    if isinstance(value, BlobReference):
+        blob_hashes.add(value.hash)
+    elif isinstance(value, dict):
+        for item in value.values():
+            add_blob_hashes(item, blob_hashes)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            add_blob_hashes(item, blob_hashes)
+
+def collect_blob_hashes(payloads: Iterable) -> set[str]:
+    """
+        Hashes of the blobs referenced by stored context payloads, snapshots or deltas. JSON payloads without the reference marker aren't decoded.
+    """
+    blob_hashes = set()
+    for payload in payloads:
+        if(payload is None or (isinstance(payload, str) and BLOB_REFERENCE_MARKER not in payload)):
+            continue
+
+        add_blob_hashes(decode_payload(payload), blob_hashes)
+
+    return blob_hashes
+
+def archive_payload(payload, compress: bool):
+    if(not compress or payload is None):
+        return payload
+
+    return zlib.compress(payload.encode("utf8") if isinstance(payload, str) else payload)
+
 class FlowRepository:
     current_db_name = None
     
 
     connection = None
+    lock = None
+    idle_readers = None
+    reader_connections = None
+    readers_lock = None
+
+    durability: Durability = Durability.FULL
+    group_commit_size: int = DEFAULT_GROUP_COMMIT_SIZE
+    group_commit_interval: float = DEFAULT_GROUP_COMMIT_INTERVAL
+
+    snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL
+    blob_threshold: int = DEFAULT_BLOB_THRESHOLD
+
+    attached_archive_file_name: str = None
+
+    transaction_depth: int = 0
+    pending_units: int = 0
+    first_pending_unit_time: float = None
+    group_commit_timer: threading.Timer = None
+
+    schema_definition: str = None
+    legacy_schema_definition: str = None
+    schema_fingerprint: str = None
+
+    _durability_pragmas = {
+        Durability.FULL : ("WAL", "FULL"),
+        Durability.WAL : ("WAL", "NORMAL"),
+        Durability.GROUP_COMMIT : ("WAL", "NORMAL")
+    }
+
+    """
+    SCHEMA QUERIES
+    """
+    select_schema_fingerprint_query = """
+                    SELECT fingerprint FROM schema_fingerprint WHERE id = 0
+                    """
+
+    replace_schema_fingerprint_query = """
+                    INSERT OR REPLACE INTO schema_fingerprint(id, fingerprint) VALUES (0, ?)
+                    """
+
+    select_is_storage_new_query = """
+                    SELECT NOT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'flow_executions')
+                    """
 
     """
     FLOW QUERIES
     """
-    select_current_execution_id_query = """
-                           SELECT MAX(execution_id)
-                           FROM flow_executions
-                           """
+    reserve_execution_ids_query = """
+                    UPDATE flow_sequences SET next_id = next_id + ?
+                    WHERE name = 'flow_execution'
+                    RETURNING next_id
+                    """
+
+    reset_execution_ids_query = """
+                    UPDATE flow_sequences SET next_id = 1
+                    WHERE name = 'flow_execution'
+                    """
     
     insert_flow_query = """
-                        INSERT INTO flow_executions(execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp)
-                        VALUES (?,?,?,?,?,?,?) RETURNING *;
+                        INSERT INTO flow_executions(execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp, context_is_delta, completed_tasks)
+                        VALUES (?,?,?,?,?,?,?,?,?) RETURNING *;
                         """
 
+    upsert_flow_state_query = """
+                    INSERT INTO flow_states(execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp, priority, deltas_since_snapshot, completed_tasks,
+                                            attempt, not_before)
+                        VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+                    ON CONFLICT(execution_id) DO UPDATE SET
+                        deltas_since_snapshot = excluded.deltas_since_snapshot,
+                        execution_step = excluded.execution_step,
+                        status = excluded.status,
+                        template_name = excluded.template_name,
+                        current_task_index = excluded.current_task_index,
+                        execution_context = excluded.execution_context,
+                        timestamp = excluded.timestamp,
+                        priority = excluded.priority,
+                        completed_tasks = excluded.completed_tasks,
+                        attempt = excluded.attempt,
+                        not_before = excluded.not_before
+                    RETURNING execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp, priority, completed_tasks, attempt, not_before;
+                    """
+
     select_get_flow_query = """
-                    WITH max_row_id AS (SELECT MAX(rowid) AS max FROM flow_executions WHERE execution_id = ?)
-                    SELECT * FROM flow_executions, max_row_id WHERE rowid = max_row_id.max
+                    SELECT execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp, priority, completed_tasks, attempt, not_before
+                    FROM flow_states WHERE execution_id = ?
+                    """
+
+    select_flow_context_state_query = """
+                    SELECT execution_context, deltas_since_snapshot FROM flow_states WHERE execution_id = ?
+                    """
+
+    """
+        Keyset pagination over the latest flow states in (timestamp, execution_id) order, every filter is backed by an index
+    """
+    select_flow_page_query = """
+                    SELECT execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp, priority, completed_tasks, attempt, not_before
+                    FROM flow_states WHERE {filters} ORDER BY timestamp, execution_id LIMIT ?
+                    """
+
+    flow_page_filters = {
+        "status" : "status = ?",
+        "template_name" : "template_name = ?",
+        "since" : "timestamp >= ?",
+        "until" : "timestamp < ?",
+        "after" : "(timestamp, execution_id) > (?, ?)"
+    }
+
+    select_flow_history_query = """
+                    SELECT execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp, context_is_delta, completed_tasks
+                    FROM flow_executions WHERE execution_id = ? ORDER BY rowid
+                    """
+
+    """
+    BLOB QUERIES
+    """
+    insert_blob_query = """
+                    INSERT OR IGNORE INTO context_blobs(hash, data, size) VALUES (?,?,?)
+                    """
+
+    select_blob_query = """
+                    SELECT data FROM context_blobs WHERE hash = ?
+                    """
+
+    select_blob_hashes_query = """
+                    SELECT hash FROM context_blobs
+                    """
+
+    select_blob_referencing_payloads_query = """
+                    SELECT execution_context FROM flow_executions
+                    UNION ALL SELECT execution_context FROM flow_states
+                    UNION ALL SELECT output_context FROM task_memos
+                    """
+
+    delete_blob_query = """
+                    DELETE FROM context_blobs WHERE hash = ?
+                    """
+
+    delete_all_blob_data_query = """
+                    DELETE FROM context_blobs
+                    """
+
+    """
+    SCHEMA MIGRATIONS
+    Applied in order on top of legacy_schema.sql, the number of applied migrations is tracked in PRAGMA user_version.
+    New storages are created from schema.sql, which already matches the last migration.
+    """
+    schema_migrations = [
+        """
+        ALTER TABLE flow_executions ADD COLUMN context_is_delta integer NOT NULL DEFAULT 0;
+        ALTER TABLE flow_states ADD COLUMN deltas_since_snapshot integer NOT NULL DEFAULT 0;
+        """,
+        """
+        ALTER TABLE flow_executions ADD COLUMN completed_tasks text;
+        ALTER TABLE flow_states ADD COLUMN completed_tasks text;
+        """,
+        # Statuses are stored as the value of their enum instead of its name, SQLite can only change the column types by rebuilding the tables
+        """
+        CREATE TABLE flow_executions_migrated(
+                execution_id integer NOT NULL,
+                execution_step integer NOT NULL,
+                status integer,
+                template_name text,
+                current_task_index integer,
+                execution_context text,
+                timestamp integer,
+                context_is_delta integer NOT NULL DEFAULT 0,
+                completed_tasks text,
+                PRIMARY KEY(execution_id, execution_step)
+                );
+        INSERT INTO flow_executions_migrated(rowid, execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp, context_is_delta, completed_tasks)
+                SELECT rowid, execution_id, execution_step, CASE status WHEN 'CREATED' THEN 0 WHEN 'SCHEDULED' THEN 1 WHEN 'RUNNING' THEN 2 WHEN 'FAILED' THEN 3 WHEN 'SUCCEEDED' THEN 4 WHEN 'RESCHEDULED' THEN 5 ELSE status END,
+                    template_name, current_task_index, execution_context, timestamp, context_is_delta, completed_tasks
+                FROM flow_executions;
+        DROP TABLE flow_executions;
+        ALTER TABLE flow_executions_migrated RENAME TO flow_executions;
+
+        CREATE TABLE task_executions_migrated(
+                flow_execution_id integer,
+                flow_execution_step integer,
+                status integer,
+                output text,
+                timestamp integer,
+                FOREIGN KEY (flow_execution_id, flow_execution_step) REFERENCES flow_executions(execution_id, execution_step)
+                );
+        INSERT INTO task_executions_migrated(rowid, flow_execution_id, flow_execution_step, status, output, timestamp)
+                SELECT rowid, flow_execution_id, flow_execution_step, CASE status WHEN 'RUNNING' THEN 1 WHEN 'FAILED' THEN 2 WHEN 'SUCCEEDED' THEN 3 ELSE status END, output, timestamp
+                FROM task_executions;
+        DROP TABLE task_executions;
+        ALTER TABLE task_executions_migrated RENAME TO task_executions;
+        CREATE INDEX task_executions_flow_idx ON task_executions(flow_execution_id);
+
+        CREATE TABLE flow_states_migrated(
+                execution_id integer PRIMARY KEY,
+                execution_step integer NOT NULL,
+                status integer,
+                template_name text,
+                current_task_index integer,
+                execution_context text,
+                timestamp integer,
+                priority integer NOT NULL DEFAULT 0,
+                deltas_since_snapshot integer NOT NULL DEFAULT 0,
+                completed_tasks text
+                );
+        INSERT INTO flow_states_migrated(execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp, priority, deltas_since_snapshot, completed_tasks)
+                SELECT execution_id, execution_step, CASE status WHEN 'CREATED' THEN 0 WHEN 'SCHEDULED' THEN 1 WHEN 'RUNNING' THEN 2 WHEN 'FAILED' THEN 3 WHEN 'SUCCEEDED' THEN 4 WHEN 'RESCHEDULED' THEN 5 ELSE status END,
+                    template_name, current_task_index, execution_context, timestamp, priority, deltas_since_snapshot, completed_tasks
+                FROM flow_states;
+        DROP TABLE flow_states;
+        ALTER TABLE flow_states_migrated RENAME TO flow_states;
+        CREATE INDEX flow_states_status_timestamp_idx ON flow_states(status, timestamp);
+        CREATE INDEX flow_states_template_timestamp_idx ON flow_states(template_name, timestamp);
+        CREATE INDEX flow_states_timestamp_idx ON flow_states(timestamp);
+
+        CREATE TABLE flow_ready_queue_migrated(
+                execution_id integer PRIMARY KEY,
+                status integer NOT NULL,
+                priority integer NOT NULL DEFAULT 0,
+                enqueued_at real NOT NULL
+                );
+        INSERT INTO flow_ready_queue_migrated(execution_id, status, priority, enqueued_at)
+                SELECT execution_id, CASE status WHEN 'CREATED' THEN 0 WHEN 'SCHEDULED' THEN 1 WHEN 'RUNNING' THEN 2 WHEN 'FAILED' THEN 3 WHEN 'SUCCEEDED' THEN 4 WHEN 'RESCHEDULED' THEN 5 ELSE status END, priority, enqueued_at
+                FROM flow_ready_queue;
+        DROP TABLE flow_ready_queue;
+        ALTER TABLE flow_ready_queue_migrated RENAME TO flow_ready_queue;
+        CREATE INDEX flow_ready_queue_order_idx ON flow_ready_queue(status, priority DESC, enqueued_at, execution_id);
+
+        CREATE TABLE flow_summaries_migrated(
+                execution_id integer PRIMARY KEY,
+                template_name text,
+                status integer,
+                steps integer NOT NULL,
+                task_executions integer NOT NULL,
+                created_at real,
+                finished_at real,
+                archive_file_name text
+                );
+        INSERT INTO flow_summaries_migrated(execution_id, template_name, status, steps, task_executions, created_at, finished_at, archive_file_name)
+                SELECT execution_id, template_name, CASE status WHEN 'CREATED' THEN 0 WHEN 'SCHEDULED' THEN 1 WHEN 'RUNNING' THEN 2 WHEN 'FAILED' THEN 3 WHEN 'SUCCEEDED' THEN 4 WHEN 'RESCHEDULED' THEN 5 ELSE status END,
+                    steps, task_executions, created_at, finished_at, archive_file_name
+                FROM flow_summaries;
+        DROP TABLE flow_summaries;
+        ALTER TABLE flow_summaries_migrated RENAME TO flow_summaries;
+        """,
+        """
+        ALTER TABLE flow_states ADD COLUMN attempt integer NOT NULL DEFAULT 0;
+        ALTER TABLE flow_states ADD COLUMN not_before real;
+        ALTER TABLE flow_ready_queue ADD COLUMN not_before real;
+        """,
+    ]
+
+    """
+    READY QUEUE QUERIES
+    """
+    enqueue_flow_query = """
+                    INSERT INTO flow_ready_queue(execution_id, status, priority, enqueued_at, not_before)
+                        VALUES (?,?,?,?,?)
+                    ON CONFLICT(execution_id) DO UPDATE SET
+                        status = excluded.status,
+                        priority = excluded.priority,
+                        enqueued_at = excluded.enqueued_at,
+                        not_before = excluded.not_before;
+                    """
+
+    dequeue_flow_query = """
+                    DELETE FROM flow_ready_queue WHERE execution_id = ?
                     """
 
     select_get_candidate_flow_id = """
-                    WITH min_row_id AS (SELECT MIN(rowid) AS min FROM flow_executions WHERE status = ?)
-                    SELECT * FROM flow_executions, min_row_id WHERE rowid = min_row_id.min
+                    SELECT execution_id FROM flow_ready_queue
+                    WHERE status = ? AND (not_before IS NULL OR not_before <= ?)
+                    ORDER BY priority DESC, enqueued_at, execution_id
+                    LIMIT 1
                     """
+
+    select_next_not_before_query = """
+                    SELECT MIN(not_before) FROM flow_ready_queue WHERE not_before > ?
+                    """
+
+    delete_all_queue_data_query = """
+                    DELETE FROM flow_ready_queue
+                    """
+
     delete_all_flow_data_query = """
                     DELETE FROM flow_executions
                     """
 
+    delete_all_flow_state_data_query = """
+                    DELETE FROM flow_states
+                    """
+
+    """
+    LEASE QUERIES
+    """
+    claim_candidate_flow_query = """
+                    INSERT INTO flow_leases(execution_id, owner, expires_at)
+                    SELECT candidate.execution_id, ?, ?
+                    FROM flow_ready_queue AS candidate
+                    WHERE candidate.status = ?
+                        AND (candidate.not_before IS NULL OR candidate.not_before <= ?)
+                        AND NOT EXISTS (SELECT 1 FROM flow_leases WHERE execution_id = candidate.execution_id AND expires_at > ?)
+                    ORDER BY candidate.priority DESC, candidate.enqueued_at, candidate.execution_id
+                    LIMIT 1
+                    ON CONFLICT(execution_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                    RETURNING execution_id
+                    """
+
+    release_flow_lease_query = """
+                    DELETE FROM flow_leases WHERE execution_id = ? AND owner = ?
+                    """
+
+    delete_all_lease_data_query = """
+                    DELETE FROM flow_leases
+                    """
+
+    """
+    COMPACTION QUERIES
+    """
+    select_compaction_candidates_query = """
+                    SELECT execution_id, timestamp FROM flow_states
+                    WHERE status = ? AND timestamp < ? AND (timestamp, execution_id) > (?, ?)
+                        AND NOT EXISTS (SELECT 1 FROM flow_summaries WHERE flow_summaries.execution_id = flow_states.execution_id)
+                    ORDER BY timestamp, execution_id LIMIT ?
+                    """
+
+    insert_flow_summary_query = """
+                    INSERT INTO flow_summaries(execution_id, template_name, status, steps, task_executions, created_at, finished_at, archive_file_name)
+                        SELECT execution_id, template_name, status,
+                            (SELECT COUNT(*) FROM flow_executions WHERE flow_executions.execution_id = flow_states.execution_id),
+                            (SELECT COUNT(*) FROM task_executions WHERE task_executions.flow_execution_id = flow_states.execution_id),
+                            (SELECT MIN(timestamp) FROM flow_executions WHERE flow_executions.execution_id = flow_states.execution_id),
+                            timestamp, ?
+                        FROM flow_states WHERE execution_id = ?
+                    """
+
+    """
+        The final history row may be a delta, it becomes a full snapshot since the rows it builds upon are removed
+    """
+    update_final_flow_snapshot_query = """
+                    UPDATE flow_executions SET context_is_delta = 0,
+                        execution_context = (SELECT execution_context FROM flow_states WHERE flow_states.execution_id = flow_executions.execution_id)
+                    WHERE execution_id = ? AND execution_step = (SELECT execution_step FROM flow_states WHERE execution_id = ?)
+                    """
+
+    reset_flow_state_deltas_query = """
+                    UPDATE flow_states SET deltas_since_snapshot = 0 WHERE execution_id = ?
+                    """
+
+    delete_compacted_flow_history_query = """
+                    DELETE FROM flow_executions
+                    WHERE execution_id = ? AND execution_step < (SELECT execution_step FROM flow_states WHERE execution_id = ?)
+                    """
+
+    delete_compacted_task_history_query = """
+                    DELETE FROM task_executions WHERE flow_execution_id = ?
+                    """
+
+    select_flow_summary_query = """
+                    SELECT execution_id, template_name, status, steps, task_executions, created_at, finished_at, archive_file_name
+                    FROM flow_summaries WHERE execution_id = ?
+                    """
+
+    delete_all_flow_summary_data_query = """
+                    DELETE FROM flow_summaries
+                    """
+
+    attach_archive_query = """
+                    ATTACH DATABASE ? AS flow_archive
+                    """
+
+    detach_archive_query = """
+                    DETACH DATABASE flow_archive
+                    """
+
+    create_archive_schema_query = """
+                    CREATE TABLE IF NOT EXISTS flow_archive.flow_executions(
+                        execution_id integer NOT NULL,
+                        execution_step integer NOT NULL,
+                        status integer,
+                        template_name text,
+                        current_task_index integer,
+                        execution_context blob,
+                        timestamp integer,
+                        context_is_delta integer NOT NULL,
+                        completed_tasks text,
+                        compressed integer NOT NULL,
+                        PRIMARY KEY(execution_id, execution_step)
+                        );
+
+                    CREATE TABLE IF NOT EXISTS flow_archive.task_executions(
+                        flow_execution_id integer,
+                        flow_execution_step integer,
+                        status integer,
+                        output text,
+                        timestamp integer
+                        );
+
+                    CREATE INDEX IF NOT EXISTS flow_archive.task_executions_flow_idx ON task_executions(flow_execution_id);
+
+                    CREATE TABLE IF NOT EXISTS flow_archive.context_blobs(
+                        hash text PRIMARY KEY,
+                        data blob NOT NULL,
+                        size integer NOT NULL
+                        );
+                    """
+
+    select_archived_flow_payloads_query = """
+                    SELECT execution_context FROM main.flow_executions WHERE execution_id = ?
+                    """
+
+    archive_blob_query = """
+                    INSERT OR IGNORE INTO flow_archive.context_blobs(hash, data, size)
+                        SELECT hash, data, size FROM main.context_blobs WHERE hash = ?
+                    """
+
+    archive_flow_history_query = """
+                    INSERT OR REPLACE INTO flow_archive.flow_executions(execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp, context_is_delta, completed_tasks, compressed)
+                        SELECT execution_id, execution_step, status, template_name, current_task_index, archive_payload(execution_context, ?), timestamp, context_is_delta, completed_tasks, ?
+                        FROM main.flow_executions WHERE execution_id = ?
+                    """
+
+    archive_task_history_query = """
+                    INSERT INTO flow_archive.task_executions(flow_execution_id, flow_execution_step, status, output, timestamp)
+                        SELECT flow_execution_id, flow_execution_step, status, output, timestamp
+                        FROM main.task_executions WHERE flow_execution_id = ? ORDER BY rowid
+                    """
+
     """
     TASK QUERIES
     """
@@ -54,61 +558,292 @@ class FlowRepository:
                     SELECT * FROM task_executions WHERE flow_execution_id = ? ORDER BY rowid
                     """
     
+    select_flow_task_execution_page_query = """
+                    SELECT rowid, * FROM task_executions WHERE flow_execution_id = ? AND rowid > ? ORDER BY rowid LIMIT ?
+                    """
+
     delete_all_task_data_query = """
                     DELETE FROM task_executions
                     """
 
+    """
+    CHECKPOINT AND MEMO QUERIES
+    """
+    upsert_task_checkpoint_query = """
+                    INSERT INTO task_checkpoints(execution_id, task_index, state, timestamp) VALUES (?,?,?,?)
+                    ON CONFLICT(execution_id, task_index) DO UPDATE SET
+                        state = excluded.state,
+                        timestamp = excluded.timestamp
+                    """
+
+    select_task_checkpoint_query = """
+                    SELECT state FROM task_checkpoints WHERE execution_id = ? AND task_index = ?
+                    """
+
+    delete_flow_task_checkpoints_query = """
+                    DELETE FROM task_checkpoints WHERE execution_id = ?
+                    """
+
+    delete_all_task_checkpoint_data_query = """
+                    DELETE FROM task_checkpoints
+                    """
+
+    insert_task_memo_query = """
+                    INSERT OR REPLACE INTO task_memos(input_hash, output_context, timestamp) VALUES (?,?,?)
+                    """
+
+    select_task_memo_query = """
+                    SELECT output_context FROM task_memos WHERE input_hash = ?
+                    """
+
+    delete_task_memos_query = """
+                    DELETE FROM task_memos WHERE timestamp < ?
+                    """
+
+    delete_all_task_memo_data_query = """
+                    DELETE FROM task_memos
+                    """
+
+    select_flow_status_stats_query = """
+                    SELECT status, COUNT(*), MIN(timestamp) FROM flow_states GROUP BY status
+                    """
+
+    select_data_version_query = """
+                    PRAGMA data_version
+                    """
+
     @classmethod
-    def from_persistence_mode(cls, persistence_mode: PersistenceMode):
+    def from_persistence_mode(cls, persistence_mode: PersistenceMode, durability: Durability = Durability.FULL):
         current_db_name = _db_names.get(persistence_mode)
             
         if(current_db_name is None):
             raise ValueError(f"There is no configured database name for ${persistence_mode} persistence mode")
 
-        return cls(current_db_name)
+        return cls(current_db_name, durability)
 
-    def __init__(self, storage_file_name: str):
+    def __init__(self, storage_file_name: str, durability: Durability = Durability.FULL):
         self.current_db_name = storage_file_name
+        self.lock = WriterLock()
+        self.idle_readers = []
+        self.reader_connections = set()
+        self.readers_lock = threading.Lock()
 
         try:
-            self.connection = sqlite3.connect(self.current_db_name)
+            self.connection = self.__connect()
             self.create_schema()
+            self.set_durability(durability)
         except Error as error:
             message = f"Error connecting to database: '{self.__extract_error_message(error)}'"
             raise Exception(message)
     
+    @synchronized
     def refresh(self):
         try:
-            self.connection = sqlite3.connect(self.current_db_name)
+            self.flush()
+            self.__close_readers()
+            self.connection = self.__connect()
+            self.attached_archive_file_name = None
+            self.set_durability(self.durability, self.group_commit_size, self.group_commit_interval)
         except Error as error:
             message = f"Error refreshing connection: '{self.__extract_error_message(error)}'"
             raise Exception(message)
 
+    @synchronized
+    def set_durability(self, durability: Durability, group_commit_size: int = DEFAULT_GROUP_COMMIT_SIZE, group_commit_interval: float = DEFAULT_GROUP_COMMIT_INTERVAL) -> None:
+        if(group_commit_size < 1):
+            raise ValueError(f"Group commit size must be at least 1, got {group_commit_size}")
+
+        # The journal mode can't be changed while a transaction, or another connection, is open
+        self.flush()
+        self.__close_readers()
+
+        (journal_mode, synchronous) = self._durability_pragmas[durability]
+        self.connection.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.connection.execute(f"PRAGMA synchronous={synchronous}")
+
+        self.durability = durability
+        self.group_commit_size = group_commit_size
+        self.group_commit_interval = group_commit_interval
+
+    @contextmanager
+    def read_connection(self):
+        """
+            Storage files are read through a pool of reader connections so that readers never wait for the writer (nor block it, thanks to WAL).
+            A reader is only held for the with block, then reused by the next read of any thread, at most DEFAULT_IDLE_READER_COUNT of them are kept open.
+            The writer connection is used instead when reads must see uncommitted writes of this repository:
+            within a unit of work, with group commit, or for an in memory storage which can't be shared between connections.
+        """
+        if(self.current_db_name == TRANSIENT_DB_NAME or self.durability is Durability.GROUP_COMMIT or self.lock.is_owned()):
+            with self.lock:
+                yield self.connection
+            return
+
+        reader = self.__acquire_reader()
+        try:
+            yield reader
+        finally:
+            self.__release_reader(reader)
+
+    def close(self) -> None:
+        with self.lock:
+            self.flush()
+            self.__close_readers()
+            self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+            Groups every write performed inside the with block in a single unit of work that is committed as a whole.
+            Units of work can be nested, only the outermost one commits. If the block raises, none of its writes are kept.
+            The repository lock is held for the whole unit so writes from other threads can't interleave with it.
+        """
+        with self.lock:
+            if(self.transaction_depth > 0):
+                self.transaction_depth += 1
+                try:
+                    yield self
+                finally:
+                    self.transaction_depth -= 1
+                return
+
+            if(not self.connection.in_transaction):
+                self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("SAVEPOINT unit_of_work")
+
+            self.transaction_depth = 1
+            try:
+                yield self
+            except BaseException:
+                self.connection.execute("ROLLBACK TO unit_of_work")
+                self.connection.execute("RELEASE unit_of_work")
+                if(self.pending_units == 0):
+                    self.connection.execute("ROLLBACK")
+                raise
+            finally:
+                self.transaction_depth = 0
+
+            self.connection.execute("RELEASE unit_of_work")
+            self.__end_unit_of_work()
+
+    @synchronized
+    def flush(self) -> None:
+        """
+            Commits the units of work that are pending because of group commit
+        """
+        if(self.transaction_depth == 0 and self.connection.in_transaction):
+            with get_metrics().timer("flow_repository_commit_seconds"):
+                self.connection.commit()
+
+        self.pending_units = 0
+        self.first_pending_unit_time = None
+
+        if(self.group_commit_timer is not None):
+            self.group_commit_timer.cancel()
+            self.group_commit_timer = None
+
+    @synchronized
+    def get_data_version(self) -> int:
+        """
+            Changes whenever another connection, from this process or another one, commits to the storage.
+            Commits made through this repository leave it unchanged.
+        """
+        return self.connection.execute(self.select_data_version_query).fetchone()[0]
+
+    @synchronized
     def create_schema(self):
         try:
+            if self.is_schema_up_to_date():
+                return
+
             cursor = self.connection.cursor()
+            is_storage_new = cursor.execute(self.select_is_storage_new_query).fetchone()[0]
 
-            with open('.\\src\\repositories\\schema.sql', 'r', encoding='utf8') as schema_definition:
-                
-                #print(schema_definition.read())
-                cursor.executescript(schema_definition.read())
+            if is_storage_new:
+                cursor.executescript(f"{self.get_schema_definition()} PRAGMA user_version = {len(self.schema_migrations)};")
+            else:
+                cursor.executescript(self.get_legacy_schema_definition())
+                self.migrate_schema()
+                # Adds the tables that came after the migrations
+                cursor.executescript(self.get_schema_definition())
 
             #cursor.execute(self.create_flow_table_query)
             #cursor.execute(self.create_task_table_query)
+            self.connection.execute(self.replace_schema_fingerprint_query, (self.get_schema_fingerprint(),))
         except Error as error:
             message = f"Error creating data schema: '{self.__extract_error_message(error)}'"
             raise Exception(message)
 
+    @classmethod
+    def get_schema_definition(cls) -> str:
+        if cls.schema_definition is None:
+            with open(SCHEMA_DEFINITION_FILENAME, 'r', encoding='utf8') as schema_definition:
+                cls.schema_definition = schema_definition.read()
+
+        return cls.schema_definition
+
+    @classmethod
+    def get_legacy_schema_definition(cls) -> str:
+        if cls.legacy_schema_definition is None:
+            with open(LEGACY_SCHEMA_DEFINITION_FILENAME, 'r', encoding='utf8') as legacy_schema_definition:
+                cls.legacy_schema_definition = legacy_schema_definition.read()
+
+        return cls.legacy_schema_definition
+
+    @classmethod
+    def get_schema_fingerprint(cls) -> str:
+        if cls.schema_fingerprint is None:
+            fingerprint = hashlib.sha256(cls.get_schema_definition().encode("utf8"))
+            fingerprint.update(cls.get_legacy_schema_definition().encode("utf8"))
+            for migration in cls.schema_migrations:
+                fingerprint.update(migration.encode("utf8"))
+            cls.schema_fingerprint = fingerprint.hexdigest()
+
+        return cls.schema_fingerprint
+
+    """
+        The schema script and the migrations only run when the storage was not already set up with the very same schema.
+        In memory storages are always new, hence always set up.
+    """
+    def is_schema_up_to_date(self) -> bool:
+        if self.current_db_name == TRANSIENT_DB_NAME:
+            return False
+
+        try:
+            row = self.connection.execute(self.select_schema_fingerprint_query).fetchone()
+        except Error:
+            # Storages created before the fingerprint table existed
+            return False
+
+        return row is not None and row[0] == self.get_schema_fingerprint()
+
+    @synchronized
+    def migrate_schema(self):
+        schema_version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+        for version in range(schema_version, len(self.schema_migrations)):
+            self.connection.executescript(f"BEGIN; {self.schema_migrations[version]} PRAGMA user_version = {version + 1}; COMMIT;")
+
+    @synchronized
     def clear_storage(self):
 
         try:
-            cursor = self.connection.cursor()
+            with self.transaction():
+                cursor = self.connection.cursor()
 
-            cursor.execute(self.delete_all_task_data_query)
-            cursor.execute(self.delete_all_flow_data_query)
+                cursor.execute(self.delete_all_lease_data_query)
+                cursor.execute(self.delete_all_queue_data_query)
+                cursor.execute(self.delete_all_task_data_query)
+                cursor.execute(self.delete_all_flow_state_data_query)
+                cursor.execute(self.delete_all_flow_data_query)
+                cursor.execute(self.delete_all_blob_data_query)
+                cursor.execute(self.delete_all_flow_summary_data_query)
+                cursor.execute(self.delete_all_task_checkpoint_data_query)
+                cursor.execute(self.delete_all_task_memo_data_query)
+                cursor.execute(self.reset_execution_ids_query)
 
-            cursor.close()
-            self.connection.commit()
+                cursor.close()
+
+            self.flush()
         except Exception as error:
             message = f"Error clearing storage: '{self.__extract_error_message(error)}'"
             raise Exception(message)
@@ -116,131 +851,697 @@ class FlowRepository:
     """
     FLOWS
     """
-    def get_max_flow_execution_id(self) -> int:
-        cursor = self.connection.cursor()
-        cursor.execute(self.select_current_execution_id_query)
+    @timed_query
+    def reserve_flow_execution_ids(self, count: int = 1) -> int:
+        """
+            Reserves a block of count consecutive execution ids and returns the first one.
+            The sequence row is updated in a write transaction, so concurrent schedulers, even in other processes, never get the same ids.
+        """
+        if(count < 1):
+            raise ValueError(f"At least one execution id must be reserved, got {count}")
 
-        rows = cursor.fetchall()
-        if(len(rows) != 1):
-            raise ValueError("Select current execution id query should only return one result!")
+        with self.transaction():
+            cursor = self.connection.cursor()
+            cursor.execute(self.reserve_execution_ids_query, (count,))
 
-        return 1 if rows[0][0] is None else rows[0][0] + 1
+            rows = cursor.fetchall()
+            if(len(rows) != 1):
+                raise ValueError("Reserve execution ids query should only return one result!")
 
+            cursor.close()
+
+        return rows[0][0] - count
+
+    @synchronized
+    @timed_query
     def save_flow(self, flow_execution: FlowExecution) -> FlowExecution:
-        flow_dao = FlowMapper.to_dao(flow_execution)
+        with self.transaction():
+            cursor = self.connection.cursor()
+
+            self.__store_blobs(cursor, flow_execution.execution_context)
+            flow_dao = FlowMapper.to_dao(flow_execution)
+
+            (history_context_payload, deltas_since_snapshot) = self.__get_history_context_payload(cursor, flow_execution, flow_dao[5])
+            context_is_delta = 1 if deltas_since_snapshot > 0 else 0
+
+            completed_tasks = FlowMapper.completed_tasks_to_dao(flow_execution)
+            cursor.execute(self.insert_flow_query, flow_dao[:5] + (history_context_payload, flow_execution.timestamp, context_is_delta, completed_tasks))
+
+            rows = cursor.fetchall()
+            if(len(rows) != 1):
+                raise ValueError("Insert flow query should only return one result!")
+
+            # Keep the latest state projection in sync with the append-only history
+            cursor.execute(self.upsert_flow_state_query, flow_dao + (flow_execution.priority, deltas_since_snapshot, completed_tasks, flow_execution.attempt, flow_execution.not_before))
+            rows = cursor.fetchall()
+
+            # Only flows waiting to be run are kept in the ready queue
+            if(flow_execution.status in _queued_flow_statuses):
+                cursor.execute(self.enqueue_flow_query, (flow_execution.execution_id, flow_execution.status.value, flow_execution.priority, flow_execution.timestamp, flow_execution.not_before))
+            else:
+                cursor.execute(self.dequeue_flow_query, (flow_execution.execution_id,))
+
+            # Nothing is left to resume once the flow is over
+            if(flow_execution.status == FlowStatus.SUCCEEDED):
+                cursor.execute(self.delete_flow_task_checkpoints_query, (flow_execution.execution_id,))
+
+            cursor.close()
+
+        return self.__with_blob_loader(FlowMapper.to_model(rows[0]))
+
+    @synchronized
+    @timed_query
+    def save_new_flows(self, flow_executions: list[FlowExecution]) -> None:
+        """
+            Stores, in a single unit of work and with one statement per table, flows that are not in the storage yet.
+            A flow can show up several times, in step order, to store its successive versions, e.g. CREATED then SCHEDULED.
+            Nothing is read back, which is what makes it suitable for enqueuing large amounts of flows.
+        """
+        history_rows = []
+        latest_states = {}
+
+        with self.transaction():
+            cursor = self.connection.cursor()
+
+            for flow_execution in flow_executions:
+                self.__store_blobs(cursor, flow_execution.execution_context)
+                flow_dao = FlowMapper.to_dao(flow_execution)
+
+                previous_state = latest_states.get(flow_execution.execution_id)
+                (history_context_payload, deltas_since_snapshot) = self.__encode_history_context_payload(
+                    flow_execution, flow_dao[5], None if previous_state is None else (previous_state[1][5], previous_state[2]))
+
+                history_rows.append(flow_dao[:5] + (history_context_payload, flow_execution.timestamp, 1 if deltas_since_snapshot > 0 else 0, FlowMapper.completed_tasks_to_dao(flow_execution)))
+                latest_states[flow_execution.execution_id] = (flow_execution, flow_dao, deltas_since_snapshot)
+
+            cursor.executemany(self.insert_flow_query, history_rows)
+            cursor.executemany(self.upsert_flow_state_query,
+                [flow_dao + (flow_execution.priority, deltas_since_snapshot, FlowMapper.completed_tasks_to_dao(flow_execution), flow_execution.attempt, flow_execution.not_before)
+                    for (flow_execution, flow_dao, deltas_since_snapshot) in latest_states.values()])
+            cursor.executemany(self.enqueue_flow_query,
+                [(flow_execution.execution_id, flow_execution.status.value, flow_execution.priority, flow_execution.timestamp, flow_execution.not_before)
+                    for (flow_execution, _, _) in latest_states.values() if flow_execution.status in _queued_flow_statuses])
+
+            cursor.close()
+
+    def __store_blobs(self, cursor: sqlite3.Cursor, execution_context: ExecutionContext) -> None:
+        """
+            Moves large binary values to the content addressed blob store, identical values are only stored once across steps and flows
+        """
+        # A context that was never decoded can't hold new values
+        if(not execution_context.is_decoded()):
+            return
+
+        large_values = [(key, value) for (key, value) in execution_context.as_dict().items()
+                            if isinstance(value, (bytes, bytearray, memoryview)) and len(value) >= self.blob_threshold]
+
+        for (key, value) in large_values:
+            blob_reference = BlobReference(hashlib.sha256(value).hexdigest(), len(value))
+            cursor.execute(self.insert_blob_query, (blob_reference.hash, value, blob_reference.size))
+            execution_context.replace_with_blob_reference(key, blob_reference)
+
+    @timed_query
+    def get_blob(self, hash: str) -> bytes:
+        with self.read_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self.select_blob_query, (hash,))
+            row = cursor.fetchone()
+            cursor.close()
 
-        cursor = self.connection.cursor()
-        cursor.execute(self.insert_flow_query, flow_dao)
+            if(row is None):
+                raise ValueError(f"Blob {hash} does not exist!")
 
-        rows = cursor.fetchall()
-        if(len(rows) != 1):
-            raise ValueError("Insert flow query should only return one result!")
+            return row[0]
 
-        cursor.close()
-       
-        self.connection.commit()
+    def __with_blob_loader(self, flow_execution: FlowExecution) -> FlowExecution:
+        flow_execution.execution_context.blob_loader = self.get_blob
+        return flow_execution
 
-        return FlowMapper.to_model(rows[0])
+    def __get_history_context_payload(self, cursor: sqlite3.Cursor, flow_execution: FlowExecution, context_payload) -> tuple[object, int]:
+        """
+            History rows only hold the key level changes since the previous step, with a full snapshot every snapshot_interval steps.
+            Returns the payload to store in the history and the number of deltas since the last snapshot (0 for a snapshot).
+        """
+        cursor.execute(self.select_flow_context_state_query, (flow_execution.execution_id,))
+        return self.__encode_history_context_payload(flow_execution, context_payload, cursor.fetchone())
+
+    def __encode_history_context_payload(self, flow_execution: FlowExecution, context_payload, previous_state: tuple) -> tuple[object, int]:
+        if(previous_state is None or previous_state[1] + 1 >= self.snapshot_interval):
+            return (context_payload, 0)
+
+        (previous_context_payload, deltas_since_snapshot) = previous_state
+        if(previous_context_payload == context_payload):
+            previous_context = current_context = {}
+        else:
+            current_context = flow_execution.execution_context.as_dict()
+            # Codecs such as JSON turn keys into strings, a delta between a decoded context and the current one only adds up for string keys
+            if(not all(isinstance(key, str) for key in current_context)):
+                return (context_payload, 0)
+
+            previous_context = decode_payload(previous_context_payload)
+
+        delta_payload = encode_payload(flow_execution.context_codec, diff_contexts(previous_context, current_context))
+
+        # A delta that isn't smaller than the context itself isn't worth it
+        if(len(delta_payload) >= len(context_payload)):
+            return (context_payload, 0)
+
+        return (delta_payload, deltas_since_snapshot + 1)
         
+    @timed_query
     def get_flow(self, execution_id: int) -> FlowExecution:
-        cursor = self.connection.cursor()
+        with self.read_connection() as connection:
+            cursor = connection.cursor()
 
-        query_param = (execution_id,)
-        cursor.execute(self.select_get_flow_query, query_param)
-        rows = cursor.fetchall()
+            query_param = (execution_id,)
+            cursor.execute(self.select_get_flow_query, query_param)
+            rows = cursor.fetchall()
 
-        if(len(rows) == 0):
-            return None
+            if(len(rows) == 0):
+                return None
 
-        if(len(rows) > 1):
-            raise ValueError("Select get flow query should only return one result!")
+            if(len(rows) > 1):
+                raise ValueError("Select get flow query should only return one result!")
         
-        return FlowMapper.to_model(rows[0])
+            return self.__with_blob_loader(FlowMapper.to_model(rows[0]))
+
+    @timed_query
+    def get_flow_status_stats(self) -> dict[FlowStatus, tuple[int, float]]:
+        """
+            Number of flows and timestamp of the oldest change, i.e. the longest time a flow has been waiting, per current flow status
+        """
+        with self.read_connection() as connection:
+            rows = connection.execute(self.select_flow_status_stats_query).fetchall()
+
+        return {FlowStatus(status): (flow_count, oldest_timestamp) for (status, flow_count, oldest_timestamp) in rows}
+
+    """
+    COMPACTION
+    """
+    @synchronized
+    @timed_query
+    def compact_finished_flows(self, older_than: float, batch_size: int = DEFAULT_COMPACTION_BATCH_SIZE, after: tuple[float, int] = None,
+                               archive_file_name: str = None, compress: bool = False) -> tuple[int, tuple[float, int]]:
+        """
+            Compacts, in a single short unit of work, up to batch_size SUCCEEDED flows whose last change is older than older_than.
+            A compacted flow keeps its latest state, its final history row as a full snapshot and a FlowSummary. Its other history rows
+            and its task executions are dropped, after being copied to the archive_file_name storage when given (contexts zlib compressed if asked).
+            Returns the number of compacted flows and the cursor to pass as after for the next batch, None once there are no candidates left.
+        """
+        if(batch_size < 1):
+            raise ValueError(f"Compaction batch size must be at least 1, got {batch_size}")
+
+        if(archive_file_name is not None):
+            self.__attach_archive(archive_file_name)
+
+        (after_timestamp, after_execution_id) = (float("-inf"), 0) if after is None else after
+
+        with self.transaction():
+            cursor = self.connection.cursor()
+            cursor.execute(self.select_compaction_candidates_query, (FlowStatus.SUCCEEDED.value, older_than, after_timestamp, after_execution_id, batch_size))
+            candidates = cursor.fetchall()
+
+            execution_ids = [(execution_id,) for (execution_id, _) in candidates]
+            execution_id_pairs = [(execution_id, execution_id) for (execution_id, _) in candidates]
+
+            if(archive_file_name is not None):
+                cursor.executemany(self.archive_flow_history_query, [(compress, compress, execution_id) for (execution_id, _) in candidates])
+                cursor.executemany(self.archive_task_history_query, execution_ids)
+
+                # The archive keeps its own copy of the blobs the archived history references, they may not outlive the compaction here
+                archived_payloads = [row[0] for execution_id in execution_ids for row in cursor.execute(self.select_archived_flow_payloads_query, execution_id).fetchall()]
+                cursor.executemany(self.archive_blob_query, [(blob_hash,) for blob_hash in collect_blob_hashes(archived_payloads)])
+
+            cursor.executemany(self.insert_flow_summary_query, [(archive_file_name, execution_id) for (execution_id, _) in candidates])
+            cursor.executemany(self.update_final_flow_snapshot_query, execution_id_pairs)
+            cursor.executemany(self.reset_flow_state_deltas_query, execution_ids)
+            cursor.executemany(self.delete_compacted_flow_history_query, execution_id_pairs)
+            cursor.executemany(self.delete_compacted_task_history_query, execution_ids)
+
+            cursor.close()
+
+        next_batch_cursor = (candidates[-1][1], candidates[-1][0]) if len(candidates) == batch_size else None
+        return (len(candidates), next_batch_cursor)
+
+    @synchronized
+    @timed_query
+    def delete_unreferenced_blobs(self) -> int:
+        """
+            Deletes the blobs that no flow state, history row or task memo references anymore, e.g. once compaction dropped the history
+            that did, and returns how many were deleted. Every payload that may hold a reference is decoded, it's meant for maintenance jobs.
+            The scan runs in a unit of work so that no write can start referencing a blob while it is being deleted.
+        """
+        with self.transaction():
+            cursor = self.connection.cursor()
+
+            blob_hashes = {row[0] for row in cursor.execute(self.select_blob_hashes_query).fetchall()}
+            unreferenced_blob_hashes = []
+            if(blob_hashes):
+                referenced_blob_hashes = collect_blob_hashes(row[0] for row in cursor.execute(self.select_blob_referencing_payloads_query))
+                unreferenced_blob_hashes = [(blob_hash,) for blob_hash in blob_hashes - referenced_blob_hashes]
+                cursor.executemany(self.delete_blob_query, unreferenced_blob_hashes)
+
+            cursor.close()
+
+        return len(unreferenced_blob_hashes)
+
+    @timed_query
+    def get_flow_summary(self, execution_id: int) -> FlowSummary:
+        with self.read_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self.select_flow_summary_query, (execution_id,))
+            row = cursor.fetchone()
+            cursor.close()
+
+            return None if row is None else FlowSummaryMapper.to_model(row)
+
+    def __attach_archive(self, archive_file_name: str) -> None:
+        if(self.attached_archive_file_name == archive_file_name):
+            return
+
+        # Databases can only be attached, and detached, outside of a transaction
+        self.flush()
+
+        if(self.attached_archive_file_name is not None):
+            self.connection.execute(self.detach_archive_query)
+            self.attached_archive_file_name = None
+
+        self.connection.create_function("archive_payload", 2, archive_payload, deterministic=True)
+        self.connection.execute(self.attach_archive_query, (archive_file_name,))
+        self.connection.executescript(self.create_archive_schema_query)
+        self.attached_archive_file_name = archive_file_name
+
+    @timed_query
+    def get_flow_history(self, execution_id: int) -> list[FlowExecution]:
+        """
+            Returns every persisted step of a flow execution, oldest first, for auditing purposes
+        """
+        with self.read_connection() as connection:
+            cursor = connection.cursor()
+
+            query_param = (execution_id,)
+            cursor.execute(self.select_flow_history_query, query_param)
+            rows = cursor.fetchall()
+
+            ret_val = []
+            previous_context = {}
+            for row in rows:
+                flow_execution = self.__with_blob_loader(FlowMapper.history_to_model(row, previous_context))
+                previous_context = flow_execution.execution_context.as_dict()
+                ret_val.append(flow_execution)
+
+            return ret_val
     
-    def get_run_candidate_flow(self, strategy: FlowStatus) -> FlowExecution:
-        cursor = self.connection.cursor()
+    @timed_query
+    def get_run_candidate_flow(self, strategy: FlowStatus, now: float = None) -> FlowExecution:
+        with self.read_connection() as connection:
+            cursor = connection.cursor()
+
+            query_param = (strategy.value, time.time() if now is None else now)
+            cursor.execute(self.select_get_candidate_flow_id, query_param)
+            rows = cursor.fetchall()
 
-        query_param = (strategy.name,)
-        cursor.execute(self.select_get_candidate_flow_id, query_param)
-        rows = cursor.fetchall()
+            if(len(rows) == 0):
+                return None
+        
+            if(len(rows) > 1):
+                raise ValueError("Select get run candidate flow query should return only one result!")
+        
+            return self.get_flow(rows[0][0])
+
+    """
+    LEASES
+    """
+    @synchronized
+    @timed_query
+    def claim_run_candidate_flow(self, strategy: FlowStatus, owner: str, lease_expires_at: float, now: float) -> FlowExecution:
+        """
+            Atomically leases the head of the ready queue for the strategy (highest priority first, then FIFO) to the given owner.
+            Flows holding a non expired lease from another owner are skipped so that concurrent workers never pick the same flow.
+        """
+        with self.transaction():
+            cursor = self.connection.cursor()
+
+            query_params = (owner, lease_expires_at, strategy.value, now, now)
+            cursor.execute(self.claim_candidate_flow_query, query_params)
+            rows = cursor.fetchall()
+            cursor.close()
 
         if(len(rows) == 0):
             return None
-        
+
         if(len(rows) > 1):
-            raise ValueError("Select get run candidate flow query should return only one result!")
-        
-        return FlowMapper.to_model(rows[0])
+            raise ValueError("Claim run candidate flow query should return only one result!")
+
+        return self.get_flow(rows[0][0])
+
+    @timed_query
+    def get_next_not_before(self, now: float) -> float:
+        """
+            Earliest time after now at which a queued flow, held back until then, becomes runnable. None if there is none.
+        """
+        with self.read_connection() as connection:
+            return connection.execute(self.select_next_not_before_query, (now,)).fetchone()[0]
+
+    @synchronized
+    @timed_query
+    def release_flow_lease(self, execution_id: int, owner: str) -> None:
+        with self.transaction():
+            cursor = self.connection.cursor()
+            cursor.execute(self.release_flow_lease_query, (execution_id, owner))
+            cursor.close()
 
     """
     TASKS
     """
+    @synchronized
+    @timed_query
     def save_task(self, task: TaskExecution) -> TaskExecution:
         task_dao = TaskMapper.to_dao(task)
 
-        cursor = self.connection.cursor()
-        cursor.execute(self.insert_task_query, task_dao)
+        with self.transaction():
+            cursor = self.connection.cursor()
+            cursor.execute(self.insert_task_query, task_dao)
 
-        rows = cursor.fetchall()
-        if(len(rows) != 1):
-            raise ValueError("Insert task query should only return one result!")
+            rows = cursor.fetchall()
+            if(len(rows) != 1):
+                raise ValueError("Insert task query should only return one result!")
 
-        cursor.close()
-       
-        self.connection.commit()
+            cursor.close()
 
         return TaskMapper.to_model(rows[0])
     
+    @timed_query
     def get_flow_task_execution_history(self, flow_id: int) -> list[TaskExecution]:
-        cursor = self.connection.cursor()
+        with self.read_connection() as connection:
+            cursor = connection.cursor()
+
+            query_param = (flow_id,)
+            cursor.execute(self.select_flow_task_execution_history_query, query_param)
+            rows = cursor.fetchall()
+
+            ret_val = []
+            for row in rows:
+                ret_val.append(TaskMapper.to_model(row))
+
+            return ret_val
+
+    @timed_query
+    def get_flow_task_execution_page(self, flow_id: int, after: int = None, limit: int = DEFAULT_PAGE_SIZE) -> tuple[list[TaskExecution], int]:
+        """
+            Returns up to limit task executions of the flow that come after the after cursor, along with the cursor of the next page.
+            The next page cursor is None once there are no more task executions.
+        """
+        if(limit < 1):
+            raise ValueError(f"Page limit must be at least 1, got {limit}")
+
+        with self.read_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self.select_flow_task_execution_page_query, (flow_id, 0 if after is None else after, limit))
+            rows = cursor.fetchall()
+            cursor.close()
+
+        next_page_cursor = rows[-1][0] if len(rows) == limit else None
+        return ([TaskMapper.to_model(row[1:]) for row in rows], next_page_cursor)
 
-        query_param = (flow_id,)
-        cursor.execute(self.select_flow_task_execution_history_query, query_param)
-        rows = cursor.fetchall()
+    def iterate_flow_task_executions(self, flow_id: int, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[TaskExecution]:
+        return iterate_pages(lambda after: self.get_flow_task_execution_page(flow_id, after, page_size))
+
+    """
+    CHECKPOINTS AND MEMOS
+    """
+    @synchronized
+    @timed_query
+    def save_task_checkpoint(self, execution_id: int, task_index: int, state, codec: ExecutionContextCodec) -> None:
+        with self.transaction():
+            self.connection.execute(self.upsert_task_checkpoint_query, (execution_id, task_index, encode_payload(codec, {"state": state}), time.time()))
+
+    @timed_query
+    def get_task_checkpoint(self, execution_id: int, task_index: int):
+        """
+            Returns the latest state saved by the task of the flow, None if there is none
+        """
+        with self.read_connection() as connection:
+            row = connection.execute(self.select_task_checkpoint_query, (execution_id, task_index)).fetchone()
+
+        return None if row is None else decode_payload(row[0])["state"]
+
+    @synchronized
+    @timed_query
+    def save_task_memo(self, input_hash: str, output_execution_context: ExecutionContext, codec: ExecutionContextCodec) -> None:
+        """
+            Stores the outputs of a task run under the hash of its inputs, their large binary values go to the blob store like the flow contexts ones
+        """
+        with self.transaction():
+            cursor = self.connection.cursor()
+
+            self.__store_blobs(cursor, output_execution_context)
+            cursor.execute(self.insert_task_memo_query, (input_hash, output_execution_context.to_payload(codec), time.time()))
+
+            cursor.close()
+
+    @timed_query
+    def get_task_memo(self, input_hash: str) -> ExecutionContext:
+        with self.read_connection() as connection:
+            row = connection.execute(self.select_task_memo_query, (input_hash,)).fetchone()
+
+        if(row is None):
+            return None
+
+        output_execution_context = ExecutionContext.from_payload(row[0])
+        output_execution_context.blob_loader = self.get_blob
+
+        return output_execution_context
+
+    @synchronized
+    @timed_query
+    def delete_task_memos(self, older_than: float) -> int:
+        """
+            Deletes the memos stored before older_than and returns how many were deleted. Their blobs are kept.
+        """
+        with self.transaction():
+            deleted_memos = self.connection.execute(self.delete_task_memos_query, (older_than,)).rowcount
+
+        return deleted_memos
+
+    @timed_query
+    def get_flow_page(self, status: FlowStatus = None, template_name: str = None, since: float = None, until: float = None,
+                      after: tuple[float, int] = None, limit: int = DEFAULT_PAGE_SIZE) -> tuple[list[FlowExecution], tuple[float, int]]:
+        """
+            Returns up to limit flows, in their latest state, matching every given filter and coming after the after cursor.
+            since and until bound the timestamp of the latest state change. The next page cursor is None once there are no more flows.
+        """
+        if(limit < 1):
+            raise ValueError(f"Page limit must be at least 1, got {limit}")
+
+        filters = {
+            "status" : None if status is None else (status.value,),
+            "template_name" : None if template_name is None else (template_name,),
+            "since" : None if since is None else (since,),
+            "until" : None if until is None else (until,),
+            "after" : after
+        }
+        used_filters = [name for (name, params) in filters.items() if params is not None]
+
+        query = self.select_flow_page_query.format(filters=" AND ".join([self.flow_page_filters[name] for name in used_filters]) or "1")
+        query_params = tuple(param for name in used_filters for param in filters[name]) + (limit,)
+
+        with self.read_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query, query_params)
+            rows = cursor.fetchall()
+            cursor.close()
 
-        ret_val = []
-        for row in rows:
-            ret_val.append(TaskMapper.to_model(row))
+        next_page_cursor = (rows[-1][6], rows[-1][0]) if len(rows) == limit else None
+        return ([self.__with_blob_loader(FlowMapper.to_model(row)) for row in rows], next_page_cursor)
 
-        return ret_val
+    def iterate_flows(self, status: FlowStatus = None, template_name: str = None, since: float = None, until: float = None,
+                      page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[FlowExecution]:
+        return iterate_pages(lambda after: self.get_flow_page(status, template_name, since, until, after, page_size))
+
+    def __end_unit_of_work(self) -> None:
+        if(self.durability is not Durability.GROUP_COMMIT):
+            with get_metrics().timer("flow_repository_commit_seconds"):
+                self.connection.commit()
+            return
+
+        self.pending_units += 1
+        if(self.first_pending_unit_time is None):
+            self.first_pending_unit_time = time.monotonic()
+
+            # The write transaction stays open until the group is committed, which must not wait for a next unit that may be a long task away
+            self.group_commit_timer = threading.Timer(self.group_commit_interval, self.__commit_group_when_due, (self.first_pending_unit_time,))
+            self.group_commit_timer.daemon = True
+            self.group_commit_timer.start()
+
+        group_is_full = self.pending_units >= self.group_commit_size
+        group_is_due = time.monotonic() - self.first_pending_unit_time >= self.group_commit_interval
+        if(group_is_full or group_is_due):
+            self.flush()
+
+    def __commit_group_when_due(self, first_pending_unit_time: float) -> None:
+        """
+            Group commit timer, commits the group it was started for unless that group was already committed
+        """
+        with self.lock:
+            if(self.first_pending_unit_time == first_pending_unit_time):
+                self.flush()
+
+    def __acquire_reader(self) -> sqlite3.Connection:
+        with self.readers_lock:
+            if(len(self.idle_readers) > 0):
+                return self.idle_readers.pop()
+
+            reader = sqlite3.connect(self.current_db_name, check_same_thread=False, isolation_level=None)
+            reader.execute("PRAGMA query_only = 1")
+            self.reader_connections.add(reader)
+
+        return reader
+
+    def __release_reader(self, reader: sqlite3.Connection) -> None:
+        with self.readers_lock:
+            if(reader not in self.reader_connections):
+                # Already closed by __close_readers while it was in use
+                return
+
+            if(len(self.idle_readers) < DEFAULT_IDLE_READER_COUNT):
+                self.idle_readers.append(reader)
+                return
+
+            self.reader_connections.discard(reader)
+
+        reader.close()
+
+    def __close_readers(self) -> None:
+        with self.readers_lock:
+            for reader in self.reader_connections:
+                reader.close()
+
+            self.reader_connections = set()
+            self.idle_readers = []
+
+    def __connect(self) -> sqlite3.Connection:
+        # Access is serialized through the repository lock so the connection can be shared between worker threads.
+        # Transactions are explicitly handled by the units of work hence the autocommit isolation level.
+        return sqlite3.connect(self.current_db_name, check_same_thread=False, isolation_level=None)
 
     def __extract_error_message(self, error: Error) -> str:
         return getattr(error, 'message', repr(error))
 
 class FlowMapper:
     @staticmethod
-    def to_dao(model: FlowExecution) -> tuple[int,int,str,str,int,str]:
-        execution_context_json = model.execution_context.to_json()
-        return (model.execution_id, model.execution_step, model.status.name, model.template_name, model.current_task_index, execution_context_json, model.timestamp)
+    def to_dao(model: FlowExecution) -> tuple[int,int,int,str,int,str]:
+        execution_context_payload = model.execution_context.to_payload(model.context_codec)
+        return (model.execution_id, model.execution_step, model.status.value, model.template_name, model.current_task_index, execution_context_payload, model.timestamp)
 
     @staticmethod
-    def to_model(dao: tuple[int,int,str,str,int,str,int]) -> FlowExecution:
-        fe = FlowExecution()
+    def to_model(dao: tuple[int,int,int,str,int,str,int,int,str,int,float]) -> FlowExecution:
+        fe = FlowExecution(ExecutionContext.from_payload(dao[5]))
         fe.execution_id = dao[0]
         fe.execution_step = dao[1]
-        fe.status = FlowStatus[dao[2]]
+        fe.status = FlowStatus(dao[2])
         fe.template_name = dao[3]
         fe.current_task_index = dao[4]
-        fe.execution_context = ExecutionContext.from_json(dao[5])
+        fe.context_codec = get_payload_codec(dao[5])
         fe.timestamp = dao[6]
 
+        # Only the latest state projection carries the scheduling priority
+        if(len(dao) > 7):
+            fe.priority = dao[7]
+
+        if(len(dao) > 8):
+            fe.completed_tasks = FlowMapper.completed_tasks_to_model(dao[8])
+
+        # The retry state is only kept in the latest state projection
+        if(len(dao) > 9):
+            fe.attempt = dao[9]
+            fe.not_before = dao[10]
+
+        return fe
+
+    """
+        Maps a flow_executions history row whose eighth column tells if its context is a delta.
+        Deltas are applied on top of previous_context, the reconstructed context of the previous history row.
+    """
+    @staticmethod
+    def history_to_model(dao: tuple[int,int,int,str,int,str,int,int,str], previous_context: dict) -> FlowExecution:
+        fe = FlowMapper.to_model(dao[:7])
+        fe.completed_tasks = FlowMapper.completed_tasks_to_model(dao[8])
+
+        if(dao[7]):
+            fe.execution_context = ExecutionContext()
+            fe.execution_context.context = apply_context_delta(previous_context, decode_payload(dao[5]))
+
         return fe
 
+    """
+        Completed tasks of DAG flows are stored as a comma separated list of task indexes, NULL when there are none
+    """
+    @staticmethod
+    def completed_tasks_to_dao(model: FlowExecution) -> str:
+        if(len(model.completed_tasks) == 0):
+            return None
+
+        return ",".join(str(index) for index in sorted(model.completed_tasks))
+
+    @staticmethod
+    def completed_tasks_to_model(completed_tasks: str) -> frozenset[int]:
+        if(completed_tasks is None):
+            return frozenset()
+
+        return frozenset(int(index) for index in completed_tasks.split(","))
+
+class FlowSummaryMapper:
+    @staticmethod
+    def to_model(dao: tuple[int,str,int,int,int,float,float,str]) -> FlowSummary:
+        fs = FlowSummary()
+        fs.execution_id = dao[0]
+        fs.template_name = dao[1]
+        fs.status = FlowStatus(dao[2])
+        fs.steps = dao[3]
+        fs.task_executions = dao[4]
+        fs.created_at = dao[5]
+        fs.finished_at = dao[6]
+        fs.archive_file_name = dao[7]
+
+        return fs
+
 class TaskMapper:
     @staticmethod
-    def to_dao(model:TaskExecution) -> tuple[int,int,str,str]:
-        return (model.flow_execution_id, model.flow_execution_step, model.status.name, model.output, model.timestamp)
+    def to_dao(model:TaskExecution) -> tuple[int,int,int,str,int]:
+        return (model.flow_execution_id, model.flow_execution_step, model.status.value, model.output, model.timestamp)
 
     @staticmethod
-    def to_model(dao: tuple[int,int,str,str,int]) -> TaskExecution:
+    def to_model(dao: tuple[int,int,int,str,int]) -> TaskExecution:
 
         te = TaskExecution()
         te.flow_execution_id = dao[0]
         te.flow_execution_step = dao[1]
-        te.status = TaskStatus[dao[2]]
+        te.status = TaskStatus(dao[2])
         te.output = dao[3]
         te.timestamp = dao[4]
 
         return te
 
-default_persistent_instance: FlowRepository = FlowRepository.from_persistence_mode(PersistenceMode.PERSISTENT)
\ No newline at end of file
+_default_persistent_instance: FlowRepository = None
+_default_persistent_instance_lock = threading.Lock()
+
+def get_default_persistent_instance() -> FlowRepository:
+    """
+        The default persistent repository is only created, and its storage only opened, on first use
+    """
+    global _default_persistent_instance
+
+    if _default_persistent_instance is None:
+        with _default_persistent_instance_lock:
+            if _default_persistent_instance is None:
+                _default_persistent_instance = FlowRepository.from_persistence_mode(PersistenceMode.PERSISTENT)
+
+    return _default_persistent_instance
+
+def __getattr__(name: str):
+    # Keeps flow_repository.default_persistent_instance working without creating it at import time
+    if name == "default_persistent_instance":
+        return get_default_persistent_instance()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,71 @@
+-- Tables as created by older versions, the schema migrations bring storages created from them up to date
+
+CREATE TABLE IF NOT EXISTS flow_executions(
+        execution_id integer NOT NULL,
+        execution_step integer NOT NULL,
+        status text, 
+        template_name text,
+        current_task_index integer,
+        execution_context text, 
+        timestamp integer, 
+        PRIMARY KEY(execution_id, execution_step)
+        );
+
+CREATE TABLE IF NOT EXISTS task_executions(
+        flow_execution_id integer,
+        flow_execution_step integer,
+        status text,output text,
+        timestamp integer,
+        FOREIGN KEY (flow_execution_id, flow_execution_step) REFERENCES flow_executions(execution_id, execution_step)
+        );
+
+CREATE INDEX IF NOT EXISTS task_executions_flow_idx ON task_executions(flow_execution_id);
+
+CREATE TABLE IF NOT EXISTS flow_states(
+        execution_id integer PRIMARY KEY,
+        execution_step integer NOT NULL,
+        status text,
+        template_name text,
+        current_task_index integer,
+        execution_context text,
+        timestamp integer,
+        priority integer NOT NULL DEFAULT 0
+        );
+
+DROP INDEX IF EXISTS flow_states_status_idx;
+CREATE INDEX IF NOT EXISTS flow_states_status_timestamp_idx ON flow_states(status, timestamp);
+CREATE INDEX IF NOT EXISTS flow_states_template_timestamp_idx ON flow_states(template_name, timestamp);
+CREATE INDEX IF NOT EXISTS flow_states_timestamp_idx ON flow_states(timestamp);
+
+INSERT INTO flow_states(execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp)
+        SELECT execution_id, execution_step, status, template_name, current_task_index, execution_context, timestamp
+        FROM flow_executions
+        WHERE NOT EXISTS (SELECT 1 FROM flow_states)
+            AND rowid IN (SELECT MAX(rowid) FROM flow_executions GROUP BY execution_id);
+
+CREATE TABLE IF NOT EXISTS flow_ready_queue(
+        execution_id integer PRIMARY KEY,
+        status text NOT NULL,
+        priority integer NOT NULL DEFAULT 0,
+        enqueued_at real NOT NULL
+        );
+
+CREATE INDEX IF NOT EXISTS flow_ready_queue_order_idx ON flow_ready_queue(status, priority DESC, enqueued_at, execution_id);
+
+-- Statuses are enum names until the storage is migrated to their values
+INSERT INTO flow_ready_queue(execution_id, status, priority, enqueued_at)
+        SELECT execution_id, status, priority, timestamp
+        FROM flow_states
+        WHERE status IN ('SCHEDULED', 'RESCHEDULED', 1, 5)
+            AND NOT EXISTS (SELECT 1 FROM flow_ready_queue);
+
+CREATE TABLE IF NOT EXISTS flow_summaries(
+        execution_id integer PRIMARY KEY,
+        template_name text,
+        status text,
+        steps integer NOT NULL,
+        task_executions integer NOT NULL,
+        created_at real,
+        finished_at real,
+        archive_file_name text
+        );
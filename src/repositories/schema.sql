@@ -1,18 +1,105 @@
 CREATE TABLE IF NOT EXISTS flow_executions(
         execution_id integer NOT NULL,
         execution_step integer NOT NULL,
-        status text, 
+        status integer,
         template_name text,
         current_task_index integer,
-        execution_context text, 
-        timestamp integer, 
+        execution_context text,
+        timestamp integer,
+        context_is_delta integer NOT NULL DEFAULT 0,
+        completed_tasks text,
         PRIMARY KEY(execution_id, execution_step)
         );
 
 CREATE TABLE IF NOT EXISTS task_executions(
         flow_execution_id integer,
         flow_execution_step integer,
-        status text,output text,
+        status integer,
+        output text,
         timestamp integer,
         FOREIGN KEY (flow_execution_id, flow_execution_step) REFERENCES flow_executions(execution_id, execution_step)
-        );
\ No newline at end of file
+        );
+
+CREATE INDEX IF NOT EXISTS task_executions_flow_idx ON task_executions(flow_execution_id);
+
+CREATE TABLE IF NOT EXISTS flow_leases(
+        execution_id integer PRIMARY KEY,
+        owner text NOT NULL,
+        expires_at real NOT NULL
+        );
+
+CREATE TABLE IF NOT EXISTS flow_states(
+        execution_id integer PRIMARY KEY,
+        execution_step integer NOT NULL,
+        status integer,
+        template_name text,
+        current_task_index integer,
+        execution_context text,
+        timestamp integer,
+        priority integer NOT NULL DEFAULT 0,
+        deltas_since_snapshot integer NOT NULL DEFAULT 0,
+        completed_tasks text,
+        attempt integer NOT NULL DEFAULT 0,
+        not_before real
+        );
+
+CREATE INDEX IF NOT EXISTS flow_states_status_timestamp_idx ON flow_states(status, timestamp);
+CREATE INDEX IF NOT EXISTS flow_states_template_timestamp_idx ON flow_states(template_name, timestamp);
+CREATE INDEX IF NOT EXISTS flow_states_timestamp_idx ON flow_states(timestamp);
+
+CREATE TABLE IF NOT EXISTS flow_ready_queue(
+        execution_id integer PRIMARY KEY,
+        status integer NOT NULL,
+        priority integer NOT NULL DEFAULT 0,
+        enqueued_at real NOT NULL,
+        not_before real
+        );
+
+CREATE INDEX IF NOT EXISTS flow_ready_queue_order_idx ON flow_ready_queue(status, priority DESC, enqueued_at, execution_id);
+
+CREATE TABLE IF NOT EXISTS context_blobs(
+        hash text PRIMARY KEY,
+        data blob NOT NULL,
+        size integer NOT NULL
+        );
+
+CREATE TABLE IF NOT EXISTS flow_sequences(
+        name text PRIMARY KEY,
+        next_id integer NOT NULL
+        );
+
+INSERT OR IGNORE INTO flow_sequences(name, next_id)
+        SELECT 'flow_execution', COALESCE(MAX(execution_id), 0) + 1
+        FROM flow_executions;
+
+CREATE TABLE IF NOT EXISTS flow_summaries(
+        execution_id integer PRIMARY KEY,
+        template_name text,
+        status integer,
+        steps integer NOT NULL,
+        task_executions integer NOT NULL,
+        created_at real,
+        finished_at real,
+        archive_file_name text
+        );
+
+CREATE TABLE IF NOT EXISTS task_checkpoints(
+        execution_id integer NOT NULL,
+        task_index integer NOT NULL,
+        state blob,
+        timestamp real NOT NULL,
+        PRIMARY KEY(execution_id, task_index)
+        );
+
+CREATE TABLE IF NOT EXISTS task_memos(
+        input_hash text PRIMARY KEY,
+        output_context blob,
+        timestamp real NOT NULL
+        );
+
+CREATE INDEX IF NOT EXISTS task_memos_timestamp_idx ON task_memos(timestamp);
+
+CREATE TABLE IF NOT EXISTS schema_fingerprint(
+        id integer PRIMARY KEY CHECK (id = 0),
+        fingerprint text NOT NULL
+        );
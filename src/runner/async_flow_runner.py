@@ -0,0 +1,159 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+
+from src.model.flow import AsyncTask, CancellationToken, ExecutionContext, FlowExecution, FlowStatus, Task, TaskCheckpoint, TaskExecution, TaskExecutionMode, TaskStatus
+from src.runner.flow_runner import DEFAULT_LEASE_DURATION, FlowRunner
+from src.services import flow_service
+
+DEFAULT_MAX_CONCURRENCY: int = 1000
+
+class AsyncFlowRunner(FlowRunner):
+    """
+        Runs flows concurrently on a single asyncio event loop.
+
+        AsyncTask instances are awaited on the loop while plain Task instances run in the loop's default executor so they don't block it.
+        Every storage access goes through a single threaded executor, which keeps the repository writes serialized and off the loop.
+        Flow and task status changes go through the very same FlowRunner steps, so the FlowService state machine is unchanged.
+    """
+    max_concurrency: int
+    storage_executor: ThreadPoolExecutor
+
+    def __init__(self, flow_service: flow_service.FlowService, lease_duration: float = DEFAULT_LEASE_DURATION, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 process_workers: int = None):
+        super().__init__(flow_service, lease_duration, process_workers)
+
+        if max_concurrency < 1:
+            raise ValueError(f"Max concurrency must be at least 1, got {max_concurrency}.")
+
+        self.max_concurrency = max_concurrency
+        self.storage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flow-storage")
+
+    def close(self) -> None:
+        super().close()
+        self.storage_executor.shutdown(wait=True)
+
+    async def run_flows_async(self, strategy: FlowStatus) -> int:
+        """
+            Runs every runnable flow for the strategy, up to max_concurrency flows at a time.
+            Returns the number of flows that were run.
+        """
+        async def drain_flows() -> int:
+            flow_count = 0
+            while await self.run_flow_async(strategy) is not None:
+                flow_count += 1
+
+            return flow_count
+
+        flow_counts = await asyncio.gather(*[drain_flows() for _ in range(self.max_concurrency)])
+        return sum(flow_counts)
+
+    async def run_flow_async(self, strategy: FlowStatus) -> int:
+        owner = self.get_worker_id()
+        candidate_flow = await self.call_storage(self.flow_service.claim_runnable_flow, strategy, owner, self.lease_duration)
+
+        if candidate_flow is None:
+            await self.call_storage(self.flow_service.flush)
+            return None
+
+        try:
+            await self.execute_flow_async(candidate_flow)
+        finally:
+            await self.call_storage(self.flow_service.release_flow, candidate_flow.execution_id, owner)
+
+        return candidate_flow.execution_id
+
+    async def execute_flow_async(self, candidate_flow: FlowExecution) -> None:
+        if self.get_execution_plan(candidate_flow.template_name).is_dag():
+            await self.execute_dag_flow_async(candidate_flow)
+            return
+
+        (running_flow, task) = await self.call_storage(self.start_flow, candidate_flow)
+
+        target_flow_status = FlowStatus.RUNNING
+        while(task is not None and target_flow_status == FlowStatus.RUNNING):
+            (post_task_execution, output_execution_context) = await self.run_task_async(running_flow, task)
+            (target_flow_status, task) = self.get_step_outcome(running_flow, post_task_execution)
+
+            running_flow = await self.call_storage(self.complete_step, running_flow, post_task_execution, target_flow_status, output_execution_context)
+
+    async def execute_dag_flow_async(self, candidate_flow: FlowExecution) -> None:
+        """
+            Same as FlowRunner.execute_dag_flow with the tasks of the flow running concurrently on the event loop
+        """
+        execution_plan = self.get_execution_plan(candidate_flow.template_name)
+        (running_flow, tasks_to_run) = await self.call_storage(self.start_dag_flow, candidate_flow)
+
+        running_tasks = {}
+        failed_tasks = []
+
+        while(tasks_to_run or running_tasks):
+            for (task_index, task_flow) in tasks_to_run:
+                running_tasks[asyncio.ensure_future(self.run_task_async(task_flow, execution_plan.get_task(task_index), task_index))] = task_index
+
+            (done, _) = await asyncio.wait(running_tasks, return_when=asyncio.FIRST_COMPLETED)
+
+            tasks_to_run = []
+            for future in done:
+                task_index = running_tasks.pop(future)
+                (post_task_execution, output_execution_context) = future.result()
+
+                if post_task_execution.status == TaskStatus.FAILED:
+                    failed_tasks.append((task_index, post_task_execution))
+                    continue
+
+                started_tasks = set(running_tasks.values()) | {index for (index, _) in tasks_to_run}
+                (running_flow, next_tasks_to_run) = await self.call_storage(self.complete_dag_task, running_flow, task_index, post_task_execution,
+                                                                            output_execution_context, started_tasks, len(failed_tasks) == 0)
+                tasks_to_run.extend(next_tasks_to_run)
+
+        await self.call_storage(self.finish_dag_flow, running_flow, failed_tasks)
+
+    async def run_task_async(self, flow: FlowExecution, task: Task, task_index: int = None) -> tuple[TaskExecution, ExecutionContext]:
+        memo_key = self.get_task_memo_key(flow, task, task_index)
+        if memo_key is not None:
+            memoized_task_outcome = await self.call_storage(self.get_memoized_task_outcome, flow, memo_key)
+            if memoized_task_outcome is not None:
+                return memoized_task_outcome
+
+        input_execution_context = flow.execution_context
+        timeout = self.get_task_timeout(flow, task_index)
+        cancellation_token = CancellationToken()
+        checkpoint = self.create_task_checkpoint(flow, task_index)
+        if isinstance(task, AsyncTask):
+            # An AsyncTask loads its checkpoint on the event loop, where waiting for the storage would hold up every other flow
+            await asyncio.get_running_loop().run_in_executor(None, checkpoint.load)
+
+        with self.capture_task_outcome(flow, checkpoint) as outcome:
+            if isinstance(task, AsyncTask):
+                outcome["execution_context"] = await self.run_async_task(task, input_execution_context, cancellation_token, checkpoint, timeout)
+            elif task.execution_mode() is TaskExecutionMode.PROCESS:
+                # The executor enforces the timeout itself, the executor thread only waits for the worker process
+                outcome["execution_context"] = await asyncio.get_running_loop().run_in_executor(None, self.process_task_executor.run, task, input_execution_context, timeout)
+            else:
+                task_future = asyncio.get_running_loop().run_in_executor(None, self.run_sync_task, task, input_execution_context, cancellation_token, checkpoint)
+                outcome["execution_context"] = await self.await_task(task_future, cancellation_token, timeout)
+
+        if memo_key is not None:
+            await self.call_storage(self.memoize_task_outputs, flow, task, memo_key, outcome)
+
+        return self.create_task_run_outcome(flow, outcome)
+
+    async def call_storage(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.storage_executor, functools.partial(function, *args))
+
+    def wait_for_storage(self, function, *args):
+        """
+            call_storage for the threads of the default executor, it must not be called from the storage executor itself
+        """
+        return self.storage_executor.submit(function, *args).result()
+
+    def create_task_checkpoint(self, flow: FlowExecution, task_index: int = None) -> TaskCheckpoint:
+        """
+            Checkpoint reads wait for the storage executor while saves are queued on it, so that saving never blocks the event loop.
+            Queued saves are written in order and before any later storage access of the flow.
+        """
+        task_index = flow.current_task_index if task_index is None else task_index
+        return TaskCheckpoint(functools.partial(self.wait_for_storage, self.flow_service.get_task_checkpoint, flow.execution_id, task_index),
+                              functools.partial(self.storage_executor.submit, self.flow_service.save_task_checkpoint, flow.execution_id, task_index,
+                                                codec=flow.context_codec))
@@ -0,0 +1,56 @@
+import time
+
+from src.repositories.flow_repository import DEFAULT_COMPACTION_BATCH_SIZE
+from src.services.flow_service import FlowService
+
+DEFAULT_COMPACTION_PAUSE: float = 0.01
+
+class FlowCompactor:
+    """
+        Retention job for the flow history: SUCCEEDED flows that didn't change for retention seconds are collapsed to their
+        final history row plus a FlowSummary, optionally archiving the dropped history to archive_file_name first.
+        Blobs that are no longer referenced once the history was dropped are deleted at the end of the run.
+
+        Work is done in units of at most batch_size flows with a pause in between, so the storage is never held for long
+        and runners sharing it keep going while the job runs.
+    """
+    flow_service: FlowService
+    retention: float
+    archive_file_name: str
+    compress: bool
+    batch_size: int
+    pause: float
+
+    def __init__(self, flow_service: FlowService, retention: float, archive_file_name: str = None, compress: bool = False,
+                 batch_size: int = DEFAULT_COMPACTION_BATCH_SIZE, pause: float = DEFAULT_COMPACTION_PAUSE):
+        if retention < 0:
+            raise ValueError(f"Retention can't be negative, got {retention}.")
+
+        self.flow_service = flow_service
+        self.retention = retention
+        self.archive_file_name = archive_file_name
+        self.compress = compress
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def run(self) -> int:
+        """
+            Compacts every flow that is past the retention and returns the number of compacted flows
+        """
+        older_than = time.time() - self.retention
+        compacted_flow_count = 0
+        next_batch_cursor = None
+
+        while True:
+            (batch_flow_count, next_batch_cursor) = self.flow_service.compact_finished_flows(
+                older_than, self.batch_size, next_batch_cursor, self.archive_file_name, self.compress)
+            compacted_flow_count += batch_flow_count
+
+            if next_batch_cursor is None:
+                # Blobs only the dropped history referenced are collected once per run, finding them means decoding every stored context
+                if compacted_flow_count > 0:
+                    self.flow_service.delete_unreferenced_blobs()
+
+                return compacted_flow_count
+
+            time.sleep(self.pause)
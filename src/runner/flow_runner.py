@@ -1,13 +1,39 @@
-from src.model.flow import ExecutionContext, FlowExecution, FlowStatus, FlowTemplate, Task, TaskExecution, TaskStatus
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import asyncio
+import copy
+import functools
+import os
+import threading
+import time
+from typing import Iterable
+from src.model.flow import AsyncTask, CancellationToken, ExecutionContext, ExecutionPlan, FlowExecution, FlowStatus, FlowTemplate, Task, TaskCheckpoint, TaskExecution, TaskExecutionMode, TaskStatus, TaskTimeoutError, hash_task_inputs
+from src.model.metrics import get_metrics
+from src.runner.process_task_executor import ProcessTaskExecutor
 from src.services import flow_service
 
+DEFAULT_LEASE_DURATION: float = 60.0
+
 class FlowRunner:
     flow_templates: list[FlowTemplate]
+    execution_plans: dict[str, ExecutionPlan]
+    lease_duration: float
+    process_task_executor: ProcessTaskExecutor
 
-    def __init__(self, flow_service: flow_service.FlowService):
+    def __init__(self, flow_service: flow_service.FlowService, lease_duration: float = DEFAULT_LEASE_DURATION, process_workers: int = None):
         self.flow_templates = {}
+        self.execution_plans = {}
         self.flow_service = flow_service
+        self.lease_duration = lease_duration
+        self.process_task_executor = ProcessTaskExecutor(process_workers)
+
+    def close(self) -> None:
+        self.process_task_executor.close()
 
+    """
+        Registers the flow template and compiles it into the execution plan used to run its flows.
+        Tasks added to the template after its registration are not taken into account.
+    """
     def register_flow_template(self, flow_template: FlowTemplate) -> None:
         flow_name = flow_template.name
 
@@ -15,83 +41,398 @@ class FlowRunner:
             raise ValueError(f"Flow with name {flow_name} is already registered.")
 
         self.flow_templates[flow_name] = flow_template
+        self.execution_plans[flow_name] = flow_template.compile()
 
     def get_flow_template(self, flow_name: str) -> FlowTemplate:
         return self.flow_templates[flow_name]
 
-    def schedule_flow(self, flow_template_name: str, execution_context: ExecutionContext) -> int:
-        flow_template = self.get_flow_template(flow_template_name)
+    def get_execution_plan(self, flow_name: str) -> ExecutionPlan:
+        return self.execution_plans[flow_name]
+
+    """
+        Schedules a flow execution. Flows with a higher priority are run first, flows with the same priority are run in scheduling order.
+    """
+    def schedule_flow(self, flow_template_name: str, execution_context: ExecutionContext, priority: int = 0) -> int:
+        execution_plan = self.get_execution_plan(flow_template_name)
 
-        if len(flow_template.tasks) == 0:
+        if len(execution_plan) == 0:
             raise ValueError("Flow template has no tasks!")
 
-        flow_execution = self.flow_service.create_flow_execution(flow_template.name, execution_context)
+        flow_execution = self.flow_service.create_flow_execution(execution_plan.template_name, execution_context, priority, execution_plan.codec)
         self.flow_service.update_flow_status(flow_execution.execution_id, FlowStatus.SCHEDULED, execution_context)
 
         return flow_execution.execution_id
 
-    def run_flow(self, strategy: FlowStatus) -> None:
-        candidate_flow = self.flow_service.get_runnable_flow(strategy)
+    """
+        Schedules a flow of the template for every context, all of them in a single transaction.
+        Contexts can come from a generator, they are consumed in batches. Returns the ids of the scheduled flows.
+    """
+    def schedule_flows(self, flow_template_name: str, execution_contexts: Iterable[ExecutionContext], priority: int = 0) -> list[int]:
+        execution_plan = self.get_execution_plan(flow_template_name)
 
-        target_flow_status = FlowStatus.RUNNING
-        running_flow = self.flow_service.update_flow_status(candidate_flow.execution_id, target_flow_status, candidate_flow.execution_context)
+        if len(execution_plan) == 0:
+            raise ValueError("Flow template has no tasks!")
 
-        task = self.get_current_task(running_flow)
-        can_run = (task != None)
-        while(can_run and target_flow_status == FlowStatus.RUNNING):
-            self.flow_service.create_task_execution(running_flow)
+        return self.flow_service.create_scheduled_flow_executions(execution_plan.template_name, execution_contexts, priority, execution_plan.codec)
+
+    """
+        Claims the next runnable flow for the given strategy and runs it to completion or failure.
+        Returns the id of the flow that was run or None when there was no flow available to be claimed.
+    """
+    def run_flow(self, strategy: FlowStatus) -> int:
+        owner = self.get_worker_id()
+        candidate_flow = self.flow_service.claim_runnable_flow(strategy, owner, self.lease_duration)
+
+        if candidate_flow is None:
+            # Nothing left to run, a good moment to commit any pending group of units of work
+            self.flow_service.flush()
+            return None
+
+        try:
+            self.execute_flow(candidate_flow)
+        finally:
+            self.flow_service.release_flow(candidate_flow.execution_id, owner)
+
+        return candidate_flow.execution_id
+
+    def execute_flow(self, candidate_flow: FlowExecution) -> None:
+        if self.get_execution_plan(candidate_flow.template_name).is_dag():
+            self.execute_dag_flow(candidate_flow)
+            return
+
+        (running_flow, task) = self.start_flow(candidate_flow)
+
+        target_flow_status = FlowStatus.RUNNING
+        while(task is not None and target_flow_status == FlowStatus.RUNNING):
             (post_task_execution,output_execution_context) = self.run_task(running_flow, task)
-            
-            if (post_task_execution.status == TaskStatus.FAILED):
-                target_flow_status = FlowStatus.FAILED
-                can_run = False
-                
-            if (post_task_execution.status == TaskStatus.SUCCEEDED):
-                target_flow_status = FlowStatus.RUNNING
-                can_run = True
-
-            # Check if flow is over
-            next_task = self.get_next_task(running_flow)
-            if(next_task is None and target_flow_status == FlowStatus.RUNNING):
-                target_flow_status = FlowStatus.SUCCEEDED
-            else:
-                task = next_task
-            
-            self.flow_service.update_task_execution(running_flow.execution_id, post_task_execution)
+            (target_flow_status, task) = self.get_step_outcome(running_flow, post_task_execution)
+
+            running_flow = self.complete_step(running_flow, post_task_execution, target_flow_status, output_execution_context)
+
+    def start_flow(self, candidate_flow: FlowExecution) -> tuple[FlowExecution, Task]:
+        with self.flow_service.transaction():
+            running_flow = self.flow_service.update_flow_status(candidate_flow.execution_id, FlowStatus.RUNNING, candidate_flow.execution_context)
+
+            task = self.get_current_task(running_flow)
+            if task is not None:
+                self.flow_service.create_task_execution(running_flow)
+
+        return (running_flow, task)
+
+    """
+        Returns the status the flow should move to after the task execution and the next task to run, if any.
+    """
+    def get_step_outcome(self, running_flow: FlowExecution, task_execution: TaskExecution) -> tuple[FlowStatus, Task]:
+        if (task_execution.status == TaskStatus.FAILED):
+            return (FlowStatus.FAILED, None)
+
+        # Check if flow is over
+        next_task = self.get_next_task(running_flow)
+        if(next_task is None):
+            return (FlowStatus.SUCCEEDED, None)
+
+        return (FlowStatus.RUNNING, next_task)
+
+    def complete_step(self, running_flow: FlowExecution, task_execution: TaskExecution, target_flow_status: FlowStatus, output_execution_context: ExecutionContext) -> FlowExecution:
+        # The outcome of the step and the start of the next one are committed together
+        with self.flow_service.transaction():
+            self.flow_service.update_task_execution(running_flow.execution_id, task_execution)
             running_flow = self.flow_service.update_flow_status(running_flow.execution_id, target_flow_status, output_execution_context)
 
+            if target_flow_status == FlowStatus.RUNNING:
+                self.flow_service.create_task_execution(running_flow)
+            elif target_flow_status == FlowStatus.FAILED:
+                running_flow = self.retry_failed_flow(running_flow, running_flow.current_task_index)
+
+        return running_flow
+
+    def retry_failed_flow(self, failed_flow: FlowExecution, task_index: int) -> FlowExecution:
+        """
+            Reschedules the flow once the backoff of the retry policy of the failed task has elapsed, as long as the policy allows another attempt
+        """
+        retry_policy = self.get_execution_plan(failed_flow.template_name).get_retry_policy(task_index)
+        if retry_policy is None or not retry_policy.can_retry(failed_flow.attempt):
+            return failed_flow
+
+        not_before = time.time() + retry_policy.get_delay(failed_flow.attempt)
+        return self.flow_service.update_flow_status(failed_flow.execution_id, FlowStatus.RESCHEDULED, None, not_before=not_before)
+
+    """
+    DAG FLOWS
+    """
+    def execute_dag_flow(self, candidate_flow: FlowExecution) -> None:
+        """
+            Starts every task whose dependencies completed, then persists each task outcome as soon as it is available and starts the tasks it unblocks.
+            Once a task failed no new task is started, the running ones are waited for and the flow is FAILED.
+        """
+        execution_plan = self.get_execution_plan(candidate_flow.template_name)
+        (running_flow, tasks_to_run) = self.start_dag_flow(candidate_flow)
+
+        running_tasks = {}
+        failed_tasks = []
+
+        with ThreadPoolExecutor(max_workers=max(len(execution_plan), 1), thread_name_prefix="flow-dag-task") as executor:
+            while(tasks_to_run or running_tasks):
+                for (task_index, task_flow) in tasks_to_run:
+                    running_tasks[executor.submit(self.run_task, task_flow, execution_plan.get_task(task_index), task_index)] = task_index
+
+                (done, _) = wait(running_tasks, return_when=FIRST_COMPLETED)
+
+                tasks_to_run = []
+                for future in done:
+                    task_index = running_tasks.pop(future)
+                    (post_task_execution, output_execution_context) = future.result()
+
+                    if post_task_execution.status == TaskStatus.FAILED:
+                        failed_tasks.append((task_index, post_task_execution))
+                        continue
+
+                    started_tasks = set(running_tasks.values()) | {index for (index, _) in tasks_to_run}
+                    (running_flow, next_tasks_to_run) = self.complete_dag_task(running_flow, task_index, post_task_execution, output_execution_context,
+                                                                               started_tasks, len(failed_tasks) == 0)
+                    tasks_to_run.extend(next_tasks_to_run)
+
+        self.finish_dag_flow(running_flow, failed_tasks)
+
+    def start_dag_flow(self, candidate_flow: FlowExecution) -> tuple[FlowExecution, list[tuple[int, FlowExecution]]]:
+        with self.flow_service.transaction():
+            running_flow = self.flow_service.update_flow_status(candidate_flow.execution_id, FlowStatus.RUNNING, candidate_flow.execution_context)
+            tasks_to_run = self.start_dag_tasks(running_flow, set())
+
+        return (running_flow, tasks_to_run)
+
+    def start_dag_tasks(self, running_flow: FlowExecution, started_tasks: set[int]) -> list[tuple[int, FlowExecution]]:
+        """
+            Creates the task executions of the tasks that are ready to run. Each task gets its own copy of the flow, and of its context, to run with.
+        """
+        execution_plan = self.get_execution_plan(running_flow.template_name)
+        tasks_to_run = []
+
+        for task_index in execution_plan.get_ready_tasks(running_flow.completed_tasks, started_tasks):
+            self.flow_service.create_task_execution(running_flow)
+
+            task_flow = copy.copy(running_flow)
+            task_flow.execution_context = copy.copy(running_flow.execution_context)
+            tasks_to_run.append((task_index, task_flow))
+
+        return tasks_to_run
+
+    def complete_dag_task(self, running_flow: FlowExecution, task_index: int, task_execution: TaskExecution, output_execution_context: ExecutionContext,
+                          started_tasks: set[int], start_next_tasks: bool) -> tuple[FlowExecution, list[tuple[int, FlowExecution]]]:
+        # The task outcome, the merged context and the start of the tasks it unblocks are committed together
+        with self.flow_service.transaction():
+            # Tasks started at an earlier step, their outcome is recorded at the step it's applied to the flow
+            task_execution.flow_execution_step = running_flow.execution_step
+            self.flow_service.update_task_execution(running_flow.execution_id, task_execution)
+
+            merged_execution_context = self.merge_task_output(running_flow.execution_context, output_execution_context)
+            running_flow = self.flow_service.update_flow_status(running_flow.execution_id, FlowStatus.RUNNING, merged_execution_context, task_index)
+
+            tasks_to_run = self.start_dag_tasks(running_flow, started_tasks) if start_next_tasks else []
+
+        return (running_flow, tasks_to_run)
+
+    def finish_dag_flow(self, running_flow: FlowExecution, failed_tasks: list[tuple[int, TaskExecution]]) -> FlowExecution:
+        """
+            failed_tasks holds the index and the execution of every failed task, in failure order. The first one decides how the flow is retried.
+        """
+        with self.flow_service.transaction():
+            for (_, task_execution) in failed_tasks:
+                task_execution.flow_execution_step = running_flow.execution_step
+                self.flow_service.update_task_execution(running_flow.execution_id, task_execution)
+
+            if len(failed_tasks) == 0:
+                return self.flow_service.update_flow_status(running_flow.execution_id, FlowStatus.SUCCEEDED, running_flow.execution_context)
+
+            failed_flow = self.flow_service.update_flow_status(running_flow.execution_id, FlowStatus.FAILED, running_flow.execution_context)
+            return self.retry_failed_flow(failed_flow, failed_tasks[0][0])
+
+    def merge_task_output(self, execution_context: ExecutionContext, output_execution_context: ExecutionContext) -> ExecutionContext:
+        """
+            Unlike LINEAR flows, where the output of a task replaces the context, the outputs of DAG tasks and memoized outputs are added to it
+        """
+        merged_execution_context = copy.copy(execution_context)
+
+        if output_execution_context is not None:
+            for (key, value) in output_execution_context.as_dict().items():
+                merged_execution_context.set(key, value)
+
+        return merged_execution_context
+
     def reschedule_flow_execution(self,flow_execution_id: int) -> None:
         self.flow_service.update_flow_status(flow_execution_id, FlowStatus.RESCHEDULED, None)
     
-    def re_run_flow(self) -> None:
-        self.run_flow(FlowStatus.RESCHEDULED)
+    def re_run_flow(self) -> int:
+        return self.run_flow(FlowStatus.RESCHEDULED)
+
+    def get_worker_id(self) -> str:
+        return f"{os.getpid()}-{threading.get_ident()}"
 
     """ 
     TASKS 
     """
     def get_current_task(self, flow: FlowExecution) -> Task:
-        flow_template = self.get_flow_template(flow.template_name)
+        execution_plan = self.get_execution_plan(flow.template_name)
         task_index = flow.current_task_index
-        return flow_template.get_task(task_index)
+        return execution_plan.get_task(task_index)
 
     def get_next_task(self, flow: FlowExecution) -> Task:
-        flow_template = self.get_flow_template(flow.template_name)
+        execution_plan = self.get_execution_plan(flow.template_name)
         task_index = flow.current_task_index + 1
-        return flow_template.get_task(task_index)
+        return execution_plan.get_task(task_index)
+
+    def run_task(self, flow: FlowExecution, task: TaskExecution, task_index: int = None) -> tuple[TaskExecution, ExecutionContext]:
+        memo_key = self.get_task_memo_key(flow, task, task_index)
+        if memo_key is not None:
+            memoized_task_outcome = self.get_memoized_task_outcome(flow, memo_key)
+            if memoized_task_outcome is not None:
+                return memoized_task_outcome
 
-    def run_task(self, flow: FlowExecution, task: TaskExecution) -> tuple[TaskExecution, ExecutionContext]:
         input_execution_context = flow.execution_context
-        output_execution_context = None
+        timeout = self.get_task_timeout(flow, task_index)
+        cancellation_token = CancellationToken()
+        checkpoint = self.create_task_checkpoint(flow, task_index)
+
+        with self.capture_task_outcome(flow, checkpoint) as outcome:
+            if isinstance(task, AsyncTask):
+                outcome["execution_context"] = asyncio.run(self.run_async_task(task, input_execution_context, cancellation_token, checkpoint, timeout))
+            elif task.execution_mode() is TaskExecutionMode.PROCESS:
+                outcome["execution_context"] = self.process_task_executor.run(task, input_execution_context, timeout)
+            elif timeout is None:
+                outcome["execution_context"] = self.run_sync_task(task, input_execution_context, cancellation_token, checkpoint)
+            else:
+                outcome["execution_context"] = self.run_sync_task_in_thread(task, input_execution_context, cancellation_token, checkpoint, timeout)
 
-        output =  None
+        if memo_key is not None:
+            self.memoize_task_outputs(flow, task, memo_key, outcome)
+
+        return self.create_task_run_outcome(flow, outcome)
+
+    @contextmanager
+    def capture_task_outcome(self, flow: FlowExecution, checkpoint: TaskCheckpoint):
+        """
+            Times the task run within the with block, which sets the "execution_context" the task returned, and turns its errors into
+            the "output" of a FAILED task execution. Shared by the runners whatever the way they run the task.
+        """
+        outcome = {"output": None, "execution_context": None}
         try:
-            output_execution_context = task.run(input_execution_context)
+            with get_metrics().timer("flow_task_run_seconds", (("template", flow.template_name),)):
+                yield outcome
+        except TaskTimeoutError as error:
+            outcome["output"] = str(error)
         except Exception:
             # TODO - catch the exception message
-            output = "EXCEPTION MESSAGE - TODO"
-        
+            outcome["output"] = "EXCEPTION MESSAGE - TODO"
+        finally:
+            # The runner is done with the task, a timed out one that keeps running must not save its progress anymore
+            checkpoint.close()
+
+    def create_task_run_outcome(self, flow: FlowExecution, outcome: dict) -> tuple[TaskExecution, ExecutionContext]:
+        return (self.create_task_execution_outcome(flow, outcome["output"]), outcome["execution_context"])
+
+    def get_task_memo_key(self, flow: FlowExecution, task: Task, task_index: int = None) -> str:
+        if not task.memoize():
+            return None
+
+        task_index = flow.current_task_index if task_index is None else task_index
+        return hash_task_inputs(task, flow.execution_context, flow.template_name, task_index)
+
+    def select_task_outputs(self, task: Task, output_execution_context: ExecutionContext) -> ExecutionContext:
+        """
+            Only the declared outputs() are memoized, anything else in the output context may come from the flow rather than from the inputs
+        """
+        values = output_execution_context.as_dict()
+        task_outputs = ExecutionContext()
+        for data_item in task.outputs():
+            if data_item.key in values:
+                task_outputs.set(data_item.key, values[data_item.key])
+
+        return task_outputs
+
+    def get_memoized_task_outcome(self, flow: FlowExecution, memo_key: str) -> tuple[TaskExecution, ExecutionContext]:
+        """
+            Outcome of the task from its memoized outputs, None when it never ran on the same input values
+        """
+        memoized_outputs = self.flow_service.get_task_memo(memo_key)
+        return None if memoized_outputs is None else self.create_memoized_task_outcome(flow, memoized_outputs)
+
+    def memoize_task_outputs(self, flow: FlowExecution, task: Task, memo_key: str, outcome: dict) -> None:
+        if outcome["output"] is None and outcome["execution_context"] is not None:
+            self.flow_service.save_task_memo(memo_key, self.select_task_outputs(task, outcome["execution_context"]), flow.context_codec)
+
+    def create_memoized_task_outcome(self, flow: FlowExecution, memoized_outputs: ExecutionContext) -> tuple[TaskExecution, ExecutionContext]:
+        """
+            Outcome of a task that isn't run because its outputs were memoized, it SUCCEEDED and its outputs are added to the flow context
+        """
+        get_metrics().increment("flow_task_memo_hits_total", (("template", flow.template_name),))
+        return (self.create_task_execution_outcome(flow, None), self.merge_task_output(flow.execution_context, memoized_outputs))
+
+    def create_task_checkpoint(self, flow: FlowExecution, task_index: int = None) -> TaskCheckpoint:
+        """
+            Checkpoint the task reaches through TaskCheckpoint.current(), it's only read from the storage if the task loads it
+        """
+        task_index = flow.current_task_index if task_index is None else task_index
+        return TaskCheckpoint(functools.partial(self.flow_service.get_task_checkpoint, flow.execution_id, task_index),
+                              functools.partial(self.flow_service.save_task_checkpoint, flow.execution_id, task_index, codec=flow.context_codec))
+
+    def get_task_timeout(self, flow: FlowExecution, task_index: int = None) -> float:
+        execution_plan = self.get_execution_plan(flow.template_name)
+        return execution_plan.get_task_timeout(flow.current_task_index if task_index is None else task_index)
+
+    def run_sync_task(self, task: Task, execution_context: ExecutionContext, cancellation_token: CancellationToken, checkpoint: TaskCheckpoint) -> ExecutionContext:
+        with cancellation_token.activate(), checkpoint.activate():
+            return task.run(execution_context)
+
+    def run_sync_task_in_thread(self, task: Task, execution_context: ExecutionContext, cancellation_token: CancellationToken, checkpoint: TaskCheckpoint,
+                                timeout: float) -> ExecutionContext:
+        """
+            Runs the task in a daemon thread and stops waiting for it after timeout seconds.
+            A thread can't be killed: a timed out task is cancelled through its token and its eventual outcome is discarded.
+        """
+        outcome = {}
+
+        def run() -> None:
+            try:
+                outcome["execution_context"] = self.run_sync_task(task, execution_context, cancellation_token, checkpoint)
+            except BaseException as error:
+                outcome["error"] = error
+
+        task_thread = threading.Thread(target=run, name="flow-task", daemon=True)
+        task_thread.start()
+        task_thread.join(timeout)
+
+        if task_thread.is_alive():
+            cancellation_token.cancel()
+            raise TaskTimeoutError(timeout)
+
+        if "error" in outcome:
+            raise outcome["error"]
+
+        return outcome["execution_context"]
+
+    async def run_async_task(self, task: AsyncTask, execution_context: ExecutionContext, cancellation_token: CancellationToken, checkpoint: TaskCheckpoint,
+                             timeout: float) -> ExecutionContext:
+        with cancellation_token.activate(), checkpoint.activate():
+            return await self.await_task(task.run(execution_context), cancellation_token, timeout)
+
+    async def await_task(self, awaitable, cancellation_token: CancellationToken, timeout: float):
+        """
+            Waits up to timeout seconds (forever when None) for the task, cancelling it when it takes longer
+        """
+        task_future = asyncio.ensure_future(awaitable)
+        (done, _) = await asyncio.wait({task_future}, timeout=timeout)
+
+        if not done:
+            cancellation_token.cancel()
+            task_future.cancel()
+            raise TaskTimeoutError(timeout)
+
+        return task_future.result()
+
+    def create_task_execution_outcome(self, flow: FlowExecution, output: str) -> TaskExecution:
         #TODO: support a case for miss-behaved Task() subclasses that don't return
         task_status = TaskStatus.FAILED if output is not None else TaskStatus.SUCCEEDED
+        get_metrics().increment("flow_tasks_total", (("template", flow.template_name), ("status", task_status.name)))
 
         te = TaskExecution()
         te.flow_execution_id = flow.execution_id
@@ -99,6 +440,24 @@ class FlowRunner:
         te.status = task_status
         te.output = output
         
-        return (te, output_execution_context)
+        return te
+
+_default_instance: FlowRunner = None
+_default_instance_lock = threading.Lock()
+
+def get_default_instance() -> FlowRunner:
+    global _default_instance
+
+    if _default_instance is None:
+        with _default_instance_lock:
+            if _default_instance is None:
+                _default_instance = FlowRunner(flow_service.get_default_persistent_instance())
+
+    return _default_instance
+
+def __getattr__(name: str):
+    # Keeps flow_runner.default_instance working without creating it at import time
+    if name == "default_instance":
+        return get_default_instance()
 
-default_instance = FlowRunner(flow_service.default_persistent_instance)
\ No newline at end of file
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,180 @@
+import threading
+import time
+from typing import Iterable
+
+from src.model.flow import FlowStatus
+from src.runner.flow_runner import FlowRunner
+
+DEFAULT_MIN_POLL_INTERVAL: float = 0.01
+DEFAULT_MAX_POLL_INTERVAL: float = 1.0
+DEFAULT_POLL_BACKOFF_FACTOR: float = 2.0
+
+class FlowScheduler:
+    """
+        Long running loop that keeps claiming and running flows with the flow runner, in one or more worker threads.
+
+        As long as there are runnable flows they are run back to back. Once the queue is empty the workers sleep, doubling
+        the poll interval from min_poll_interval up to max_poll_interval, so an idle scheduler costs next to nothing.
+        Flows queued through the runner's FlowService wake the workers up right away. Flows queued by other processes
+        are noticed on the next poll: a poll only claims, which is a write, when the storage version changed or when
+        max_poll_interval went by, the latter so that flows whose lease expired are picked up again.
+        Idle workers also wake up when a flow held back by a retry backoff becomes runnable.
+
+        The strategies take turns being tried first, so neither fresh nor retried flows are starved by the other ones.
+    """
+    flow_runner: FlowRunner
+    workers: int
+    strategies: list[FlowStatus]
+    min_poll_interval: float
+    max_poll_interval: float
+    poll_backoff_factor: float
+    wakeup_condition: threading.Condition
+    wakeup_count: int
+    stopping: bool
+    worker_threads: list[threading.Thread]
+    next_strategy_index: int
+    last_error: Exception
+
+    def __init__(self, flow_runner: FlowRunner, workers: int = 1, strategies: Iterable[FlowStatus] = (FlowStatus.SCHEDULED, FlowStatus.RESCHEDULED),
+                 min_poll_interval: float = DEFAULT_MIN_POLL_INTERVAL, max_poll_interval: float = DEFAULT_MAX_POLL_INTERVAL,
+                 poll_backoff_factor: float = DEFAULT_POLL_BACKOFF_FACTOR):
+        if workers < 1:
+            raise ValueError(f"A scheduler needs at least one worker, got {workers}.")
+
+        if min_poll_interval <= 0 or max_poll_interval < min_poll_interval:
+            raise ValueError(f"Poll intervals must be positive with min <= max, got {min_poll_interval} and {max_poll_interval}.")
+
+        if poll_backoff_factor < 1:
+            raise ValueError(f"Poll backoff factor must be at least 1, got {poll_backoff_factor}.")
+
+        self.strategies = list(strategies)
+        for strategy in self.strategies:
+            flow_runner.flow_service.verify_runnable_strategy(strategy)
+
+        self.flow_runner = flow_runner
+        self.workers = workers
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_backoff_factor = poll_backoff_factor
+        self.wakeup_condition = threading.Condition()
+        self.wakeup_count = 0
+        self.stopping = False
+        self.worker_threads = []
+        self.next_strategy_index = 0
+        self.last_error = None
+
+    def start(self) -> None:
+        with self.wakeup_condition:
+            if self.worker_threads:
+                raise ValueError("Scheduler is already running.")
+
+            self.stopping = False
+            self.worker_threads = [threading.Thread(target=self.run, name=f"flow-scheduler-{index}", daemon=True) for index in range(self.workers)]
+
+        self.flow_runner.flow_service.add_flows_queued_listener(self.wake_up)
+        for worker_thread in self.worker_threads:
+            worker_thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        """
+            Stops the workers once they are done with the flow they are running, if any
+        """
+        with self.wakeup_condition:
+            if not self.worker_threads:
+                return
+
+            self.stopping = True
+            self.wakeup_condition.notify_all()
+
+        self.flow_runner.flow_service.remove_flows_queued_listener(self.wake_up)
+        for worker_thread in self.worker_threads:
+            worker_thread.join(timeout)
+
+        with self.wakeup_condition:
+            self.worker_threads = []
+
+    def is_running(self) -> bool:
+        return any(worker_thread.is_alive() for worker_thread in self.worker_threads)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def wake_up(self) -> None:
+        with self.wakeup_condition:
+            self.wakeup_count += 1
+            self.wakeup_condition.notify_all()
+
+    def run(self) -> None:
+        """
+            Worker loop, returns once the scheduler is stopped
+        """
+        poll_interval = self.min_poll_interval
+        seen_wakeup_count = self.wakeup_count
+
+        while not self.stopping:
+            if self.run_next_flow() is not None:
+                poll_interval = self.min_poll_interval
+                continue
+
+            storage_version = self.poll_storage(self.flow_runner.flow_service.get_storage_version)
+            next_runnable_time = self.poll_storage(self.flow_runner.flow_service.get_next_runnable_time)
+            last_claim_time = time.monotonic()
+
+            while True:
+                wait_time = poll_interval if next_runnable_time is None else max(min(poll_interval, next_runnable_time - time.time()), 0)
+
+                with self.wakeup_condition:
+                    # Wake ups that happened while claiming are not lost, the count already moved on
+                    if self.wakeup_count == seen_wakeup_count and not self.stopping:
+                        self.wakeup_condition.wait(wait_time)
+
+                    woken_up = self.wakeup_count != seen_wakeup_count
+                    seen_wakeup_count = self.wakeup_count
+
+                if self.stopping:
+                    return
+
+                if woken_up:
+                    poll_interval = self.min_poll_interval
+                    break
+
+                poll_interval = min(poll_interval * self.poll_backoff_factor, self.max_poll_interval)
+
+                if (self.poll_storage(self.flow_runner.flow_service.get_storage_version) != storage_version or
+                    time.monotonic() - last_claim_time >= self.max_poll_interval or
+                    (next_runnable_time is not None and time.time() >= next_runnable_time)):
+                    break
+
+    def run_next_flow(self) -> int:
+        """
+            Runs a flow of the first strategy, in turn order, that has one and returns its id, or None when there was nothing to run
+        """
+        first_strategy_index = self.next_strategy_index
+
+        try:
+            for offset in range(len(self.strategies)):
+                strategy_index = (first_strategy_index + offset) % len(self.strategies)
+                flow_execution_id = self.flow_runner.run_flow(self.strategies[strategy_index])
+
+                if flow_execution_id is not None:
+                    self.next_strategy_index = (strategy_index + 1) % len(self.strategies)
+                    return flow_execution_id
+        except Exception as error:
+            # The worker outlives storage errors, it backs off as if there was nothing to run
+            self.last_error = error
+
+        return None
+
+    def poll_storage(self, read_storage):
+        """
+            Returns what read_storage read, or None when it failed: like run_next_flow, the worker outlives storage errors and keeps backing off
+        """
+        try:
+            return read_storage()
+        except Exception as error:
+            self.last_error = error
+            return None
@@ -0,0 +1,68 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from enum import Enum
+from typing import Callable
+import multiprocessing
+
+from src.model.flow import FlowStatus
+from src.runner.flow_runner import FlowRunner
+
+class WorkerMode(Enum):
+    THREAD = 0
+    PROCESS = 1
+
+def drain_flows(flow_runner: FlowRunner, strategy: FlowStatus) -> int:
+    """
+        Keeps claiming and running flows until there are no more runnable flows for the strategy.
+        Returns the number of flows that were run.
+    """
+    flow_count = 0
+    while flow_runner.run_flow(strategy) is not None:
+        flow_count += 1
+
+    return flow_count
+
+def drain_flows_in_process(flow_runner_factory: Callable[[], FlowRunner], strategy: FlowStatus) -> int:
+    return drain_flows(flow_runner_factory(), strategy)
+
+class FlowWorkerPool:
+    """
+        Runs flows in parallel by having several workers claim runnable flows from the same storage.
+
+        In THREAD mode the factory is called once and the resulting FlowRunner is shared by every worker thread.
+        In PROCESS mode every worker process builds its own FlowRunner, hence the factory must be a picklable
+        module level callable and the FlowRunner must use PERSISTENT storage so that the processes share the flows.
+    """
+    flow_runner_factory: Callable[[], FlowRunner]
+    workers: int
+    mode: WorkerMode
+
+    def __init__(self, flow_runner_factory: Callable[[], FlowRunner], workers: int, mode: WorkerMode = WorkerMode.THREAD):
+        if workers < 1:
+            raise ValueError(f"A worker pool needs at least one worker, got {workers}.")
+
+        self.flow_runner_factory = flow_runner_factory
+        self.workers = workers
+        self.mode = mode
+
+    def run_flows(self, strategy: FlowStatus) -> int:
+        """
+            Runs every runnable flow for the strategy and returns the number of flows that were run.
+        """
+        with self.create_executor() as executor:
+            if self.mode is WorkerMode.THREAD:
+                flow_runner = self.flow_runner_factory()
+                futures = [executor.submit(drain_flows, flow_runner, strategy) for _ in range(self.workers)]
+            else:
+                futures = [executor.submit(drain_flows_in_process, self.flow_runner_factory, strategy) for _ in range(self.workers)]
+
+            return sum(future.result() for future in futures)
+
+    def create_executor(self) -> Executor:
+        if self.mode is WorkerMode.THREAD:
+            return ThreadPoolExecutor(max_workers=self.workers)
+
+        if self.mode is WorkerMode.PROCESS:
+            # Spawned processes never inherit the parent's open sqlite connections
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+        raise ValueError(f"Unsupported worker mode {self.mode}")
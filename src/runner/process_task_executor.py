@@ -0,0 +1,242 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait as wait_futures
+from multiprocessing import shared_memory
+import functools
+import multiprocessing
+import threading
+
+from src.model.codec import BlobReference
+from src.model.flow import ExecutionContext, Task, TaskTimeoutError
+
+DEFAULT_SHARED_MEMORY_THRESHOLD: int = 64 * 1024
+
+class SharedBuffer:
+    """
+        Stands for a large binary context value that crosses the process boundary through a shared memory segment instead of being pickled
+    """
+    name: str
+    size: int
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+def share_values(values: dict, shared_memory_threshold: int) -> tuple[dict, list[shared_memory.SharedMemory]]:
+    """
+        Copies the large binary values to new shared memory segments, which the caller has to release, and returns the values to pickle
+    """
+    shared_values = {}
+    segments = []
+
+    for (key, value) in values.items():
+        # Empty segments can't be created
+        if isinstance(value, (bytes, bytearray, memoryview)) and len(value) >= max(shared_memory_threshold, 1):
+            segment = shared_memory.SharedMemory(create=True, size=len(value))
+            segment.buf[:len(value)] = value
+            segments.append(segment)
+            value = SharedBuffer(segment.name, len(value))
+
+        shared_values[key] = value
+
+    return (shared_values, segments)
+
+def attach_shared_values(shared_values: dict) -> tuple[dict, list[shared_memory.SharedMemory]]:
+    """
+        Maps the shared buffers of the values as read only memoryviews, without copying them
+    """
+    values = {}
+    segments = []
+
+    for (key, value) in shared_values.items():
+        if isinstance(value, SharedBuffer):
+            segment = shared_memory.SharedMemory(name=value.name)
+            segments.append(segment)
+            value = segment.buf[:value.size].toreadonly()
+
+        values[key] = value
+
+    return (values, segments)
+
+def release_segments(segments: list[shared_memory.SharedMemory], unlink: bool) -> None:
+    for segment in segments:
+        try:
+            segment.close()
+        except BufferError:
+            # A memoryview of the segment is still referenced, it will be unmapped when the process exits
+            pass
+
+        if unlink:
+            segment.unlink()
+
+def run_task_in_process(task: Task, shared_values: dict, shared_memory_threshold: int) -> dict:
+    """
+        Entry point of the worker processes, returns the shared values of the output context or None if the task returned none
+    """
+    (values, input_segments) = attach_shared_values(shared_values)
+
+    try:
+        return run_task_on_values(task, values, shared_memory_threshold)
+    finally:
+        del values
+        release_segments(input_segments, unlink=False)
+
+def run_task_on_values(task: Task, values: dict, shared_memory_threshold: int) -> dict:
+    input_execution_context = ExecutionContext()
+    input_execution_context.context = values
+
+    output_execution_context = task.run(input_execution_context)
+    if output_execution_context is None:
+        return None
+
+    # Outputs are copied to their own segments, the runner process unlinks them once it has read them
+    (shared_output_values, output_segments) = share_values(output_execution_context.as_dict(), shared_memory_threshold)
+    release_segments(output_segments, unlink=False)
+
+    return shared_output_values
+
+def receive_output(shared_output_values: dict) -> ExecutionContext:
+    """
+        Builds the output context in the runner process out of the values returned by a worker process and frees their shared memory
+    """
+    if shared_output_values is None:
+        return None
+
+    (values, output_segments) = attach_shared_values(shared_output_values)
+
+    output_execution_context = ExecutionContext()
+    output_execution_context.context = {key: bytes(value) if isinstance(value, memoryview) else value for (key, value) in values.items()}
+
+    del values
+    release_segments(output_segments, unlink=True)
+
+    return output_execution_context
+
+def discard_outcome(input_segments: list[shared_memory.SharedMemory], future: Future) -> None:
+    """
+        Done callback of a timed out task: its inputs can only be released once the worker is done with them, and so is its output
+    """
+    release_segments(input_segments, unlink=True)
+
+    if not future.cancelled() and future.exception() is None and future.result() is not None:
+        release_segments(attach_shared_values(future.result())[1], unlink=True)
+
+def terminate_process_pool(process_pool: ProcessPoolExecutor, processes: list[multiprocessing.Process], futures: list[Future]) -> None:
+    """
+        Waits for the given tasks of a retired pool, then terminates its worker processes, the stuck ones included
+    """
+    wait_futures(futures)
+
+    for process in processes:
+        process.terminate()
+
+    process_pool.shutdown(wait=False, cancel_futures=True)
+
+class ProcessTaskExecutor:
+    """
+        Runs the run() method of ProcessTask instances in a pool of worker processes while the flow state machine stays in the runner process.
+        Large binary values of the contexts, blobs included, go through shared memory segments, everything else is pickled.
+        The pool is spawned, and its processes started, on the first task.
+        A worker process running a timed out task can't be told to stop: its pool is retired, new tasks go to a new pool,
+        and the retired pool is terminated as soon as its other tasks are done.
+    """
+    workers: int
+    shared_memory_threshold: int
+    process_pool: ProcessPoolExecutor
+    process_pool_lock: threading.Lock
+    pool_futures: dict[ProcessPoolExecutor, set[Future]]
+    retired_process_pools: list[ProcessPoolExecutor]
+
+    def __init__(self, workers: int = None, shared_memory_threshold: int = DEFAULT_SHARED_MEMORY_THRESHOLD):
+        if workers is not None and workers < 1:
+            raise ValueError(f"A process task executor needs at least one worker, got {workers}.")
+
+        self.workers = workers
+        self.shared_memory_threshold = shared_memory_threshold
+        self.process_pool = None
+        self.process_pool_lock = threading.Lock()
+        self.pool_futures = {}
+        self.retired_process_pools = []
+
+    def run(self, task: Task, execution_context: ExecutionContext, timeout: float = None) -> ExecutionContext:
+        # Blobs are loaded here as the repository behind the blob loader can't cross the process boundary
+        values = {key: execution_context.get(key) if isinstance(value, BlobReference) else value
+                    for (key, value) in execution_context.as_dict().items()}
+        (shared_values, input_segments) = share_values(values, self.shared_memory_threshold)
+
+        try:
+            (process_pool, future) = self.submit(task, shared_values)
+
+            try:
+                shared_output_values = future.result(timeout)
+            except FutureTimeoutError:
+                # The worker process may not even have attached the inputs yet: both the inputs and the output
+                # of the task are freed once it's done, or once its worker is terminated
+                future.add_done_callback(functools.partial(discard_outcome, input_segments))
+                input_segments = []
+                self.retire_process_pool(process_pool, future)
+                raise TaskTimeoutError(timeout)
+
+            return receive_output(shared_output_values)
+        finally:
+            release_segments(input_segments, unlink=True)
+
+    def submit(self, task: Task, shared_values: dict) -> tuple[ProcessPoolExecutor, Future]:
+        with self.process_pool_lock:
+            if self.process_pool is None:
+                # Spawned processes never inherit the parent's open sqlite connections
+                self.process_pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+                self.pool_futures[self.process_pool] = set()
+
+            process_pool = self.process_pool
+            future = process_pool.submit(run_task_in_process, task, shared_values, self.shared_memory_threshold)
+            self.pool_futures[process_pool].add(future)
+
+        future.add_done_callback(functools.partial(self.forget_future, process_pool))
+        return (process_pool, future)
+
+    def forget_future(self, process_pool: ProcessPoolExecutor, future: Future) -> None:
+        with self.process_pool_lock:
+            self.pool_futures.get(process_pool, set()).discard(future)
+
+    def retire_process_pool(self, process_pool: ProcessPoolExecutor, timed_out_future: Future) -> None:
+        """
+            Keeps the worker stuck on the timed out task from holding a slot of the pool for good. A pool that was already retired,
+            whose other tasks are then stuck too, is terminated right away.
+        """
+        with self.process_pool_lock:
+            if self.process_pool is process_pool:
+                self.process_pool = None
+
+            if process_pool not in self.retired_process_pools:
+                self.retired_process_pools.append(process_pool)
+
+            other_futures = [future for future in self.pool_futures.pop(process_pool, set()) if future is not timed_out_future]
+            # The pool forgets its processes once they are gone, they are listed while they still run
+            processes = list((process_pool._processes or {}).values())
+
+        threading.Thread(target=self.terminate_retired_process_pool, args=(process_pool, processes, other_futures), name="process-pool-terminator", daemon=True).start()
+
+    def terminate_retired_process_pool(self, process_pool: ProcessPoolExecutor, processes: list[multiprocessing.Process], futures: list[Future]) -> None:
+        terminate_process_pool(process_pool, processes, futures)
+
+        with self.process_pool_lock:
+            if process_pool in self.retired_process_pools:
+                self.retired_process_pools.remove(process_pool)
+
+    def close(self) -> None:
+        """
+            Waits for the tasks of the current pool, retired pools are terminated without waiting for their stuck workers
+        """
+        with self.process_pool_lock:
+            retired_process_pools = self.retired_process_pools
+            self.retired_process_pools = []
+            process_pool = self.process_pool
+            self.process_pool = None
+            self.pool_futures = {}
+
+        for retired_process_pool in retired_process_pools:
+            terminate_process_pool(retired_process_pool, list((retired_process_pool._processes or {}).values()), [])
+
+        if process_pool is not None:
+            process_pool.shutdown(wait=True)
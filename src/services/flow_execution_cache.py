@@ -0,0 +1,80 @@
+from collections import OrderedDict
+import copy
+import threading
+
+from src.model.flow import FlowExecution
+
+DEFAULT_FLOW_CACHE_SIZE: int = 1000
+
+def copy_flow_execution(flow_execution: FlowExecution) -> FlowExecution:
+    """
+        Callers are free to change the flow, and its context, they get without altering the cached one.
+        Copying an execution context that wasn't decoded yet only copies a reference to its payload.
+    """
+    flow_execution_copy = copy.copy(flow_execution)
+    if flow_execution.execution_context is not None:
+        flow_execution_copy.execution_context = copy.copy(flow_execution.execution_context)
+
+    return flow_execution_copy
+
+class FlowExecutionCache:
+    """
+        Bounded, thread safe, map of the latest FlowExecution per id that evicts the least recently used flows first.
+        A capacity of 0 disables the cache.
+    """
+    capacity: int
+    flow_executions: OrderedDict[int, FlowExecution]
+    lock: threading.Lock
+
+    def __init__(self, capacity: int = DEFAULT_FLOW_CACHE_SIZE):
+        if capacity < 0:
+            raise ValueError(f"Flow cache capacity can't be negative, got {capacity}.")
+
+        self.capacity = capacity
+        self.flow_executions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.flow_executions)
+
+    def __contains__(self, flow_execution_id: int) -> bool:
+        return flow_execution_id in self.flow_executions
+
+    def get(self, flow_execution_id: int) -> FlowExecution:
+        with self.lock:
+            flow_execution = self.flow_executions.get(flow_execution_id)
+            if flow_execution is None:
+                return None
+
+            self.flow_executions.move_to_end(flow_execution_id)
+
+        return copy_flow_execution(flow_execution)
+
+    def put(self, flow_execution: FlowExecution) -> None:
+        if self.capacity == 0:
+            return
+
+        flow_execution = copy_flow_execution(flow_execution)
+        with self.lock:
+            self.flow_executions[flow_execution.execution_id] = flow_execution
+            self.flow_executions.move_to_end(flow_execution.execution_id)
+
+            while len(self.flow_executions) > self.capacity:
+                self.flow_executions.popitem(last=False)
+
+    def replace(self, flow_execution: FlowExecution) -> None:
+        """
+            Write through of a new version of the flow, flows that are not cached stay out of the cache
+        """
+        flow_execution = copy_flow_execution(flow_execution)
+        with self.lock:
+            if flow_execution.execution_id in self.flow_executions:
+                self.flow_executions[flow_execution.execution_id] = flow_execution
+
+    def evict(self, flow_execution_id: int) -> None:
+        with self.lock:
+            self.flow_executions.pop(flow_execution_id, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.flow_executions.clear()
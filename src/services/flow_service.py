@@ -1,10 +1,22 @@
+from contextlib import contextmanager
 import copy
+import itertools
+import threading
 import time
-from src.model.flow import ExecutionContext, FlowExecution, FlowStatus, PersistenceMode, TaskExecution, TaskStatus
+from typing import Callable, Iterable, Iterator
+from src.model.codec import JSON_CODEC, ExecutionContextCodec
+from src.model.flow import Durability, ExecutionContext, FlowExecution, FlowStatus, FlowSummary, PersistenceMode, TaskExecution, TaskStatus
+from src.model.metrics import MetricsRegistry
 from src.repositories import flow_repository
+from src.repositories.flow_repository import DEFAULT_COMPACTION_BATCH_SIZE, DEFAULT_PAGE_SIZE
+from src.services.flow_execution_cache import DEFAULT_FLOW_CACHE_SIZE, FlowExecutionCache
+
+DEFAULT_SCHEDULE_BATCH_SIZE: int = 1000
 
 class FlowService:
     flow_repository = None
+    flows_queued_listeners = None
+    flow_cache = None
     
     allowed_flow_transitions = {
         FlowStatus.CREATED: [FlowStatus.SCHEDULED],
@@ -14,45 +26,197 @@ class FlowService:
         FlowStatus.RESCHEDULED: [FlowStatus.RUNNING]
     }
 
-    def __init__(self, persistence: PersistenceMode):
-        if(persistence is PersistenceMode.PERSISTENT):
-            self.flow_repository = flow_repository.default_persistent_instance
+    """
+        A PERSISTENT service shares the default repository unless it is given a durability or a storage_file_name,
+        it then gets its own repository so that the durability of the other services is left alone
+    """
+    def __init__(self, persistence: PersistenceMode, durability: Durability = None, flow_cache_size: int = DEFAULT_FLOW_CACHE_SIZE, storage_file_name: str = None):
+        if(storage_file_name is not None):
+            if(persistence is not PersistenceMode.PERSISTENT):
+                raise ValueError(f"Only the {PersistenceMode.PERSISTENT} mode can be given a storage file, got {persistence}.")
+
+            self.flow_repository = flow_repository.FlowRepository(storage_file_name, durability or Durability.FULL)
+        elif(persistence is PersistenceMode.PERSISTENT and durability is None):
+            self.flow_repository = flow_repository.get_default_persistent_instance()
         else:
-            self.flow_repository = flow_repository.FlowRepository.from_persistence_mode(persistence)
+            self.flow_repository = flow_repository.FlowRepository.from_persistence_mode(persistence, durability or Durability.FULL)
+
+        self.flows_queued_listeners = []
+        self.flow_cache = FlowExecutionCache(flow_cache_size)
+
+    """
+        Groups every change made through the service inside the with block in a single commit
+    """
+    @contextmanager
+    def transaction(self):
+        try:
+            with self.flow_repository.transaction():
+                yield self
+        except BaseException:
+            # Rolled back writes might have gone through the cache already
+            self.flow_cache.clear()
+            raise
+
+    def flush(self) -> None:
+        self.flow_repository.flush()
+
+    def get_storage_version(self) -> int:
+        """
+            Changes whenever the storage is written through another FlowService, possibly in another process
+        """
+        return self.flow_repository.get_data_version()
+
+    """
+        Listeners are called, without arguments, every time flows are queued to be run through this service
+    """
+    def add_flows_queued_listener(self, listener: Callable[[], None]) -> None:
+        self.flows_queued_listeners.append(listener)
+
+    def remove_flows_queued_listener(self, listener: Callable[[], None]) -> None:
+        self.flows_queued_listeners.remove(listener)
+
+    def notify_flows_queued(self) -> None:
+        for listener in list(self.flows_queued_listeners):
+            listener()
 
     """
     FLOWS
     """
-    def create_flow_execution(self, template_name: str, execution_context: ExecutionContext) -> FlowExecution:
+    def create_flow_execution(self, template_name: str, execution_context: ExecutionContext, priority: int = 0, context_codec: ExecutionContextCodec = JSON_CODEC) -> FlowExecution:
+        flow_execution = self.__new_flow_execution(self.generate_flow_execution_id(), template_name, execution_context, priority, context_codec)
+
+        db_flow_execution = self.flow_repository.save_flow(flow_execution)
+
+        return db_flow_execution
+
+    def create_scheduled_flow_executions(self, template_name: str, execution_contexts: Iterable[ExecutionContext], priority: int = 0,
+                                         context_codec: ExecutionContextCodec = JSON_CODEC, batch_size: int = DEFAULT_SCHEDULE_BATCH_SIZE) -> list[int]:
+        """
+            Creates and schedules a flow for every context in a single transaction and returns their ids in the contexts order.
+            Contexts are consumed batch_size at a time, so a generator never has to be held in memory as a whole.
+        """
+        if(batch_size < 1):
+            raise ValueError(f"Batch size must be at least 1, got {batch_size}")
+
+        execution_ids = []
+        execution_contexts = iter(execution_contexts)
+
+        with self.transaction():
+            while(batch := list(itertools.islice(execution_contexts, batch_size))):
+                first_execution_id = self.flow_repository.reserve_flow_execution_ids(len(batch))
+                flow_executions = []
+
+                for (execution_id, execution_context) in enumerate(batch, first_execution_id):
+                    created_flow_execution = self.__new_flow_execution(execution_id, template_name, execution_context, priority, context_codec)
+
+                    # Same outcome as update_flow_status from CREATED to SCHEDULED, without reading the flow back
+                    scheduled_flow_execution = copy.copy(created_flow_execution)
+                    scheduled_flow_execution.status = FlowStatus.SCHEDULED
+                    scheduled_flow_execution.execution_step = created_flow_execution.execution_step + 1
+                    scheduled_flow_execution.timestamp = time.time()
+
+                    flow_executions.extend([created_flow_execution, scheduled_flow_execution])
+
+                self.flow_repository.save_new_flows(flow_executions)
+                execution_ids.extend(range(first_execution_id, first_execution_id + len(batch)))
+
+        if(execution_ids):
+            self.notify_flows_queued()
+
+        return execution_ids
+
+    def __new_flow_execution(self, execution_id: int, template_name: str, execution_context: ExecutionContext, priority: int, context_codec: ExecutionContextCodec) -> FlowExecution:
         flow_execution = FlowExecution()
         flow_execution.status = FlowStatus.CREATED
+        flow_execution.priority = priority
+        flow_execution.context_codec = context_codec
         flow_execution.template_name = template_name
-        flow_execution.execution_id = self.generate_flow_execution_id()
+        flow_execution.execution_id = execution_id
         flow_execution.execution_context = copy.copy(execution_context)
         flow_execution.timestamp = time.time()
 
-        db_flow_execution = self.flow_repository.save_flow(flow_execution)
-
-        return db_flow_execution
+        return flow_execution
 
     def generate_flow_execution_id(self) -> int:
-        return self.flow_repository.get_max_flow_execution_id()
+        return self.flow_repository.reserve_flow_execution_ids()
 
     def get_flow_execution(self, flow_execution_id: int) -> FlowExecution:
-        flow = self.flow_repository.get_flow(flow_execution_id)
+        flow = self.__get_flow(flow_execution_id)
         if(flow is None):
             raise ValueError(f"Flow with id {flow_execution_id} does not exist!")
 
         return flow
 
+    """
+        Flows leased through this service are read from the flow cache: while the lease holds, every write to the flow goes through this service.
+        The cache entry is dropped when the flow is released, so other flows are always read from the storage.
+    """
+    def __get_flow(self, flow_execution_id: int) -> FlowExecution:
+        flow = self.flow_cache.get(flow_execution_id)
+        if(flow is None):
+            flow = self.flow_repository.get_flow(flow_execution_id)
+
+        return flow
+
+    def invalidate_cached_flow_execution(self, flow_execution_id: int) -> None:
+        """
+            Makes the next reads of the flow go to the storage, e.g. after it was changed outside of this service while leased
+        """
+        self.flow_cache.evict(flow_execution_id)
+
+    def get_flow_execution_history(self, flow_execution_id: int) -> list[FlowExecution]:
+        flow = self.get_flow_execution(flow_execution_id)
+        return self.flow_repository.get_flow_history(flow_execution_id)
+
     def get_runnable_flow(self, strategy: FlowStatus) -> FlowExecution:
+        self.verify_runnable_strategy(strategy)
+
+        return self.flow_repository.get_run_candidate_flow(strategy)
+
+    def claim_runnable_flow(self, strategy: FlowStatus, owner: str, lease_duration: float) -> FlowExecution:
+        self.verify_runnable_strategy(strategy)
+
+        now = time.time()
+        flow = self.flow_repository.claim_run_candidate_flow(strategy, owner, now + lease_duration, now)
+
+        if(flow is not None):
+            self.flow_cache.put(flow)
+
+        return flow
+
+    def get_next_runnable_time(self) -> float:
+        """
+            Earliest time at which a flow that is held back, e.g. waiting for a retry, becomes runnable. None if there is none.
+        """
+        return self.flow_repository.get_next_not_before(time.time())
+
+    def release_flow(self, flow_execution_id: int, owner: str) -> None:
+        self.flow_cache.evict(flow_execution_id)
+        self.flow_repository.release_flow_lease(flow_execution_id, owner)
+
+    def verify_runnable_strategy(self, strategy: FlowStatus) -> None:
         if(strategy != FlowStatus.SCHEDULED and strategy != FlowStatus.RESCHEDULED):
             raise ValueError(f"Provided '{strategy}' is invalid for getting a runnable flow. Only '{FlowStatus.SCHEDULED}' and '{FlowStatus.RESCHEDULED}' FlowStatuses can be run.")
 
-        return self.flow_repository.get_run_candidate_flow(strategy)
+    """
+        completed_task is the index of a task of a DAG flow whose completion comes with this update.
+        not_before holds a SCHEDULED or RESCHEDULED flow back, it isn't run before that time.
+    """
+    def update_flow_status(self, flow_id, target_flow_status: FlowStatus, execution_context: ExecutionContext, completed_task: int = None,
+                           not_before: float = None) -> FlowExecution:
+        if(not_before is not None and target_flow_status != FlowStatus.SCHEDULED and target_flow_status != FlowStatus.RESCHEDULED):
+            raise ValueError(f"Only '{FlowStatus.SCHEDULED}' and '{FlowStatus.RESCHEDULED}' flows can be held back, got '{target_flow_status}'")
+
+        with self.transaction():
+            new_flow_execution = self.__update_flow_status(flow_id, target_flow_status, execution_context, completed_task, not_before)
+
+        if(target_flow_status == FlowStatus.SCHEDULED or target_flow_status == FlowStatus.RESCHEDULED):
+            self.notify_flows_queued()
 
-    def update_flow_status(self, flow_id, target_flow_status: FlowStatus, execution_context: ExecutionContext) -> FlowExecution:
-        flow_execution = self.flow_repository.get_flow(flow_id)
+        return new_flow_execution
+
+    def __update_flow_status(self, flow_id, target_flow_status: FlowStatus, execution_context: ExecutionContext, completed_task: int, not_before: float) -> FlowExecution:
+        flow_execution = self.__get_flow(flow_id)
         origin_flow_status = flow_execution.status
 
         allowed_targets = self.allowed_flow_transitions.get(origin_flow_status)
@@ -87,8 +251,37 @@ class FlowService:
                 new_flow_execution.current_task_index = flow_execution.current_task_index
             else:
                 new_flow_execution.current_task_index = flow_execution.current_task_index + 1
+
+            if(origin_flow_status != FlowStatus.RUNNING):
+                new_flow_execution.attempt = flow_execution.attempt + 1
+
+        new_flow_execution.not_before = not_before
+
+        if(completed_task is not None):
+            new_flow_execution.completed_tasks = flow_execution.completed_tasks | {completed_task}
         
-        return self.flow_repository.save_flow(new_flow_execution)
+        db_flow_execution = self.flow_repository.save_flow(new_flow_execution)
+        self.flow_cache.replace(db_flow_execution)
+
+        return db_flow_execution
+
+    """
+    METRICS
+    """
+    def collect_metrics(self, metrics: MetricsRegistry) -> None:
+        """
+            Metrics collector, see MetricsRegistry.add_collector, setting the number of flows and the age of the oldest one per flow status.
+            For SCHEDULED and RESCHEDULED flows these are the depth of the queue and the longest waiting time in it.
+        """
+        flow_status_stats = self.flow_repository.get_flow_status_stats()
+        now = time.time()
+
+        for flow_status in FlowStatus:
+            (flow_count, oldest_timestamp) = flow_status_stats.get(flow_status, (0, None))
+            labels = (("status", flow_status.name),)
+
+            metrics.set_gauge("flow_status_flows", flow_count, labels)
+            metrics.set_gauge("flow_status_oldest_age_seconds", 0 if oldest_timestamp is None else now - oldest_timestamp, labels)
 
     """
     TASKS
@@ -109,7 +302,7 @@ class FlowService:
     
     #TODO: support task class name, check transitions and matching of the flow execution steps with the passed task
     def update_task_execution(self, flow_execution_id: int, task: TaskExecution) -> TaskExecution:
-        flow: FlowExecution = self.flow_repository.get_flow(flow_execution_id)
+        flow: FlowExecution = self.__get_flow(flow_execution_id)
         task.timestamp = time.time()
 
         if(flow.status != FlowStatus.RUNNING):
@@ -124,4 +317,92 @@ class FlowService:
         flow = self.get_flow_execution(flow_execution_id)
         return self.flow_repository.get_flow_task_execution_history(flow_execution_id)
 
-default_persistent_instance = FlowService(PersistenceMode.PERSISTENT)
\ No newline at end of file
+    def get_flow_task_execution_page(self, flow_execution_id: int, after: int = None, limit: int = DEFAULT_PAGE_SIZE) -> tuple[list[TaskExecution], int]:
+        flow = self.get_flow_execution(flow_execution_id)
+        return self.flow_repository.get_flow_task_execution_page(flow_execution_id, after, limit)
+
+    def iterate_flow_task_execution_history(self, flow_execution_id: int, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[TaskExecution]:
+        """
+            Streams the task executions of a flow page by page, the flow existence is checked right away and not on first iteration
+        """
+        flow = self.get_flow_execution(flow_execution_id)
+        return self.flow_repository.iterate_flow_task_executions(flow_execution_id, page_size)
+
+    """
+    CHECKPOINTS AND MEMOS
+    """
+    def save_task_checkpoint(self, flow_execution_id: int, task_index: int, state, codec: ExecutionContextCodec = JSON_CODEC) -> None:
+        self.flow_repository.save_task_checkpoint(flow_execution_id, task_index, state, codec)
+
+    def get_task_checkpoint(self, flow_execution_id: int, task_index: int):
+        return self.flow_repository.get_task_checkpoint(flow_execution_id, task_index)
+
+    def save_task_memo(self, input_hash: str, output_execution_context: ExecutionContext, codec: ExecutionContextCodec = JSON_CODEC) -> None:
+        self.flow_repository.save_task_memo(input_hash, output_execution_context, codec)
+
+    def get_task_memo(self, input_hash: str) -> ExecutionContext:
+        """
+            Returns the outputs memoized for the hash of the inputs of a task, None if the task was never run on them
+        """
+        return self.flow_repository.get_task_memo(input_hash)
+
+    def delete_task_memos(self, older_than: float) -> int:
+        """
+            Deletes the memos stored before older_than, and the blobs only they referenced, and returns how many memos were deleted
+        """
+        deleted_memos = self.flow_repository.delete_task_memos(older_than)
+        if(deleted_memos > 0):
+            self.flow_repository.delete_unreferenced_blobs()
+
+        return deleted_memos
+
+    """
+    COMPACTION
+    """
+    def compact_finished_flows(self, older_than: float, batch_size: int = DEFAULT_COMPACTION_BATCH_SIZE, after: tuple[float, int] = None,
+                               archive_file_name: str = None, compress: bool = False) -> tuple[int, tuple[float, int]]:
+        return self.flow_repository.compact_finished_flows(older_than, batch_size, after, archive_file_name, compress)
+
+    def delete_unreferenced_blobs(self) -> int:
+        return self.flow_repository.delete_unreferenced_blobs()
+
+    def get_flow_summary(self, flow_execution_id: int) -> FlowSummary:
+        """
+            Returns the summary of a compacted flow or None if the flow was not compacted
+        """
+        flow = self.get_flow_execution(flow_execution_id)
+        return self.flow_repository.get_flow_summary(flow_execution_id)
+
+    """
+    FLOW LISTING
+    """
+    def list_flows(self, status: FlowStatus = None, template_name: str = None, since: float = None, until: float = None,
+                   after: tuple[float, int] = None, limit: int = DEFAULT_PAGE_SIZE) -> tuple[list[FlowExecution], tuple[float, int]]:
+        """
+            Returns a page of flows in their latest state, ordered by last change, along with the cursor of the next page (None on the last page)
+        """
+        return self.flow_repository.get_flow_page(status, template_name, since, until, after, limit)
+
+    def iterate_flows(self, status: FlowStatus = None, template_name: str = None, since: float = None, until: float = None,
+                      page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[FlowExecution]:
+        return self.flow_repository.iterate_flows(status, template_name, since, until, page_size)
+
+_default_persistent_instance: FlowService = None
+_default_persistent_instance_lock = threading.Lock()
+
+def get_default_persistent_instance() -> FlowService:
+    global _default_persistent_instance
+
+    if _default_persistent_instance is None:
+        with _default_persistent_instance_lock:
+            if _default_persistent_instance is None:
+                _default_persistent_instance = FlowService(PersistenceMode.PERSISTENT)
+
+    return _default_persistent_instance
+
+def __getattr__(name: str):
+    # Keeps flow_service.default_persistent_instance working without creating it at import time
+    if name == "default_persistent_instance":
+        return get_default_persistent_instance()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
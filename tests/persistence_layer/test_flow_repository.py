@@ -1,15 +1,41 @@
-from src.model.flow import ExecutionContext, FlowExecution, FlowStatus, PersistenceMode
-from src.repositories.flow_repository import FlowRepository
+from src.model.flow import Durability, ExecutionContext, FlowExecution, FlowStatus, TaskStatus
+from src.model.codec import JSON_CODEC, PICKLE_CODEC
+from src.repositories.flow_repository import DEFAULT_PERSISTENT_STORAGE_FILENAME, FlowRepository
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
 import pytest
 
+def create_flow(execution_id: int, status: FlowStatus) -> FlowExecution:
+    flow = FlowExecution()
+    flow.template_name = "name"
+    flow.status = status
+    flow.execution_id = execution_id
+    flow.execution_step = 1
+    flow.timestamp = 5
+
+    return flow
+
+def count_committed_flows(storage_file_name: str) -> int:
+    connection = sqlite3.connect(storage_file_name)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM flow_states").fetchone()[0]
+    finally:
+        connection.close()
+
 class TestPersistentFlowRepository:
     subject = None
+    storage_file_name = None
 
     @pytest.fixture(autouse=True)
-    def before_tests(self):
-        self.subject: FlowRepository = FlowRepository.from_persistence_mode(PersistenceMode.PERSISTENT)
+    def before_tests(self, tmp_path):
+        self.storage_file_name = str(tmp_path / DEFAULT_PERSISTENT_STORAGE_FILENAME)
+        self.subject: FlowRepository = FlowRepository(self.storage_file_name)
         yield
-        self.subject.clear_storage()
+        self.subject.close()
 
     def test_persistent_repository_usage(self):
         # Given
@@ -42,4 +68,422 @@ class TestPersistentFlowRepository:
         assert(saved_flow.timestamp == retrieved_flow.timestamp)
 
         assert(saved_flow.execution_context.get("some_field") == retrieved_flow.execution_context.get("some_field"))
-        assert(saved_flow.execution_context.get("another_field") == retrieved_flow.execution_context.get("another_field"))
\ No newline at end of file
+        assert(saved_flow.execution_context.get("another_field") == retrieved_flow.execution_context.get("another_field"))
+
+    def test_claimed_flow_is_not_claimed_twice(self):
+        # Given
+        flow = FlowExecution()
+        flow.template_name = "name"
+        flow.status = FlowStatus.SCHEDULED
+        flow.execution_id = 1
+        flow.execution_step = 1
+        flow.timestamp = 5
+        self.subject.save_flow(flow)
+
+        # When
+        first_claim = self.subject.claim_run_candidate_flow(FlowStatus.SCHEDULED, "first_worker", 100, 10)
+        second_claim = self.subject.claim_run_candidate_flow(FlowStatus.SCHEDULED, "second_worker", 100, 10)
+
+        # Then
+        assert(first_claim.execution_id == flow.execution_id)
+        assert(second_claim is None)
+
+        # An expired lease can be claimed by another worker
+        expired_claim = self.subject.claim_run_candidate_flow(FlowStatus.SCHEDULED, "second_worker", 200, 150)
+        assert(expired_claim.execution_id == flow.execution_id)
+
+    def test_held_back_flow_is_only_claimed_once_due(self):
+        # Given
+        flow = create_flow(1, FlowStatus.RESCHEDULED)
+        flow.attempt = 1
+        flow.not_before = 50
+        self.subject.save_flow(flow)
+
+        # When
+        early_claim = self.subject.claim_run_candidate_flow(FlowStatus.RESCHEDULED, "worker", 100, 10)
+        next_not_before = self.subject.get_next_not_before(10)
+        due_claim = self.subject.claim_run_candidate_flow(FlowStatus.RESCHEDULED, "worker", 100, 50)
+
+        # Then
+        assert(early_claim is None)
+        assert(next_not_before == 50)
+        assert(due_claim.execution_id == flow.execution_id)
+        assert(due_claim.attempt == 1)
+        assert(due_claim.not_before == 50)
+
+    def test_transaction_discards_every_write_of_a_failed_unit(self):
+        # Given
+        flow = create_flow(1, FlowStatus.SCHEDULED)
+
+        # When
+        with pytest.raises(ValueError):
+            with self.subject.transaction():
+                self.subject.save_flow(flow)
+                raise ValueError("Step failed")
+
+        # Then
+        assert(self.subject.get_flow(flow.execution_id) is None)
+        assert(self.subject.get_run_candidate_flow(FlowStatus.SCHEDULED) is None)
+
+    def test_group_commit_defers_commit_until_flush(self):
+        # Given
+        self.subject.set_durability(Durability.GROUP_COMMIT, group_commit_size=100, group_commit_interval=1000)
+
+        # When
+        with self.subject.transaction():
+            self.subject.save_flow(create_flow(1, FlowStatus.SCHEDULED))
+        self.subject.save_flow(create_flow(2, FlowStatus.SCHEDULED))
+
+        # Then
+        assert(self.subject.get_flow(2) is not None)
+        assert(count_committed_flows(self.storage_file_name) == 0)
+
+        self.subject.flush()
+        assert(count_committed_flows(self.storage_file_name) == 2)
+
+        self.subject.set_durability(Durability.FULL)
+
+    def test_group_commit_interval_bounds_how_long_units_stay_pending(self):
+        # Given
+        self.subject.set_durability(Durability.GROUP_COMMIT, group_commit_size=100, group_commit_interval=0.05)
+
+        # When
+        self.subject.save_flow(create_flow(1, FlowStatus.SCHEDULED))
+        pending_flows = count_committed_flows(self.storage_file_name)
+        # No other unit of work follows, e.g. while a long task runs
+        time.sleep(0.2)
+
+        # Then
+        assert(pending_flows == 0)
+        assert(count_committed_flows(self.storage_file_name) == 1)
+
+    def test_history_stores_context_deltas_between_snapshots(self):
+        # Given
+        self.subject.snapshot_interval = 4
+        large_value = "x" * 10000
+
+        flow = create_flow(1, FlowStatus.RUNNING)
+        flow.execution_context.set("large_value", large_value)
+
+        # When
+        for step in range(1, 10):
+            flow.execution_step = step
+            flow.execution_context.set(f"output_{step}", step)
+            self.subject.save_flow(flow)
+
+        # Then
+        cursor = self.subject.connection.cursor()
+        cursor.execute("SELECT context_is_delta, LENGTH(execution_context) FROM flow_executions WHERE execution_id = 1 ORDER BY rowid")
+        rows = cursor.fetchall()
+
+        assert([row[0] for row in rows] == [0, 1, 1, 1, 0, 1, 1, 1, 0])
+        assert(all(row[1] < 100 for row in rows if row[0] == 1))
+
+        history = self.subject.get_flow_history(1)
+        assert(len(history) == 9)
+        for (index, flow_execution) in enumerate(history):
+            step = index + 1
+            assert(flow_execution.execution_step == step)
+            assert(flow_execution.execution_context.get("large_value") == large_value)
+            assert(flow_execution.execution_context.get(f"output_{step}") == step)
+            assert(f"output_{step + 1}" not in flow_execution.execution_context.as_dict())
+
+        assert(self.subject.get_flow(1).execution_context.get("output_9") == 9)
+
+    def test_history_of_contexts_with_non_string_keys_is_rebuilt_as_saved(self):
+        # Given
+        self.subject.snapshot_interval = 4
+        large_value = "x" * 10000
+
+        flow = create_flow(1, FlowStatus.RUNNING)
+        flow.execution_context.set("large_value", large_value)
+        flow.execution_context.set(1, "one")
+
+        # When
+        for step in range(1, 6):
+            flow.execution_step = step
+            flow.execution_context.set("step", step)
+            self.subject.save_flow(flow)
+
+        # Then
+        history = self.subject.get_flow_history(1)
+        assert(len(history) == 5)
+        for (index, flow_execution) in enumerate(history):
+            assert(flow_execution.execution_context.as_dict() == {"large_value": large_value, "1": "one", "step": index + 1})
+
+    def test_large_binary_values_are_stored_once_in_the_blob_store(self):
+        # Given
+        self.subject.blob_threshold = 1024
+        large_value = bytes(range(256)) * 64
+
+        first_flow = create_flow(1, FlowStatus.SCHEDULED)
+        first_flow.execution_context.set("artifact", large_value)
+        second_flow = create_flow(2, FlowStatus.SCHEDULED)
+        second_flow.execution_context.set("artifact", bytearray(large_value))
+        second_flow.execution_context.set("small_value", "small")
+
+        # When
+        self.subject.save_flow(first_flow)
+        self.subject.save_flow(second_flow)
+
+        # Then
+        cursor = self.subject.connection.cursor()
+        assert(cursor.execute("SELECT COUNT(*) FROM context_blobs").fetchone()[0] == 1)
+        assert(cursor.execute("SELECT MAX(LENGTH(execution_context)) FROM flow_executions").fetchone()[0] < 1024)
+
+        retrieved_flow = self.subject.get_flow(2)
+        loaded_hashes = []
+        blob_loader = retrieved_flow.execution_context.blob_loader
+        retrieved_flow.execution_context.blob_loader = lambda hash: loaded_hashes.append(hash) or blob_loader(hash)
+
+        assert(retrieved_flow.execution_context.get("small_value") == "small")
+        assert(len(loaded_hashes) == 0)
+
+        artifact = retrieved_flow.execution_context.get("artifact")
+        assert(type(artifact) is memoryview)
+        assert(artifact == large_value)
+        assert(retrieved_flow.execution_context.get("artifact") is artifact)
+        assert(len(loaded_hashes) == 1)
+
+    def test_task_checkpoints_are_kept_until_the_flow_succeeded(self):
+        # Given
+        flow = create_flow(1, FlowStatus.RUNNING)
+        self.subject.save_flow(flow)
+
+        # When
+        self.subject.save_task_checkpoint(1, 0, {"offset": 10}, JSON_CODEC)
+        self.subject.save_task_checkpoint(1, 0, {"offset": 20}, JSON_CODEC)
+        self.subject.save_task_checkpoint(1, 1, b"state", PICKLE_CODEC)
+
+        # Then
+        assert(self.subject.get_task_checkpoint(1, 0) == {"offset": 20})
+        assert(self.subject.get_task_checkpoint(1, 1) == b"state")
+        assert(self.subject.get_task_checkpoint(1, 2) is None)
+
+        flow.status = FlowStatus.SUCCEEDED
+        flow.execution_step = 2
+        self.subject.save_flow(flow)
+        assert(self.subject.get_task_checkpoint(1, 0) is None)
+        assert(self.subject.get_task_checkpoint(1, 1) is None)
+
+    def test_task_memos_store_large_outputs_in_the_blob_store(self):
+        # Given
+        self.subject.blob_threshold = 1024
+        large_value = bytes(range(256)) * 64
+
+        output_execution_context = ExecutionContext()
+        output_execution_context.set("artifact", large_value)
+        output_execution_context.set("small_value", "small")
+
+        # When
+        self.subject.save_task_memo("some_hash", output_execution_context, JSON_CODEC)
+        memoized_execution_context = self.subject.get_task_memo("some_hash")
+
+        # Then
+        assert(memoized_execution_context.get("artifact") == large_value)
+        assert(memoized_execution_context.get("small_value") == "small")
+        assert(self.subject.get_task_memo("another_hash") is None)
+
+        assert(self.subject.delete_task_memos(older_than=0) == 0)
+        assert(self.subject.delete_task_memos(older_than=float("inf")) == 1)
+        assert(self.subject.get_task_memo("some_hash") is None)
+        assert(self.subject.delete_unreferenced_blobs() == 1)
+
+    def test_reader_connections_are_reused_across_threads(self):
+        # Given
+        self.subject.save_flow(create_flow(1, FlowStatus.SCHEDULED))
+        read_flows = []
+
+        # When
+        for _ in range(50):
+            reader = threading.Thread(target=lambda: read_flows.append(self.subject.get_flow(1)))
+            reader.start()
+            reader.join()
+
+        # Then
+        assert(len(read_flows) == 50)
+        assert(len(self.subject.reader_connections) == 1)
+
+    def test_readers_are_not_blocked_by_an_open_unit_of_work(self):
+        # Given
+        self.subject.save_flow(create_flow(1, FlowStatus.SCHEDULED))
+        read_flows = {}
+
+        def read_flows_from_another_thread():
+            read_flows["committed"] = self.subject.get_flow(1)
+            read_flows["uncommitted"] = self.subject.get_flow(2)
+
+        # When
+        with self.subject.transaction():
+            self.subject.save_flow(create_flow(2, FlowStatus.SCHEDULED))
+
+            reader = threading.Thread(target=read_flows_from_another_thread)
+            reader.start()
+            reader.join(timeout=2)
+
+            # Then
+            assert(not reader.is_alive())
+            assert(read_flows["committed"].execution_id == 1)
+            assert(read_flows["uncommitted"] is None)
+
+            # The writer reads its own uncommitted writes
+            assert(self.subject.get_flow(2) is not None)
+
+def test_older_storage_schema_is_migrated(tmp_path):
+    # Given
+    storage_file_name = str(tmp_path / "old_flow_store.db")
+    connection = sqlite3.connect(storage_file_name)
+    connection.executescript("""
+        CREATE TABLE flow_executions(execution_id integer NOT NULL, execution_step integer NOT NULL, status text, template_name text,
+            current_task_index integer, execution_context text, timestamp integer, PRIMARY KEY(execution_id, execution_step));
+        INSERT INTO flow_executions VALUES (1, 0, 'CREATED', 'template', -1, '{"some_field": 1}', 1);
+        INSERT INTO flow_executions VALUES (1, 1, 'SCHEDULED', 'template', -1, '{"some_field": 1}', 2);
+        """)
+    connection.close()
+
+    # When
+    subject = FlowRepository(storage_file_name)
+
+    # Then
+    flow = subject.get_flow(1)
+    assert(flow.status == FlowStatus.SCHEDULED)
+    assert(flow.execution_context.get("some_field") == 1)
+    assert(subject.get_run_candidate_flow(FlowStatus.SCHEDULED).execution_id == 1)
+    assert(len(subject.get_flow_history(1)) == 2)
+    assert(subject.reserve_flow_execution_ids() == 2)
+
+def test_statuses_of_older_storages_are_migrated_to_integers(tmp_path):
+    # Given
+    storage_file_name = str(tmp_path / "old_flow_store.db")
+    connection = sqlite3.connect(storage_file_name)
+    connection.executescript("""
+        CREATE TABLE flow_executions(execution_id integer NOT NULL, execution_step integer NOT NULL, status text, template_name text,
+            current_task_index integer, execution_context text, timestamp integer, PRIMARY KEY(execution_id, execution_step));
+        CREATE TABLE task_executions(flow_execution_id integer, flow_execution_step integer, status text, output text, timestamp integer);
+        INSERT INTO flow_executions VALUES (1, 0, 'CREATED', 'template', -1, '{}', 1);
+        INSERT INTO flow_executions VALUES (1, 1, 'SCHEDULED', 'template', -1, '{}', 2);
+        INSERT INTO flow_executions VALUES (1, 2, 'RUNNING', 'template', 0, '{}', 3);
+        INSERT INTO flow_executions VALUES (2, 0, 'CREATED', 'template', -1, '{}', 4);
+        INSERT INTO flow_executions VALUES (2, 1, 'SCHEDULED', 'template', -1, '{}', 5);
+        INSERT INTO task_executions VALUES (1, 2, 'SUCCEEDED', NULL, 3);
+        """)
+    connection.close()
+
+    # When
+    subject = FlowRepository(storage_file_name)
+
+    # Then
+    assert(subject.get_flow(1).status == FlowStatus.RUNNING)
+    assert([flow.status for flow in subject.get_flow_history(1)] == [FlowStatus.CREATED, FlowStatus.SCHEDULED, FlowStatus.RUNNING])
+    assert(subject.get_flow_task_execution_history(1)[0].status == TaskStatus.SUCCEEDED)
+    assert(subject.get_run_candidate_flow(FlowStatus.SCHEDULED).execution_id == 2)
+
+    with subject.read_connection() as connection:
+        for table in ["flow_executions", "flow_states", "flow_ready_queue", "task_executions"]:
+            assert(connection.execute(f"SELECT DISTINCT typeof(status) FROM {table}").fetchall() == [("integer",)])
+
+def test_new_storages_are_created_without_migrations(tmp_path, monkeypatch):
+    # Given
+    storage_file_name = str(tmp_path / "flow_store.db")
+
+    def fail_migrate_schema(self):
+        raise AssertionError("New storages should not be migrated")
+
+    monkeypatch.setattr(FlowRepository, "migrate_schema", fail_migrate_schema)
+
+    # When
+    subject = FlowRepository(storage_file_name)
+
+    # Then
+    with subject.read_connection() as connection:
+        assert(connection.execute("PRAGMA user_version").fetchone()[0] == len(FlowRepository.schema_migrations))
+
+def test_new_storages_match_migrated_older_storages(tmp_path):
+    # Given
+    old_storage_file_name = str(tmp_path / "old_flow_store.db")
+    connection = sqlite3.connect(old_storage_file_name)
+    connection.executescript("""
+        CREATE TABLE flow_executions(execution_id integer NOT NULL, execution_step integer NOT NULL, status text, template_name text,
+            current_task_index integer, execution_context text, timestamp integer, PRIMARY KEY(execution_id, execution_step));
+        """)
+    connection.close()
+
+    # When
+    migrated_repository = FlowRepository(old_storage_file_name)
+    new_repository = FlowRepository(str(tmp_path / "flow_store.db"))
+
+    # Then
+    def describe_schema(repository: FlowRepository):
+        with repository.read_connection() as connection:
+            tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+            indexes = connection.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' ORDER BY name").fetchall()
+            columns = {table: connection.execute(f"PRAGMA table_info({table})").fetchall() for table in tables}
+            return tables, indexes, columns, connection.execute("PRAGMA user_version").fetchone()[0]
+
+    assert(describe_schema(new_repository) == describe_schema(migrated_repository))
+
+def test_repositories_sharing_a_storage_reserve_distinct_execution_ids(tmp_path):
+    # Given
+    storage_file_name = str(tmp_path / "flow_store.db")
+    first_repository = FlowRepository(storage_file_name)
+    second_repository = FlowRepository(storage_file_name)
+    reserved_ids = []
+
+    def reserve_ids(repository: FlowRepository):
+        for _ in range(50):
+            first_id = repository.reserve_flow_execution_ids(3)
+            reserved_ids.extend(range(first_id, first_id + 3))
+
+    # When
+    threads = [threading.Thread(target=reserve_ids, args=(repository,)) for repository in [first_repository, second_repository]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Then
+    assert(sorted(reserved_ids) == list(range(1, 301)))
+
+def test_data_version_only_changes_on_commits_from_other_connections(tmp_path):
+    # Given
+    storage_file_name = str(tmp_path / "flow_store.db")
+    subject = FlowRepository(storage_file_name)
+    other_repository = FlowRepository(storage_file_name)
+    data_version = subject.get_data_version()
+
+    # When
+    subject.reserve_flow_execution_ids()
+    own_commit_data_version = subject.get_data_version()
+    other_repository.reserve_flow_execution_ids()
+    other_commit_data_version = subject.get_data_version()
+
+    # Then
+    assert(own_commit_data_version == data_version)
+    assert(other_commit_data_version != data_version)
+
+def test_up_to_date_storage_skips_schema_script(tmp_path, monkeypatch):
+    # Given
+    storage_file_name = str(tmp_path / "flow_store.db")
+    FlowRepository(storage_file_name).close()
+
+    def fail_schema_definition():
+        raise AssertionError("The schema script should not run again")
+
+    monkeypatch.setattr(FlowRepository, "get_schema_definition", fail_schema_definition)
+
+    # When
+    subject = FlowRepository(storage_file_name)
+
+    # Then
+    assert(subject.get_flow(1) is None)
+
+def test_importing_the_runner_does_not_open_the_storage(tmp_path):
+    # Given
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    # When
+    subprocess.run([sys.executable, "-c", "import src.runner.flow_runner"], cwd=tmp_path, check=True,
+        env={**os.environ, "PYTHONPATH": project_root})
+
+    # Then
+    assert(not (tmp_path / DEFAULT_PERSISTENT_STORAGE_FILENAME).exists())
@@ -1,4 +1,9 @@
-from src.model.flow import ExecutionContext, Task, TaskStatus
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from src.model.flow import AsyncTask, CancellationToken, ExecutionContext, ProcessTask, RetryPolicy, Task, TaskCheckpoint, TaskDataItem, TaskStatus
 
 class SuccessfulTask(Task):
     def run(self, execution_context: ExecutionContext) -> ExecutionContext:
@@ -36,4 +41,227 @@ class RoundRobinTask(Task):
         else:
             ec = ExecutionContext()
             ec.set("some_output","OK")
-            return ec
\ No newline at end of file
+            return ec
+
+class AsyncSleepingTask(AsyncTask):
+    delay: float
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+
+    async def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        await asyncio.sleep(self.delay)
+        ec = ExecutionContext()
+        ec.set("some_output", "OK")
+        return ec
+
+class AsyncFailingTask(AsyncTask):
+    async def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        await asyncio.sleep(0)
+        raise ValueError("Oh nooo!")
+
+class HangingTask(Task):
+    """
+        Waits until it is cancelled, or for a very long time, polling its cancellation token
+    """
+    task_timeout: float
+    cancelled: bool
+
+    def __init__(self, task_timeout: float = None) -> None:
+        self.task_timeout = task_timeout
+        self.cancelled = False
+
+    def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        self.cancelled = CancellationToken.current().wait(60)
+        return ExecutionContext()
+
+    def timeout(self) -> float:
+        return self.task_timeout
+
+class LateCheckpointTask(Task):
+    """
+        Sleeps past its timeout, ignoring its cancellation token, then saves a checkpoint
+    """
+    task_timeout: float
+    delay: float
+    saved: threading.Event
+
+    def __init__(self, task_timeout: float, delay: float) -> None:
+        self.task_timeout = task_timeout
+        self.delay = delay
+        self.saved = threading.Event()
+
+    def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        checkpoint = TaskCheckpoint.current()
+        time.sleep(self.delay)
+        checkpoint.save("late progress")
+        self.saved.set()
+        return ExecutionContext()
+
+    def timeout(self) -> float:
+        return self.task_timeout
+
+class ChecksumProcessTask(ProcessTask):
+    """
+        Hashes the "payload" context value in a worker process and outputs it reversed along with the worker pid
+    """
+    def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        payload = execution_context.get("payload")
+
+        ec = ExecutionContext()
+        ec.set("checksum", hashlib.sha256(payload).hexdigest())
+        ec.set("reversed_payload", bytes(payload)[::-1])
+        ec.set("pid", os.getpid())
+        return ec
+
+class SleepingProcessTask(ProcessTask):
+    delay: float
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+
+    def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        time.sleep(self.delay)
+        return ExecutionContext()
+
+class SleepingChecksumProcessTask(ChecksumProcessTask):
+    """
+        ChecksumProcessTask that sleeps for delay seconds first
+    """
+    delay: float
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+
+    def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        time.sleep(self.delay)
+        return super().run(execution_context)
+
+class FailingProcessTask(ProcessTask):
+    def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        raise ValueError("Oh nooo!")
+
+class DataTask(Task):
+    """
+        Sleeps for delay seconds, checks its inputs are in the context and sets each of its outputs. Fails its first fail_count runs.
+    """
+    input_keys: list[str]
+    output_keys: list[str]
+    delay: float
+    fail_count: int
+    run_count: int
+
+    def __init__(self, input_keys: list[str], output_keys: list[str], delay: float = 0, fail_count: int = 0) -> None:
+        self.input_keys = input_keys
+        self.output_keys = output_keys
+        self.delay = delay
+        self.fail_count = fail_count
+        self.run_count = 0
+
+    def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        self.run_count += 1
+        time.sleep(self.delay)
+
+        if self.run_count <= self.fail_count:
+            raise ValueError("I will fail")
+
+        for key in self.input_keys:
+            execution_context.get(key)
+
+        ec = ExecutionContext()
+        for key in self.output_keys:
+            ec.set(key, f"{key}-done")
+        return ec
+
+    def inputs(self) -> list[TaskDataItem]:
+        return [TaskDataItem(key, str) for key in self.input_keys]
+
+    def outputs(self) -> list[TaskDataItem]:
+        return [TaskDataItem(key, str) for key in self.output_keys]
+
+class RetriedTask(DataTask):
+    """
+        DataTask that fails its first fail_count runs and comes with its own retry policy
+    """
+    policy: RetryPolicy
+
+    def __init__(self, policy: RetryPolicy, fail_count: int) -> None:
+        super().__init__([], ["some_output"], fail_count=fail_count)
+        self.policy = policy
+
+    def retry_policy(self) -> RetryPolicy:
+        return self.policy
+
+class MemoizedTask(DataTask):
+    """
+        DataTask whose outputs are memoized on the values of its inputs
+    """
+    def memoize(self) -> bool:
+        return True
+
+class PassThroughMemoizedTask(MemoizedTask):
+    """
+        MemoizedTask that, like most LINEAR tasks, returns the context it was given with its outputs added
+    """
+    def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        for (key, value) in super().run(execution_context).as_dict().items():
+            execution_context.set(key, value)
+
+        return execution_context
+
+class CheckpointedTask(Task):
+    """
+        Runs step_count steps, checkpointing after each of them, and resumes from its checkpoint. Fails once, right after its fail_after-th step.
+    """
+    step_count: int
+    fail_after: int
+    run_steps: list[int]
+
+    def __init__(self, step_count: int, fail_after: int = None) -> None:
+        self.step_count = step_count
+        self.fail_after = fail_after
+        self.run_steps = []
+
+    def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        checkpoint = TaskCheckpoint.current()
+        first_step = checkpoint.load() or 0
+
+        for step in range(first_step, self.step_count):
+            self.run_steps.append(step)
+            checkpoint.save(step + 1)
+
+            if len(self.run_steps) == self.fail_after:
+                raise ValueError("I will fail")
+
+        ec = ExecutionContext()
+        ec.set("some_output", "OK")
+        return ec
+
+class AsyncCheckpointedTask(AsyncTask):
+    """
+        CheckpointedTask counterpart that saves its progress from the event loop
+    """
+    step_count: int
+    fail_after: int
+    run_steps: list[int]
+
+    def __init__(self, step_count: int, fail_after: int = None) -> None:
+        self.step_count = step_count
+        self.fail_after = fail_after
+        self.run_steps = []
+
+    async def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        checkpoint = TaskCheckpoint.current()
+        first_step = checkpoint.load() or 0
+
+        for step in range(first_step, self.step_count):
+            await asyncio.sleep(0)
+            self.run_steps.append(step)
+            checkpoint.save(step + 1)
+
+            if len(self.run_steps) == self.fail_after:
+                raise ValueError("I will fail")
+
+        ec = ExecutionContext()
+        ec.set("some_output", "OK")
+        return ec
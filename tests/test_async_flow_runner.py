@@ -0,0 +1,205 @@
+from src.model.flow import ExecutionContext, FlowStatus, FlowTemplate, FlowTemplateMode, PersistenceMode, TaskStatus
+from src.runner.async_flow_runner import AsyncFlowRunner
+from src.runner.flow_runner import FlowRunner
+from src.services.flow_service import FlowService
+import asyncio
+import threading
+import time
+import pytest
+
+from tests.task_helper import AsyncCheckpointedTask, AsyncFailingTask, AsyncSleepingTask, CheckpointedTask, DataTask, HangingTask, MemoizedTask, SuccessfulTask
+
+class TestAsyncFlowRunner:
+    subject = None
+    flow_service = None
+
+    @pytest.fixture(autouse=True)
+    def before_tests(self):
+        self.flow_service = FlowService(PersistenceMode.TRANSIENT)
+        self.subject = AsyncFlowRunner(self.flow_service, max_concurrency=100)
+        yield
+        self.subject.close()
+
+    def test_run_io_bound_flows_concurrently(self):
+        # Given
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(AsyncSleepingTask(0.1))
+        flow_template.add_task(SuccessfulTask())
+        flow_template.add_task(AsyncSleepingTask(0.1))
+
+        self.subject.register_flow_template(flow_template)
+        flow_ids = [self.subject.schedule_flow("template", ExecutionContext()) for _ in range(50)]
+
+        # When
+        start = time.monotonic()
+        flow_count = asyncio.run(self.subject.run_flows_async(FlowStatus.SCHEDULED))
+        elapsed = time.monotonic() - start
+
+        # Then
+        assert(flow_count == 50)
+        # Running the flows one after the other would take at least 10 seconds
+        assert(elapsed < 5)
+
+        for flow_id in flow_ids:
+            flow = self.flow_service.get_flow_execution(flow_id)
+            assert(flow.status == FlowStatus.SUCCEEDED)
+            assert(len(self.flow_service.get_flow_task_execution_history(flow_id)) == 6)
+
+    def test_run_failing_async_flow(self):
+        # Given
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(AsyncFailingTask())
+
+        self.subject.register_flow_template(flow_template)
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        run_flow_id = asyncio.run(self.subject.run_flow_async(FlowStatus.SCHEDULED))
+
+        # Then
+        assert(run_flow_id == flow_id)
+
+        flow = self.flow_service.get_flow_execution(flow_id)
+        assert(flow.status == FlowStatus.FAILED)
+
+        task_execution = self.flow_service.get_flow_task_execution_history(flow_id)[1]
+        assert(task_execution.status == TaskStatus.FAILED)
+        assert(task_execution.output == "EXCEPTION MESSAGE - TODO")
+
+    def test_sync_runner_runs_async_tasks(self):
+        # Given
+        flow_runner = FlowRunner(self.flow_service)
+
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(AsyncSleepingTask(0))
+
+        flow_runner.register_flow_template(flow_template)
+        flow_id = flow_runner.schedule_flow("template", ExecutionContext())
+
+        # When
+        flow_runner.run_flow(FlowStatus.SCHEDULED)
+
+        # Then
+        flow = self.flow_service.get_flow_execution(flow_id)
+        assert(flow.status == FlowStatus.SUCCEEDED)
+        assert(flow.execution_context.get("some_output") == "OK")
+
+    def test_timed_out_tasks_fail_without_holding_the_loop(self):
+        # Given
+        flow_template = FlowTemplate("template", task_timeout=0.2)
+        flow_template.add_task(AsyncSleepingTask(60))
+
+        hanging_flow_template = FlowTemplate("hanging")
+        hanging_flow_template.add_task(HangingTask(task_timeout=0.2))
+
+        self.subject.register_flow_template(flow_template)
+        self.subject.register_flow_template(hanging_flow_template)
+        flow_ids = [self.subject.schedule_flow(template_name, ExecutionContext()) for template_name in ["template", "hanging"] * 5]
+
+        # When
+        start = time.monotonic()
+        flow_count = asyncio.run(self.subject.run_flows_async(FlowStatus.SCHEDULED))
+        elapsed = time.monotonic() - start
+
+        # Then
+        assert(flow_count == 10)
+        assert(elapsed < 5)
+
+        for flow_id in flow_ids:
+            assert(self.flow_service.get_flow_execution(flow_id).status == FlowStatus.FAILED)
+            assert(self.flow_service.get_flow_task_execution_history(flow_id)[-1].output == "Task timed out after 0.2 seconds")
+
+    def test_run_dag_flow_with_concurrent_tasks(self):
+        # Given
+        flow_template = FlowTemplate("template", mode=FlowTemplateMode.DAG)
+        flow_template.add_task(AsyncSleepingTask(0.3))
+        flow_template.add_task(DataTask([], ["a"], delay=0.3))
+        flow_template.add_task(DataTask(["a"], ["b"]))
+        flow_template.add_task(AsyncSleepingTask(0.3))
+
+        self.subject.register_flow_template(flow_template)
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        start = time.monotonic()
+        asyncio.run(self.subject.run_flows_async(FlowStatus.SCHEDULED))
+        elapsed = time.monotonic() - start
+
+        # Then
+        assert(elapsed < 0.8)
+
+        flow = self.flow_service.get_flow_execution(flow_id)
+        assert(flow.status == FlowStatus.SUCCEEDED)
+        assert(flow.completed_tasks == frozenset([0, 1, 2, 3]))
+        assert(flow.execution_context.get("b") == "b-done")
+        assert(flow.execution_context.get("some_output") == "OK")
+
+    def test_memoized_tasks_are_only_run_once_per_input(self):
+        # Given
+        memoized_task = MemoizedTask(["input"], ["result"])
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(memoized_task)
+        self.subject.register_flow_template(flow_template)
+
+        context = ExecutionContext()
+        context.set("input", "value")
+        first_flow_id = self.subject.schedule_flow("template", context)
+        asyncio.run(self.subject.run_flows_async(FlowStatus.SCHEDULED))
+
+        second_flow_id = self.subject.schedule_flow("template", context)
+
+        # When
+        asyncio.run(self.subject.run_flows_async(FlowStatus.SCHEDULED))
+
+        # Then
+        assert(memoized_task.run_count == 1)
+        assert(self.flow_service.get_flow_execution(first_flow_id).status == FlowStatus.SUCCEEDED)
+        assert(self.flow_service.get_flow_execution(second_flow_id).execution_context.get("result") == "result-done")
+
+    def test_task_checkpoints_are_saved(self):
+        # Given
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(CheckpointedTask(3, fail_after=2))
+        self.subject.register_flow_template(flow_template)
+
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        asyncio.run(self.subject.run_flows_async(FlowStatus.SCHEDULED))
+
+        # Then
+        assert(self.flow_service.get_flow_execution(flow_id).status == FlowStatus.FAILED)
+        assert(self.flow_service.get_task_checkpoint(flow_id, 0) == 2)
+
+    def test_async_task_checkpoints_go_through_the_storage_executor(self):
+        # Given
+        checkpointed_task = AsyncCheckpointedTask(3, fail_after=2)
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(checkpointed_task)
+        self.subject.register_flow_template(flow_template)
+
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+        storage_threads = set()
+
+        def record_storage_thread(method):
+            def wrapper(*args, **kwargs):
+                storage_threads.add(threading.current_thread().name)
+                return method(*args, **kwargs)
+
+            return wrapper
+
+        self.flow_service.get_task_checkpoint = record_storage_thread(self.flow_service.get_task_checkpoint)
+        self.flow_service.save_task_checkpoint = record_storage_thread(self.flow_service.save_task_checkpoint)
+
+        # When
+        asyncio.run(self.subject.run_flows_async(FlowStatus.SCHEDULED))
+        saved_checkpoint = self.flow_service.flow_repository.get_task_checkpoint(flow_id, 0)
+        self.subject.reschedule_flow_execution(flow_id)
+        asyncio.run(self.subject.run_flows_async(FlowStatus.RESCHEDULED))
+
+        # Then
+        assert(saved_checkpoint == 2)
+        assert(checkpointed_task.run_steps == [0, 1, 2])
+        assert(self.flow_service.get_flow_execution(flow_id).status == FlowStatus.SUCCEEDED)
+        assert(len(storage_threads) == 1)
+        assert(storage_threads.pop().startswith("flow-storage"))
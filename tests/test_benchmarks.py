@@ -0,0 +1,25 @@
+from benchmarks.run_benchmarks import parse_arguments, prefill_history, run_benchmarks
+from src.model.flow import FlowStatus
+from src.repositories.flow_repository import FlowRepository
+
+def test_prefilled_history_is_read_back():
+    # Given
+    flow_repository = FlowRepository(":memory:")
+
+    # When
+    flow_count = prefill_history(flow_repository, history_size=20, context_size=16)
+
+    # Then
+    assert(flow_count == 2)
+    assert(flow_repository.get_flow(1).status == FlowStatus.RUNNING)
+    assert(len(flow_repository.get_flow_history(2)) == 10)
+
+def test_benchmarks_run_on_small_sizes():
+    # Given
+    arguments = parse_arguments(["--flows", "2", "--tasks-per-flow", "2", "--operations", "2", "--context-sizes", "0", "--history-sizes", "20"])
+
+    # When
+    report = run_benchmarks(arguments)
+
+    # Then
+    assert({result["benchmark"] for result in report["results"]} == {"run_flow", "update_flow_status", "get_flow", "save_flow"})
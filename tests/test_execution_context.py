@@ -0,0 +1,72 @@
+from src.model.codec import JSON_CODEC, PICKLE_CODEC, BlobReference, ZlibCodec, decode_payload, encode_payload, get_payload_codec
+from src.model.flow import ExecutionContext
+import pytest
+
+class TestExecutionContext:
+    def test_binary_codec_payload_is_self_describing(self):
+        # Given
+        codec = ZlibCodec(PICKLE_CODEC)
+        context = {"numbers": (1, 2, 3), "raw": b"\x00\x01"}
+
+        # When
+        payload = encode_payload(codec, context)
+
+        # Then
+        assert(get_payload_codec(payload).name == "pickle+zlib")
+        assert(decode_payload(payload) == context)
+
+    def test_json_payload_is_plain_text(self):
+        # When
+        payload = encode_payload(JSON_CODEC, {"some_field": "some value"})
+
+        # Then
+        assert(payload == '{"some_field": "some value"}')
+        assert(get_payload_codec(payload) is JSON_CODEC)
+
+    def test_user_keys_never_decode_as_blob_references(self):
+        # Given
+        context = {
+            "$blob": "not a reference",
+            "nested": [{"$blob": "abc"}, {"$$blob": "abc", "size": 3}],
+            "artifact": BlobReference("some_hash", 10)
+        }
+
+        # When
+        payload = encode_payload(ZlibCodec(JSON_CODEC), context)
+
+        # Then
+        assert(decode_payload(payload) == context)
+        assert(decode_payload(encode_payload(JSON_CODEC, context))["artifact"].size == 10)
+
+    def test_context_is_decoded_on_first_access_only(self):
+        # Given
+        payload = encode_payload(PICKLE_CODEC, {"some_field": "some value"})
+
+        # When
+        subject = ExecutionContext.from_payload(payload)
+
+        # Then
+        assert(not subject.is_decoded())
+        assert(subject.to_payload(PICKLE_CODEC) is payload)
+
+        assert(subject.get("some_field") == "some value")
+        assert(subject.is_decoded())
+        assert(subject.to_payload(PICKLE_CODEC) is payload)
+
+    def test_changed_context_is_encoded_again(self):
+        # Given
+        subject = ExecutionContext.from_payload(encode_payload(JSON_CODEC, {"some_field": "some value"}))
+
+        # When
+        subject.set("another_field", 42)
+
+        # Then
+        assert(decode_payload(subject.to_payload(JSON_CODEC)) == {"some_field": "some value", "another_field": 42})
+
+    def test_unknown_codec(self):
+        # When/Then
+        with pytest.raises(ValueError) as exc:
+            decode_payload(b"unknown\0payload")
+
+        raised_exception = exc.value
+        assert(type(raised_exception) is ValueError)
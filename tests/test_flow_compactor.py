@@ -0,0 +1,162 @@
+from src.model.codec import decode_payload
+from src.model.flow import ExecutionContext, FlowStatus, FlowTemplate, PersistenceMode, Task
+from src.runner.flow_compactor import FlowCompactor
+from src.runner.flow_runner import FlowRunner
+from src.services.flow_service import FlowService
+import sqlite3
+import zlib
+import pytest
+
+from tests.task_helper import FailingTask, SuccessfulTask
+
+class LargeOutputTask(Task):
+    def run(self, execution_context: ExecutionContext) -> ExecutionContext:
+        ec = ExecutionContext()
+        ec.set("artifact", bytes(range(256)) * 64)
+        return ec
+
+class TestFlowCompactor:
+    flow_service = None
+    flow_runner = None
+
+    @pytest.fixture(autouse=True)
+    def before_tests(self):
+        self.flow_service = FlowService(PersistenceMode.TRANSIENT)
+        self.flow_runner = FlowRunner(self.flow_service)
+
+        successful_template = FlowTemplate("successful")
+        successful_template.add_task(SuccessfulTask())
+        successful_template.add_task(SuccessfulTask())
+        self.flow_runner.register_flow_template(successful_template)
+
+        failing_template = FlowTemplate("failing")
+        failing_template.add_task(FailingTask())
+        self.flow_runner.register_flow_template(failing_template)
+
+    def run_flows(self, template_name: str, count: int) -> list[int]:
+        flow_ids = []
+        for value in range(count):
+            execution_context = ExecutionContext()
+            execution_context.set("value", value)
+            flow_ids.append(self.flow_runner.schedule_flow(template_name, execution_context))
+
+        while self.flow_runner.run_flow(FlowStatus.SCHEDULED) is not None:
+            pass
+
+        return flow_ids
+
+    def test_succeeded_flows_are_collapsed_to_their_final_row_and_a_summary(self):
+        # Given
+        succeeded_flow_ids = self.run_flows("successful", 3)
+        (failed_flow_id,) = self.run_flows("failing", 1)
+
+        history_length = len(self.flow_service.get_flow_execution_history(succeeded_flow_ids[0]))
+        task_history_length = len(self.flow_service.get_flow_task_execution_history(succeeded_flow_ids[0]))
+        final_flow = self.flow_service.get_flow_execution(succeeded_flow_ids[0])
+        failed_flow_history_length = len(self.flow_service.get_flow_execution_history(failed_flow_id))
+
+        subject = FlowCompactor(self.flow_service, retention=0, batch_size=2, pause=0)
+
+        # When
+        compacted_flow_count = subject.run()
+
+        # Then
+        assert(compacted_flow_count == 3)
+        assert(subject.run() == 0)
+
+        compacted_history = self.flow_service.get_flow_execution_history(succeeded_flow_ids[0])
+        assert(len(compacted_history) == 1)
+        assert(compacted_history[0].status == FlowStatus.SUCCEEDED)
+        assert(compacted_history[0].execution_context.as_dict() == final_flow.execution_context.as_dict())
+        assert(self.flow_service.get_flow_task_execution_history(succeeded_flow_ids[0]) == [])
+
+        summary = self.flow_service.get_flow_summary(succeeded_flow_ids[0])
+        assert(summary.status == FlowStatus.SUCCEEDED)
+        assert(summary.steps == history_length)
+        assert(summary.task_executions == task_history_length)
+        assert(summary.archive_file_name is None)
+
+        assert(self.flow_service.get_flow_summary(failed_flow_id) is None)
+        assert(len(self.flow_service.get_flow_execution_history(failed_flow_id)) == failed_flow_history_length)
+
+    def test_recent_flows_are_kept(self):
+        # Given
+        (flow_id,) = self.run_flows("successful", 1)
+        subject = FlowCompactor(self.flow_service, retention=3600)
+
+        # When
+        compacted_flow_count = subject.run()
+
+        # Then
+        assert(compacted_flow_count == 0)
+        assert(self.flow_service.get_flow_summary(flow_id) is None)
+
+    def test_history_is_archived_compressed(self, tmp_path):
+        # Given
+        archive_file_name = str(tmp_path / "flow_archive.db")
+        (flow_id,) = self.run_flows("successful", 1)
+        history = self.flow_service.get_flow_execution_history(flow_id)
+        task_history_length = len(self.flow_service.get_flow_task_execution_history(flow_id))
+
+        subject = FlowCompactor(self.flow_service, retention=0, archive_file_name=archive_file_name, compress=True)
+
+        # When
+        subject.run()
+
+        # Then
+        assert(self.flow_service.get_flow_summary(flow_id).archive_file_name == archive_file_name)
+
+        archive = sqlite3.connect(archive_file_name)
+        archived_rows = archive.execute("SELECT execution_step, execution_context, context_is_delta, compressed FROM flow_executions WHERE execution_id = ? ORDER BY execution_step", (flow_id,)).fetchall()
+        archived_task_count = archive.execute("SELECT COUNT(*) FROM task_executions WHERE flow_execution_id = ?", (flow_id,)).fetchone()[0]
+        archive.close()
+
+        assert([row[0] for row in archived_rows] == [step.execution_step for step in history])
+        assert(all(row[3] == 1 for row in archived_rows))
+        assert(decode_payload(zlib.decompress(archived_rows[0][1]).decode("utf8")) == history[0].execution_context.as_dict())
+        assert(archived_task_count == task_history_length)
+
+    def test_blobs_only_referenced_by_the_dropped_history_are_moved_to_the_archive(self, tmp_path):
+        # Given
+        archive_file_name = str(tmp_path / "flow_archive.db")
+        self.flow_service.flow_repository.blob_threshold = 1024
+
+        # The large intermediate output is replaced by the output of the last task
+        template = FlowTemplate("large_output")
+        template.add_task(LargeOutputTask())
+        template.add_task(SuccessfulTask())
+        self.flow_runner.register_flow_template(template)
+        self.run_flows("large_output", 1)
+
+        subject = FlowCompactor(self.flow_service, retention=0, archive_file_name=archive_file_name)
+
+        # When
+        subject.run()
+
+        # Then
+        with self.flow_service.flow_repository.read_connection() as connection:
+            assert(connection.execute("SELECT COUNT(*) FROM context_blobs").fetchone()[0] == 0)
+
+        archive = sqlite3.connect(archive_file_name)
+        archived_blobs = archive.execute("SELECT data FROM context_blobs").fetchall()
+        archive.close()
+
+        assert(archived_blobs == [(bytes(range(256)) * 64,)])
+
+    def test_blobs_still_referenced_are_kept(self):
+        # Given
+        self.flow_service.flow_repository.blob_threshold = 1024
+
+        template = FlowTemplate("large_output")
+        template.add_task(SuccessfulTask())
+        template.add_task(LargeOutputTask())
+        self.flow_runner.register_flow_template(template)
+        (flow_id,) = self.run_flows("large_output", 1)
+
+        # When
+        deleted_blob_count = self.flow_service.delete_unreferenced_blobs()
+        FlowCompactor(self.flow_service, retention=0).run()
+
+        # Then
+        assert(deleted_blob_count == 0)
+        assert(self.flow_service.get_flow_execution(flow_id).execution_context.get("artifact") == bytes(range(256)) * 64)
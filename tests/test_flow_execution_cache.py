@@ -0,0 +1,58 @@
+from src.model.flow import FlowExecution, FlowStatus
+from src.services.flow_execution_cache import FlowExecutionCache
+import pytest
+
+def create_flow(execution_id: int, status: FlowStatus = FlowStatus.RUNNING) -> FlowExecution:
+    flow = FlowExecution()
+    flow.execution_id = execution_id
+    flow.status = status
+
+    return flow
+
+class TestFlowExecutionCache:
+    def test_least_recently_used_flows_are_evicted_first(self):
+        # Given
+        subject = FlowExecutionCache(2)
+        subject.put(create_flow(1))
+        subject.put(create_flow(2))
+
+        # When
+        subject.get(1)
+        subject.put(create_flow(3))
+
+        # Then
+        assert(1 in subject)
+        assert(2 not in subject)
+        assert(3 in subject)
+        assert(len(subject) == 2)
+
+    def test_replace_only_updates_cached_flows(self):
+        # Given
+        subject = FlowExecutionCache(2)
+        subject.put(create_flow(1))
+
+        # When
+        subject.replace(create_flow(1, FlowStatus.SUCCEEDED))
+        subject.replace(create_flow(2, FlowStatus.SUCCEEDED))
+
+        # Then
+        assert(subject.get(1).status == FlowStatus.SUCCEEDED)
+        assert(subject.get(2) is None)
+
+    def test_disabled_cache_keeps_nothing(self):
+        # Given
+        subject = FlowExecutionCache(0)
+
+        # When
+        subject.put(create_flow(1))
+
+        # Then
+        assert(subject.get(1) is None)
+
+    def test_negative_capacity(self):
+        # When/Then
+        with pytest.raises(ValueError) as exc:
+            FlowExecutionCache(-1)
+
+        raised_exception = exc.value
+        assert(type(raised_exception) is ValueError)
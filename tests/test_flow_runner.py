@@ -1,9 +1,11 @@
-from src.model.flow import ExecutionContext, FlowStatus, FlowTemplate, PersistenceMode, Task, TaskStatus
+from src.model.codec import PICKLE_CODEC, ZlibCodec
+from src.model.flow import Durability, ExecutionContext, FlowStatus, FlowTemplate, FlowTemplateMode, PersistenceMode, RetryPolicy, Task, TaskStatus
 from src.runner.flow_runner import FlowRunner
 from src.services.flow_service import FlowService
+import time
 import pytest
 
-from tests.task_helper import FailingTask, SuccessfulTask
+from tests.task_helper import AsyncSleepingTask, CheckpointedTask, DataTask, FailingTask, HangingTask, LateCheckpointTask, MemoizedTask, PassThroughMemoizedTask, RetriedTask, SuccessfulTask
 from tests.test_helper import TestHelper
 
 class TestRunner:
@@ -68,6 +70,111 @@ class TestRunner:
         assert(task_execution.flow_execution_id == flow_id)
         assert(task_execution.status == TaskStatus.SUCCEEDED)
     
+    def test_run_flow_runs_flows_in_scheduling_order(self):
+        # Given
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(SuccessfulTask())
+
+        self.subject.register_flow_template(flow_template)
+
+        first_flow_id = self.subject.schedule_flow("template", ExecutionContext())
+        second_flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        first_run_flow_id = self.subject.run_flow(FlowStatus.SCHEDULED)
+        second_run_flow_id = self.subject.run_flow(FlowStatus.SCHEDULED)
+        third_run_flow_id = self.subject.run_flow(FlowStatus.SCHEDULED)
+
+        # Then
+        assert(first_run_flow_id == first_flow_id)
+        assert(second_run_flow_id == second_flow_id)
+        assert(third_run_flow_id is None)
+
+        assert(self.flow_service.get_flow_execution(first_flow_id).status == FlowStatus.SUCCEEDED)
+        assert(self.flow_service.get_flow_execution(second_flow_id).status == FlowStatus.SUCCEEDED)
+
+    def test_schedule_flows_runs_like_single_scheduled_flows(self):
+        # Given
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(SuccessfulTask())
+
+        self.subject.register_flow_template(flow_template)
+
+        single_flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        flow_ids = self.subject.schedule_flows("template", (ExecutionContext() for _ in range(3)))
+
+        # Then
+        run_flow_ids = [self.subject.run_flow(FlowStatus.SCHEDULED) for _ in range(4)]
+        assert(run_flow_ids == [single_flow_id] + flow_ids)
+
+        single_flow_history = [step.status for step in self.flow_service.get_flow_execution_history(single_flow_id)]
+        for flow_id in flow_ids:
+            assert([step.status for step in self.flow_service.get_flow_execution_history(flow_id)] == single_flow_history)
+
+    def test_flow_execution_history_is_kept_for_audit(self):
+        # Given
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(SuccessfulTask())
+
+        self.subject.register_flow_template(flow_template)
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+
+        # Then
+        flow = self.flow_service.get_flow_execution(flow_id)
+        flow_execution_history = self.flow_service.get_flow_execution_history(flow_id)
+
+        statuses = [flow_execution.status for flow_execution in flow_execution_history]
+        assert(statuses == [FlowStatus.CREATED, FlowStatus.SCHEDULED, FlowStatus.RUNNING, FlowStatus.SUCCEEDED])
+        assert(flow_execution_history[-1].execution_step == flow.execution_step)
+
+    def test_run_flow_with_group_commit(self):
+        # Given
+        self.flow_service = FlowService(PersistenceMode.TRANSIENT, Durability.GROUP_COMMIT)
+        self.subject = FlowRunner(self.flow_service)
+
+        flow_template = TestHelper.create_long_failing_flow()
+        flow_execution_id = TestHelper.run_flow(self.subject, flow_template)
+
+        # When
+        self.subject.reschedule_flow_execution(flow_execution_id)
+        self.subject.re_run_flow()
+
+        # Then
+        flow = self.flow_service.get_flow_execution(flow_execution_id)
+        assert(flow.status == FlowStatus.SUCCEEDED)
+
+        flow_task_execution_history = self.flow_service.get_flow_task_execution_history(flow_execution_id)
+        assert(len(flow_task_execution_history) == 8)
+
+    def test_run_flow_with_binary_context_codec(self):
+        # Given
+        flow_template = FlowTemplate("template", ZlibCodec(PICKLE_CODEC))
+        flow_template.add_task(SuccessfulTask())
+
+        self.subject.register_flow_template(flow_template)
+
+        context = ExecutionContext()
+        context.set("not_json_native", (1, b"bytes"))
+        flow_id = self.subject.schedule_flow("template", context)
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+
+        # Then
+        flow = self.flow_service.get_flow_execution(flow_id)
+        assert(flow.status == FlowStatus.SUCCEEDED)
+        assert(flow.context_codec.name == "pickle+zlib")
+        assert(not flow.execution_context.is_decoded())
+        assert(flow.execution_context.get("some_output") == "OK")
+
+        scheduled_flow = self.flow_service.get_flow_execution_history(flow_id)[1]
+        assert(scheduled_flow.execution_context.get("not_json_native") == (1, b"bytes"))
+
     def test_run_simple_failing_flow(self):
         # Given
         flow_template = FlowTemplate("template")
@@ -93,6 +200,331 @@ class TestRunner:
         assert(task_execution.status == TaskStatus.FAILED)
         assert(task_execution.output == "EXCEPTION MESSAGE - TODO")
     
+    def test_run_flow_with_timed_out_task(self):
+        # Given
+        hanging_task = HangingTask(task_timeout=0.2)
+
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(hanging_task)
+        flow_template.add_task(SuccessfulTask())
+
+        self.subject.register_flow_template(flow_template)
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        start = time.monotonic()
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+        elapsed = time.monotonic() - start
+
+        # Then
+        assert(elapsed < 5)
+        assert(self.flow_service.get_flow_execution(flow_id).status == FlowStatus.FAILED)
+
+        task_execution = self.flow_service.get_flow_task_execution_history(flow_id)[-1]
+        assert(task_execution.status == TaskStatus.FAILED)
+        assert(task_execution.output == "Task timed out after 0.2 seconds")
+
+        # The hanging task is told to stop
+        deadline = time.monotonic() + 5
+        while not hanging_task.cancelled and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert(hanging_task.cancelled)
+
+    def test_timed_out_task_can_not_save_its_checkpoint(self):
+        # Given
+        late_task = LateCheckpointTask(task_timeout=0.1, delay=0.3)
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(late_task)
+
+        self.subject.register_flow_template(flow_template)
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+        saved = late_task.saved.wait(5)
+
+        # Then
+        assert(saved)
+        assert(self.flow_service.get_flow_execution(flow_id).status == FlowStatus.FAILED)
+        assert(self.flow_service.get_task_checkpoint(flow_id, 0) is None)
+
+    def test_template_task_timeout_applies_to_tasks_without_their_own(self):
+        # Given
+        flow_template = FlowTemplate("template", task_timeout=0.2)
+        flow_template.add_task(SuccessfulTask())
+        flow_template.add_task(AsyncSleepingTask(60))
+
+        self.subject.register_flow_template(flow_template)
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+
+        # Then
+        task_history = self.flow_service.get_flow_task_execution_history(flow_id)
+        assert([task_execution.status for task_execution in task_history if task_execution.output is not None] == [TaskStatus.FAILED])
+        assert(task_history[-1].output == "Task timed out after 0.2 seconds")
+        assert(self.flow_service.get_flow_execution(flow_id).status == FlowStatus.FAILED)
+
+    def test_run_dag_flow_runs_independent_tasks_concurrently(self):
+        # Given
+        flow_template = FlowTemplate("template", mode=FlowTemplateMode.DAG)
+        flow_template.add_task(DataTask(["a", "b", "c"], ["result"]))
+        flow_template.add_task(DataTask(["input"], ["a"], delay=0.3))
+        flow_template.add_task(DataTask(["input"], ["b"], delay=0.3))
+        flow_template.add_task(DataTask(["input"], ["c"], delay=0.3))
+
+        self.subject.register_flow_template(flow_template)
+
+        context = ExecutionContext()
+        context.set("input", "value")
+        flow_id = self.subject.schedule_flow("template", context)
+
+        # When
+        start = time.monotonic()
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+        elapsed = time.monotonic() - start
+
+        # Then
+        # Running the fan-out tasks one after the other would take at least 0.9 seconds
+        assert(elapsed < 0.8)
+
+        flow = self.flow_service.get_flow_execution(flow_id)
+        assert(flow.status == FlowStatus.SUCCEEDED)
+        assert(flow.completed_tasks == frozenset([0, 1, 2, 3]))
+        assert(dict(flow.execution_context.as_dict()) == {"input": "value", "a": "a-done", "b": "b-done", "c": "c-done", "result": "result-done"})
+
+        task_history = self.flow_service.get_flow_task_execution_history(flow_id)
+        assert([task_execution.status for task_execution in task_history].count(TaskStatus.SUCCEEDED) == 4)
+
+    def test_rescheduled_dag_flow_only_runs_the_tasks_that_did_not_complete(self):
+        # Given
+        succeeding_task = DataTask(["input"], ["a"])
+        failing_task = DataTask(["input"], ["b"], fail_count=1)
+
+        flow_template = FlowTemplate("template", mode=FlowTemplateMode.DAG)
+        flow_template.add_task(succeeding_task)
+        flow_template.add_task(failing_task)
+        flow_template.add_task(DataTask(["a", "b"], ["result"]))
+
+        self.subject.register_flow_template(flow_template)
+
+        context = ExecutionContext()
+        context.set("input", "value")
+        flow_id = self.subject.schedule_flow("template", context)
+
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+        failed_flow = self.flow_service.get_flow_execution(flow_id)
+
+        # When
+        self.subject.reschedule_flow_execution(flow_id)
+        self.subject.re_run_flow()
+
+        # Then
+        assert(failed_flow.status == FlowStatus.FAILED)
+        assert(failed_flow.completed_tasks == frozenset([0]))
+
+        flow = self.flow_service.get_flow_execution(flow_id)
+        assert(flow.status == FlowStatus.SUCCEEDED)
+        assert(flow.execution_context.get("result") == "result-done")
+        assert(succeeding_task.run_count == 1)
+        assert(failing_task.run_count == 2)
+
+    def test_failed_flow_is_retried_after_the_backoff(self):
+        # Given
+        flaky_task = DataTask([], ["some_output"], fail_count=2)
+        flow_template = FlowTemplate("template", retry_policy=RetryPolicy(max_attempts=3, backoff=0.1, jitter=0))
+        flow_template.add_task(SuccessfulTask())
+        flow_template.add_task(flaky_task)
+        self.subject.register_flow_template(flow_template)
+
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+        first_retry_flow = self.flow_service.get_flow_execution(flow_id)
+        held_back_flow_id = self.subject.re_run_flow()
+
+        time.sleep(0.1)
+        self.subject.re_run_flow()
+        second_retry_flow = self.flow_service.get_flow_execution(flow_id)
+
+        time.sleep(0.2)
+        self.subject.re_run_flow()
+
+        # Then
+        assert(first_retry_flow.status == FlowStatus.RESCHEDULED)
+        assert(first_retry_flow.attempt == 1)
+        assert(first_retry_flow.not_before - first_retry_flow.timestamp == pytest.approx(0.1, abs=0.01))
+        assert(held_back_flow_id is None)
+
+        assert(second_retry_flow.status == FlowStatus.RESCHEDULED)
+        assert(second_retry_flow.not_before - second_retry_flow.timestamp == pytest.approx(0.2, abs=0.01))
+
+        flow = self.flow_service.get_flow_execution(flow_id)
+        assert(flow.status == FlowStatus.SUCCEEDED)
+        assert(flow.attempt == 3)
+        assert(flow.not_before is None)
+        assert(flaky_task.run_count == 3)
+
+    def test_failed_flow_is_not_retried_past_max_attempts(self):
+        # Given
+        flow_template = FlowTemplate("template", retry_policy=RetryPolicy(max_attempts=2, backoff=0, jitter=0))
+        flow_template.add_task(FailingTask())
+        self.subject.register_flow_template(flow_template)
+
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+        self.subject.re_run_flow()
+        flow_count = self.subject.re_run_flow()
+
+        # Then
+        flow = self.flow_service.get_flow_execution(flow_id)
+        assert(flow.status == FlowStatus.FAILED)
+        assert(flow.attempt == 2)
+        assert(flow_count is None)
+
+    def test_task_retry_policy_overrides_the_template_one(self):
+        # Given
+        flow_template = FlowTemplate("template", retry_policy=RetryPolicy(max_attempts=1))
+        flow_template.add_task(RetriedTask(RetryPolicy(max_attempts=2, backoff=0, jitter=0), fail_count=1))
+        self.subject.register_flow_template(flow_template)
+
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+        self.subject.re_run_flow()
+
+        # Then
+        assert(self.flow_service.get_flow_execution(flow_id).status == FlowStatus.SUCCEEDED)
+
+    def test_failed_dag_flow_is_retried(self):
+        # Given
+        failing_task = DataTask(["input"], ["b"], fail_count=1)
+        flow_template = FlowTemplate("template", mode=FlowTemplateMode.DAG, retry_policy=RetryPolicy(max_attempts=2, backoff=0, jitter=0))
+        flow_template.add_task(DataTask(["input"], ["a"]))
+        flow_template.add_task(failing_task)
+        flow_template.add_task(DataTask(["a", "b"], ["result"]))
+        self.subject.register_flow_template(flow_template)
+
+        context = ExecutionContext()
+        context.set("input", "value")
+        flow_id = self.subject.schedule_flow("template", context)
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+        rescheduled_flow = self.flow_service.get_flow_execution(flow_id)
+        self.subject.re_run_flow()
+
+        # Then
+        assert(rescheduled_flow.status == FlowStatus.RESCHEDULED)
+        flow = self.flow_service.get_flow_execution(flow_id)
+        assert(flow.status == FlowStatus.SUCCEEDED)
+        assert(failing_task.run_count == 2)
+
+    def test_failed_task_resumes_from_its_checkpoint(self):
+        # Given
+        checkpointed_task = CheckpointedTask(5, fail_after=3)
+        flow_template = FlowTemplate("template", retry_policy=RetryPolicy(max_attempts=2, backoff=0, jitter=0))
+        flow_template.add_task(checkpointed_task)
+        self.subject.register_flow_template(flow_template)
+
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+        saved_checkpoint = self.flow_service.get_task_checkpoint(flow_id, 0)
+        self.subject.re_run_flow()
+
+        # Then
+        assert(saved_checkpoint == 3)
+        assert(checkpointed_task.run_steps == [0, 1, 2, 3, 4])
+        assert(self.flow_service.get_flow_execution(flow_id).status == FlowStatus.SUCCEEDED)
+        assert(self.flow_service.get_task_checkpoint(flow_id, 0) is None)
+
+    def test_memoized_task_outputs_are_reused_across_flows(self):
+        # Given
+        memoized_task = MemoizedTask(["input"], ["result"])
+        flow_template = FlowTemplate("template", mode=FlowTemplateMode.DAG)
+        flow_template.add_task(memoized_task)
+        self.subject.register_flow_template(flow_template)
+
+        flow_ids = []
+        for value in ["same", "same", "other"]:
+            context = ExecutionContext()
+            context.set("input", value)
+            flow_ids.append(self.subject.schedule_flow("template", context))
+
+        # When
+        while self.subject.run_flow(FlowStatus.SCHEDULED) is not None:
+            pass
+
+        # Then
+        assert(memoized_task.run_count == 2)
+        for flow_id in flow_ids:
+            flow = self.flow_service.get_flow_execution(flow_id)
+            assert(flow.status == FlowStatus.SUCCEEDED)
+            assert(flow.execution_context.get("result") == "result-done")
+
+        memoized_task_executions = self.flow_service.get_flow_task_execution_history(flow_ids[1])
+        assert(memoized_task_executions[-1].status == TaskStatus.SUCCEEDED)
+
+    def test_only_memoized_outputs_are_added_to_linear_flow_contexts(self):
+        # Given
+        memoized_task = PassThroughMemoizedTask(["input"], ["result"])
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(memoized_task)
+        self.subject.register_flow_template(flow_template)
+
+        flow_ids = []
+        for other_value in ["one", "two"]:
+            context = ExecutionContext()
+            context.set("input", "same")
+            context.set("other", other_value)
+            flow_ids.append(self.subject.schedule_flow("template", context))
+
+        # When
+        while self.subject.run_flow(FlowStatus.SCHEDULED) is not None:
+            pass
+
+        # Then
+        assert(memoized_task.run_count == 1)
+        flow = self.flow_service.get_flow_execution(flow_ids[1])
+        assert(flow.status == FlowStatus.SUCCEEDED)
+        assert(flow.execution_context.get("result") == "result-done")
+        assert(flow.execution_context.get("other") == "two")
+
+    def test_memoized_tasks_of_the_same_class_do_not_share_their_outputs(self):
+        # Given
+        first_task = MemoizedTask(["input"], ["a"])
+        second_task = MemoizedTask(["input"], ["b"])
+        flow_template = FlowTemplate("template", mode=FlowTemplateMode.DAG)
+        flow_template.add_task(first_task)
+        flow_template.add_task(second_task)
+        self.subject.register_flow_template(flow_template)
+
+        flow_ids = []
+        for _ in range(2):
+            context = ExecutionContext()
+            context.set("input", "same")
+            flow_ids.append(self.subject.schedule_flow("template", context))
+
+        # When
+        while self.subject.run_flow(FlowStatus.SCHEDULED) is not None:
+            pass
+
+        # Then
+        assert(first_task.run_count == 1)
+        assert(second_task.run_count == 1)
+        for flow_id in flow_ids:
+            flow = self.flow_service.get_flow_execution(flow_id)
+            assert(flow.status == FlowStatus.SUCCEEDED)
+            assert(flow.execution_context.get("a") == "a-done")
+            assert(flow.execution_context.get("b") == "b-done")
+
     def test_run_long_failing_flow(self):
         # Given
         flow_template = TestHelper.create_long_failing_flow()
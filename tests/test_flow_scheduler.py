@@ -0,0 +1,186 @@
+from src.model.flow import ExecutionContext, FlowStatus, FlowTemplate, PersistenceMode, RetryPolicy
+from src.repositories.flow_repository import FlowRepository
+from src.runner.flow_runner import FlowRunner
+from src.runner.flow_scheduler import FlowScheduler
+from src.services.flow_service import FlowService
+import time
+import pytest
+
+from tests.task_helper import DataTask, FailingTask, SuccessfulTask
+
+def wait_for_status(flow_service: FlowService, flow_ids: list[int], status: FlowStatus, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(flow_service.get_flow_execution(flow_id).status == status for flow_id in flow_ids):
+            return True
+        time.sleep(0.005)
+
+    return False
+
+class CountingFlowRunner(FlowRunner):
+    run_flow_calls: int = 0
+
+    def run_flow(self, strategy: FlowStatus) -> int:
+        self.run_flow_calls += 1
+        return super().run_flow(strategy)
+
+class TestFlowScheduler:
+    flow_service = None
+    flow_runner = None
+
+    @pytest.fixture(autouse=True)
+    def before_tests(self):
+        self.flow_service = FlowService(PersistenceMode.TRANSIENT)
+        self.flow_runner = CountingFlowRunner(self.flow_service)
+
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(SuccessfulTask())
+        flow_template.add_task(SuccessfulTask())
+        self.flow_runner.register_flow_template(flow_template)
+
+        failing_template = FlowTemplate("failing")
+        failing_template.add_task(FailingTask())
+        self.flow_runner.register_flow_template(failing_template)
+
+    def test_scheduled_flows_wake_the_scheduler_up(self):
+        # Given
+        subject = FlowScheduler(self.flow_runner, workers=2, min_poll_interval=5, max_poll_interval=5)
+
+        with subject:
+            # Let the workers fall asleep on the empty queue
+            time.sleep(0.05)
+
+            # When
+            flow_ids = [self.flow_runner.schedule_flow("template", ExecutionContext()) for _ in range(5)]
+            flow_ids.extend(self.flow_runner.schedule_flows("template", [ExecutionContext() for _ in range(5)]))
+
+            # Then
+            assert(wait_for_status(self.flow_service, flow_ids, FlowStatus.SUCCEEDED, timeout=2))
+
+        assert(not subject.is_running())
+
+    def test_rescheduled_flows_are_run(self):
+        # Given
+        subject = FlowScheduler(self.flow_runner, min_poll_interval=5, max_poll_interval=5)
+        flow_id = self.flow_runner.schedule_flow("failing", ExecutionContext())
+
+        with subject:
+            assert(wait_for_status(self.flow_service, [flow_id], FlowStatus.FAILED, timeout=2))
+
+            # When
+            self.flow_runner.reschedule_flow_execution(flow_id)
+
+            # Then
+            assert(wait_for_status(self.flow_service, [flow_id], FlowStatus.FAILED, timeout=2))
+            assert(self.flow_service.get_flow_execution(flow_id).execution_step > 4)
+
+    def test_failed_flows_are_retried_once_their_backoff_is_over(self):
+        # Given
+        flow_template = FlowTemplate("flaky", retry_policy=RetryPolicy(max_attempts=3, backoff=0.2, jitter=0))
+        flow_template.add_task(DataTask([], ["some_output"], fail_count=1))
+        self.flow_runner.register_flow_template(flow_template)
+
+        subject = FlowScheduler(self.flow_runner, min_poll_interval=5, max_poll_interval=5)
+        flow_id = self.flow_runner.schedule_flow("flaky", ExecutionContext())
+
+        # When
+        with subject:
+            succeeded = wait_for_status(self.flow_service, [flow_id], FlowStatus.SUCCEEDED, timeout=2)
+
+        # Then
+        # The worker slept until the retry was due instead of polling every min_poll_interval or waiting max_poll_interval
+        assert(succeeded)
+        assert(self.flow_service.get_flow_execution(flow_id).attempt == 2)
+        assert(self.flow_runner.run_flow_calls <= 8)
+
+    def test_strategies_take_turns(self):
+        # Given
+        failed_flow_ids = [self.flow_runner.schedule_flow("failing", ExecutionContext()) for _ in range(2)]
+        while self.flow_runner.run_flow(FlowStatus.SCHEDULED) is not None:
+            pass
+
+        for flow_id in failed_flow_ids:
+            self.flow_runner.reschedule_flow_execution(flow_id)
+        scheduled_flow_ids = [self.flow_runner.schedule_flow("template", ExecutionContext()) for _ in range(2)]
+        subject = FlowScheduler(self.flow_runner)
+
+        # When
+        run_flow_ids = [subject.run_next_flow() for _ in range(4)]
+
+        # Then
+        assert(run_flow_ids == [scheduled_flow_ids[0], failed_flow_ids[0], scheduled_flow_ids[1], failed_flow_ids[1]])
+
+    def test_worker_outlives_storage_errors_while_idle(self, monkeypatch):
+        # Given
+        subject = FlowScheduler(self.flow_runner, min_poll_interval=0.01, max_poll_interval=0.05)
+        storage_error = Exception("database is locked")
+
+        def fail_to_read_storage():
+            raise storage_error
+
+        monkeypatch.setattr(self.flow_service, "get_storage_version", fail_to_read_storage)
+        monkeypatch.setattr(self.flow_service, "get_next_runnable_time", fail_to_read_storage)
+
+        with subject:
+            time.sleep(0.1)
+
+            # When
+            flow_id = self.flow_runner.schedule_flow("template", ExecutionContext())
+
+            # Then
+            assert(wait_for_status(self.flow_service, [flow_id], FlowStatus.SUCCEEDED, timeout=2))
+            assert(subject.is_running())
+            assert(subject.last_error is storage_error)
+
+    def test_idle_scheduler_backs_off(self):
+        # Given
+        subject = FlowScheduler(self.flow_runner, strategies=[FlowStatus.SCHEDULED], min_poll_interval=0.01, max_poll_interval=0.1)
+
+        # When
+        with subject:
+            time.sleep(0.5)
+
+        # Then
+        # Without backoff the worker would have polled 50 times, with it only every max_poll_interval is a claim forced
+        assert(self.flow_runner.run_flow_calls <= 8)
+
+    def test_flows_scheduled_from_another_storage_connection_are_polled(self, tmp_path):
+        # Given
+        storage_file_name = str(tmp_path / "flow_store.db")
+        self.flow_service.flow_repository = FlowRepository(storage_file_name)
+        other_flow_service = FlowService(PersistenceMode.TRANSIENT)
+        other_flow_service.flow_repository = FlowRepository(storage_file_name)
+        other_flow_runner = FlowRunner(other_flow_service)
+        other_flow_runner.register_flow_template(self.flow_runner.get_flow_template("template"))
+
+        subject = FlowScheduler(self.flow_runner, min_poll_interval=0.01, max_poll_interval=0.05)
+
+        with subject:
+            time.sleep(0.05)
+
+            # When
+            flow_id = other_flow_runner.schedule_flow("template", ExecutionContext())
+
+            # Then
+            assert(wait_for_status(other_flow_service, [flow_id], FlowStatus.SUCCEEDED, timeout=2))
+
+    def test_scheduler_can_only_be_started_once(self):
+        # Given
+        subject = FlowScheduler(self.flow_runner)
+
+        with subject:
+            # When/Then
+            with pytest.raises(ValueError) as exc:
+                subject.start()
+
+        raised_exception = exc.value
+        assert(type(raised_exception) is ValueError)
+        assert(self.flow_service.flows_queued_listeners == [])
+
+    def test_scheduler_rejects_non_runnable_strategies(self):
+        # When/Then
+        with pytest.raises(ValueError) as exc:
+            FlowScheduler(self.flow_runner, strategies=[FlowStatus.RUNNING])
+
+        raised_exception = exc.value
+        assert(type(raised_exception) is ValueError)
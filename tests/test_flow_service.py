@@ -1,5 +1,6 @@
 from logging import exception
-from src.model.flow import ExecutionContext, FlowStatus, PersistenceMode
+from src.model.flow import Durability, ExecutionContext, FlowStatus, PersistenceMode
+from src.repositories import flow_repository
 from src.services.flow_service import FlowService
 import pytest
 
@@ -33,4 +34,185 @@ class TestFlowService:
             self.subject.update_flow_status(flow.execution_id, FlowStatus.FAILED, execution_context)
 
         raised_expection = exc.value
-        assert(type(raised_expection) is ValueError)
\ No newline at end of file
+        assert(type(raised_expection) is ValueError)
+
+    def test_runnable_flow_ignores_flows_that_already_left_the_queue(self):
+        # Given
+        execution_context = ExecutionContext()
+        flow = self.subject.create_flow_execution("template", execution_context)
+        self.subject.update_flow_status(flow.execution_id, FlowStatus.SCHEDULED, execution_context)
+        self.subject.update_flow_status(flow.execution_id, FlowStatus.RUNNING, execution_context)
+
+        # When
+        runnable_flow = self.subject.get_runnable_flow(FlowStatus.SCHEDULED)
+
+        # Then
+        assert(runnable_flow is None)
+
+    def test_runnable_flow_honors_priority_then_scheduling_order(self):
+        # Given
+        execution_context = ExecutionContext()
+        flow_ids = []
+        for priority in [0, 5, 0, 5]:
+            flow = self.subject.create_flow_execution("template", execution_context, priority)
+            self.subject.update_flow_status(flow.execution_id, FlowStatus.SCHEDULED, execution_context)
+            flow_ids.append(flow.execution_id)
+
+        # When
+        run_order = []
+        for _ in flow_ids:
+            runnable_flow = self.subject.get_runnable_flow(FlowStatus.SCHEDULED)
+            self.subject.update_flow_status(runnable_flow.execution_id, FlowStatus.RUNNING, execution_context)
+            run_order.append(runnable_flow.execution_id)
+
+        # Then
+        assert(run_order == [flow_ids[1], flow_ids[3], flow_ids[0], flow_ids[2]])
+        assert(self.subject.get_runnable_flow(FlowStatus.SCHEDULED) is None)
+
+    def test_create_scheduled_flow_executions_from_a_generator(self):
+        # Given
+        existing_flow = self.subject.create_flow_execution("template", ExecutionContext())
+
+        def execution_contexts():
+            for value in range(5):
+                execution_context = ExecutionContext()
+                execution_context.set("value", value)
+                yield execution_context
+
+        # When
+        flow_ids = self.subject.create_scheduled_flow_executions("template", execution_contexts(), batch_size=2)
+
+        # Then
+        assert(flow_ids == list(range(existing_flow.execution_id + 1, existing_flow.execution_id + 6)))
+
+        for (value, flow_id) in enumerate(flow_ids):
+            flow = self.subject.get_flow_execution(flow_id)
+            assert(flow.status == FlowStatus.SCHEDULED)
+            assert(flow.execution_step == 1)
+            assert(flow.execution_context.get("value") == value)
+            assert([step.status for step in self.subject.get_flow_execution_history(flow_id)] == [FlowStatus.CREATED, FlowStatus.SCHEDULED])
+
+        assert(self.subject.get_runnable_flow(FlowStatus.SCHEDULED).execution_id == flow_ids[0])
+
+    def test_task_execution_history_is_streamed_page_by_page(self):
+        # Given
+        flow = self.subject.create_flow_execution("template", ExecutionContext())
+        other_flow = self.subject.create_flow_execution("template", ExecutionContext())
+
+        for _ in range(5):
+            self.subject.create_task_execution(flow)
+            self.subject.create_task_execution(other_flow)
+
+        # When
+        (first_page, next_page_cursor) = self.subject.get_flow_task_execution_page(flow.execution_id, limit=3)
+        (second_page, last_page_cursor) = self.subject.get_flow_task_execution_page(flow.execution_id, next_page_cursor, limit=3)
+        streamed_history = list(self.subject.iterate_flow_task_execution_history(flow.execution_id, page_size=2))
+
+        # Then
+        assert(len(first_page) == 3)
+        assert(len(second_page) == 2)
+        assert(last_page_cursor is None)
+        assert(len(streamed_history) == 5)
+        assert(all(task_execution.flow_execution_id == flow.execution_id for task_execution in streamed_history))
+
+        with pytest.raises(ValueError):
+            self.subject.iterate_flow_task_execution_history(666)
+
+    def test_list_flows_by_status_template_and_time_range(self):
+        # Given
+        flows = [self.subject.create_flow_execution(template_name, ExecutionContext()) for template_name in ["first", "second", "first", "first"]]
+        self.subject.update_flow_status(flows[2].execution_id, FlowStatus.SCHEDULED, ExecutionContext())
+        scheduled_flow = self.subject.get_flow_execution(flows[2].execution_id)
+
+        # When
+        (first_page, next_page_cursor) = self.subject.list_flows(template_name="first", limit=2)
+        (second_page, last_page_cursor) = self.subject.list_flows(template_name="first", after=next_page_cursor, limit=2)
+
+        # Then
+        assert([flow.execution_id for flow in first_page] == [flows[0].execution_id, flows[3].execution_id])
+        assert([flow.execution_id for flow in second_page] == [flows[2].execution_id])
+        assert(last_page_cursor is None)
+
+        assert([flow.execution_id for flow in self.subject.iterate_flows(status=FlowStatus.CREATED, page_size=1)] == [flow.execution_id for flow in flows if flow is not flows[2]])
+        assert([flow.execution_id for flow in self.subject.iterate_flows(since=scheduled_flow.timestamp)] == [scheduled_flow.execution_id])
+        assert([flow.execution_id for flow in self.subject.iterate_flows(until=flows[1].timestamp)] == [flows[0].execution_id])
+
+    def test_leased_flow_steps_are_read_from_the_flow_cache(self, monkeypatch):
+        # Given
+        flow = self.subject.create_flow_execution("template", ExecutionContext())
+        self.subject.update_flow_status(flow.execution_id, FlowStatus.SCHEDULED, ExecutionContext())
+        self.subject.claim_runnable_flow(FlowStatus.SCHEDULED, "owner", 60)
+
+        storage_reads = []
+        get_flow = self.subject.flow_repository.get_flow
+        monkeypatch.setattr(self.subject.flow_repository, "get_flow", lambda flow_id: storage_reads.append(flow_id) or get_flow(flow_id))
+
+        # When
+        running_flow = self.subject.update_flow_status(flow.execution_id, FlowStatus.RUNNING, None)
+        task_execution = self.subject.create_task_execution(running_flow)
+        self.subject.update_task_execution(flow.execution_id, task_execution)
+        output_execution_context = ExecutionContext()
+        output_execution_context.set("some_output", "OK")
+        self.subject.update_flow_status(flow.execution_id, FlowStatus.SUCCEEDED, output_execution_context)
+        cached_flow = self.subject.get_flow_execution(flow.execution_id)
+
+        self.subject.release_flow(flow.execution_id, "owner")
+        stored_flow = self.subject.get_flow_execution(flow.execution_id)
+
+        # Then
+        # Only the read made once the flow was released went to the storage
+        assert(storage_reads == [flow.execution_id])
+        assert(cached_flow.status == FlowStatus.SUCCEEDED)
+        assert(stored_flow.status == FlowStatus.SUCCEEDED)
+        assert(stored_flow.execution_step == cached_flow.execution_step)
+        assert(stored_flow.execution_context.get("some_output") == "OK")
+
+    def test_flow_cache_is_cleared_when_a_transaction_is_rolled_back(self):
+        # Given
+        flow = self.subject.create_flow_execution("template", ExecutionContext())
+        self.subject.update_flow_status(flow.execution_id, FlowStatus.SCHEDULED, ExecutionContext())
+        self.subject.claim_runnable_flow(FlowStatus.SCHEDULED, "owner", 60)
+
+        # When
+        with pytest.raises(ValueError):
+            with self.subject.transaction():
+                self.subject.update_flow_status(flow.execution_id, FlowStatus.RUNNING, None)
+                raise ValueError("Rolled back")
+
+        # Then
+        assert(len(self.subject.flow_cache) == 0)
+        assert(self.subject.get_flow_execution(flow.execution_id).status == FlowStatus.SCHEDULED)
+
+    def test_cached_flows_are_not_changed_through_the_returned_flows(self):
+        # Given
+        execution_context = ExecutionContext()
+        execution_context.set("value", 1)
+        flow = self.subject.create_flow_execution("template", execution_context)
+        self.subject.update_flow_status(flow.execution_id, FlowStatus.SCHEDULED, None)
+        claimed_flow = self.subject.claim_runnable_flow(FlowStatus.SCHEDULED, "owner", 60)
+
+        # When
+        claimed_flow.status = FlowStatus.FAILED
+        claimed_flow.execution_context.set("value", 2)
+
+        # Then
+        cached_flow = self.subject.get_flow_execution(flow.execution_id)
+        assert(cached_flow.status == FlowStatus.SCHEDULED)
+        assert(cached_flow.execution_context.get("value") == 1)
+
+def test_persistent_service_with_a_durability_leaves_the_default_repository_alone(tmp_path, monkeypatch):
+    # Given
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(flow_repository, "_default_persistent_instance", None)
+    default_service = FlowService(PersistenceMode.PERSISTENT)
+
+    # When
+    subject = FlowService(PersistenceMode.PERSISTENT, Durability.GROUP_COMMIT)
+
+    # Then
+    assert(subject.flow_repository is not default_service.flow_repository)
+    assert(subject.flow_repository.durability is Durability.GROUP_COMMIT)
+    assert(default_service.flow_repository.durability is Durability.FULL)
+
+    subject.flow_repository.close()
+    default_service.flow_repository.close()
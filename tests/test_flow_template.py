@@ -1,5 +1,6 @@
 from typing import List
-from src.model.flow import ExecutionContext, FlowTemplate, Task, TaskDataItem
+from src.model.codec import BlobReference
+from src.model.flow import ExecutionContext, FlowTemplate, FlowTemplateMode, RetryPolicy, Task, TaskDataItem, hash_task_inputs
 import pytest
 
 class Task1(Task):
@@ -23,6 +24,25 @@ class Task3(Task):
     def outputs(self) -> list[TaskDataItem]:
         return [TaskDataItem("A", int)]
 
+class ChainTask(Task):
+    index: int
+
+    def __init__(self, index: int):
+        self.index = index
+
+    def inputs(self) -> list[TaskDataItem]:
+        return [TaskDataItem(f"item_{self.index}", int)]
+
+    def outputs(self) -> list[TaskDataItem]:
+        return [TaskDataItem(f"item_{self.index + 1}", int)]
+
+class JoinTask(Task):
+    def inputs(self) -> list[TaskDataItem]:
+        return [TaskDataItem("B", str), TaskDataItem("D", str)]
+
+    def outputs(self) -> list[TaskDataItem]:
+        return [TaskDataItem("E", str)]
+
 class TestFlowTemplate():
     subject = None
 
@@ -62,4 +82,173 @@ class TestFlowTemplate():
             self.subject.add_task(secondTask)
         
         raised_exception = exc.value
-        assert(type(raised_exception) is ValueError)
\ No newline at end of file
+        assert(type(raised_exception) is ValueError)
+
+    def test_compiled_execution_plan(self):
+        # Given
+        self.subject.add_task(Task1())
+        self.subject.add_task(Task())
+
+        # When
+        execution_plan = self.subject.compile()
+        self.subject.add_task(Task())
+
+        # Then
+        assert(len(execution_plan) == 2)
+        assert(execution_plan.get_task(2) is None)
+        assert(execution_plan.task_inputs[0] == frozenset([TaskDataItem("A", int)]))
+        assert(execution_plan.task_outputs[0] == frozenset([TaskDataItem("B", str)]))
+        assert(execution_plan.task_dependencies == (frozenset(), frozenset([0])))
+
+    def test_large_template_is_validated_and_compiled(self):
+        # Given
+        task_count = 2000
+
+        # When
+        for index in range(task_count):
+            self.subject.add_task(ChainTask(index))
+        execution_plan = self.subject.compile()
+
+        # Then
+        assert(len(execution_plan) == task_count)
+        assert(execution_plan.get_ready_tasks(frozenset(range(task_count - 1)), set()) == [task_count - 1])
+
+    def test_dag_execution_plan_derives_dependencies_from_data_items(self):
+        # Given
+        subject = FlowTemplate("dag", mode=FlowTemplateMode.DAG)
+
+        # Tasks don't need to be added in dependency order
+        subject.add_task(Task3())
+        subject.add_task(Task2())
+        subject.add_task(ChainTask(0))
+
+        # When
+        execution_plan = subject.compile()
+
+        # Then
+        assert(execution_plan.is_dag())
+        assert(execution_plan.task_dependencies == (frozenset(), frozenset(), frozenset()))
+        assert(execution_plan.get_ready_tasks(frozenset(), set()) == [0, 1, 2])
+        assert(execution_plan.get_ready_tasks(frozenset([0]), {1}) == [2])
+
+    def test_dag_execution_plan_waits_for_every_producer(self):
+        # Given
+        subject = FlowTemplate("dag", mode=FlowTemplateMode.DAG)
+        subject.add_task(Task1())
+        subject.add_task(Task2())
+        subject.add_task(JoinTask())
+
+        # When
+        execution_plan = subject.compile()
+
+        # Then
+        assert(execution_plan.task_dependencies[2] == frozenset([0, 1]))
+        assert(execution_plan.get_ready_tasks(frozenset([0]), set()) == [1])
+        assert(execution_plan.get_ready_tasks(frozenset([0, 1]), set()) == [2])
+
+    def test_dag_template_with_circular_dependencies(self):
+        # Given
+        subject = FlowTemplate("dag", mode=FlowTemplateMode.DAG)
+        subject.add_task(Task1())
+        subject.add_task(Task3())
+
+        # When/Then
+        with pytest.raises(ValueError):
+            subject.compile()
+
+    def test_dag_template_with_data_item_produced_twice(self):
+        # Given
+        subject = FlowTemplate("dag", mode=FlowTemplateMode.DAG)
+        subject.add_task(Task1())
+
+        # When/Then
+        with pytest.raises(ValueError):
+            subject.add_task(Task1())
+
+class TestRetryPolicy:
+    def test_retry_delays_grow_exponentially_up_to_max_backoff(self):
+        # Given
+        subject = RetryPolicy(max_attempts=10, backoff=1, multiplier=2, max_backoff=5, jitter=0)
+
+        # When
+        delays = [subject.get_delay(attempt) for attempt in range(1, 6)]
+
+        # Then
+        assert(delays == [1, 2, 4, 5, 5])
+
+    def test_retry_delays_are_jittered(self):
+        # Given
+        subject = RetryPolicy(backoff=10, jitter=0.5)
+
+        # When
+        delays = [subject.get_delay(1) for _ in range(100)]
+
+        # Then
+        assert(all(5 <= delay <= 15 for delay in delays))
+        assert(len(set(delays)) > 1)
+
+    def test_flows_are_retried_until_max_attempts(self):
+        # Given
+        subject = RetryPolicy(max_attempts=3)
+
+        # Then
+        assert(subject.can_retry(1))
+        assert(subject.can_retry(2))
+        assert(not subject.can_retry(3))
+
+    def test_invalid_retry_policies(self):
+        with pytest.raises(ValueError):
+            RetryPolicy(max_attempts=0)
+
+        with pytest.raises(ValueError):
+            RetryPolicy(backoff=10, max_backoff=1)
+
+        with pytest.raises(ValueError):
+            RetryPolicy(jitter=2)
+
+class TestHashTaskInputs:
+    def create_context(self, **values) -> ExecutionContext:
+        context = ExecutionContext()
+        for (key, value) in values.items():
+            context.set(key, value)
+
+        return context
+
+    def test_only_declared_inputs_are_hashed(self):
+        # Given
+        subject = Task2()
+
+        # When
+        input_hash = hash_task_inputs(subject, self.create_context(C="value", other="one"))
+        same_input_hash = hash_task_inputs(subject, self.create_context(other="two", C="value"))
+        other_input_hash = hash_task_inputs(subject, self.create_context(C="other value"))
+
+        # Then
+        assert(input_hash == same_input_hash)
+        assert(input_hash != other_input_hash)
+        assert(input_hash != hash_task_inputs(Task3(), self.create_context(C="value")))
+
+    def test_tasks_are_hashed_by_their_place_in_the_template(self):
+        # Given
+        context = self.create_context(C="value")
+        input_hash = hash_task_inputs(Task2(), context, "template", 1)
+
+        # Then
+        assert(input_hash == hash_task_inputs(Task2(), context, "template", 1))
+        assert(input_hash != hash_task_inputs(Task2(), context, "template", 2))
+        assert(input_hash != hash_task_inputs(Task2(), context, "other template", 1))
+
+    def test_missing_inputs_do_not_hash_like_none(self):
+        assert(hash_task_inputs(Task2(), self.create_context()) != hash_task_inputs(Task2(), self.create_context(C=None)))
+
+    def test_binary_inputs_are_hashed_by_content(self):
+        # Given
+        subject = Task2()
+        value = bytes(range(256))
+
+        # Then
+        assert(hash_task_inputs(subject, self.create_context(C=value)) == hash_task_inputs(subject, self.create_context(C=bytearray(value))))
+        assert(hash_task_inputs(subject, self.create_context(C=BlobReference("some_hash", 10))) is not None)
+
+    def test_inputs_that_can_not_be_hashed(self):
+        assert(hash_task_inputs(Task2(), self.create_context(C=object())) is None)
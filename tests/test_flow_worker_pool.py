@@ -0,0 +1,67 @@
+from src.model.flow import ExecutionContext, FlowStatus, FlowTemplate, PersistenceMode, TaskStatus
+from src.runner.flow_runner import FlowRunner
+from src.runner.flow_worker_pool import FlowWorkerPool, WorkerMode
+from src.services.flow_service import FlowService
+import functools
+import pytest
+
+from tests.task_helper import SuccessfulTask
+
+def create_flow_runner(persistence: PersistenceMode, storage_file_name: str = None) -> FlowRunner:
+    flow_template = FlowTemplate("template")
+    flow_template.add_task(SuccessfulTask())
+    flow_template.add_task(SuccessfulTask())
+
+    flow_runner = FlowRunner(FlowService(persistence, storage_file_name=storage_file_name))
+    flow_runner.register_flow_template(flow_template)
+
+    return flow_runner
+
+def create_persistent_flow_runner(storage_file_name: str = None) -> FlowRunner:
+    return create_flow_runner(PersistenceMode.PERSISTENT, storage_file_name)
+
+class TestFlowWorkerPool:
+    def test_thread_pool_runs_every_flow_once(self):
+        # Given
+        flow_runner = create_flow_runner(PersistenceMode.TRANSIENT)
+        flow_ids = [flow_runner.schedule_flow("template", ExecutionContext()) for _ in range(20)]
+
+        subject = FlowWorkerPool(lambda: flow_runner, 4, WorkerMode.THREAD)
+
+        # When
+        flow_count = subject.run_flows(FlowStatus.SCHEDULED)
+
+        # Then
+        assert(flow_count == 20)
+        for flow_id in flow_ids:
+            flow = flow_runner.flow_service.get_flow_execution(flow_id)
+            assert(flow.status == FlowStatus.SUCCEEDED)
+
+            flow_task_execution_history = flow_runner.flow_service.get_flow_task_execution_history(flow_id)
+            assert(len(flow_task_execution_history) == 4)
+            assert(flow_task_execution_history[3].status == TaskStatus.SUCCEEDED)
+
+    def test_process_pool_runs_every_flow_once(self, tmp_path):
+        # Given
+        create_flow_runner_for_storage = functools.partial(create_persistent_flow_runner, str(tmp_path / "flow_store.db"))
+        flow_runner = create_flow_runner_for_storage()
+        flow_ids = [flow_runner.schedule_flow("template", ExecutionContext()) for _ in range(6)]
+
+        subject = FlowWorkerPool(create_flow_runner_for_storage, 2, WorkerMode.PROCESS)
+
+        # When
+        flow_count = subject.run_flows(FlowStatus.SCHEDULED)
+
+        # Then
+        assert(flow_count == 6)
+        for flow_id in flow_ids:
+            flow = flow_runner.flow_service.get_flow_execution(flow_id)
+            assert(flow.status == FlowStatus.SUCCEEDED)
+
+    def test_worker_pool_without_workers(self):
+        # When/Then
+        with pytest.raises(ValueError) as exc:
+            FlowWorkerPool(create_persistent_flow_runner, 0)
+
+        raised_exception = exc.value
+        assert(type(raised_exception) is ValueError)
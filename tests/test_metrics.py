@@ -0,0 +1,112 @@
+from src.model.flow import ExecutionContext, FlowStatus, FlowTemplate, PersistenceMode
+from src.model.metrics import NULL_METRICS, MetricsRegistry, MetricType, disable_metrics, enable_metrics, get_metrics, timed
+from src.runner.flow_runner import FlowRunner
+from src.services.flow_service import FlowService
+import pytest
+
+from tests.task_helper import FailingTask, SuccessfulTask
+
+def get_sample(samples, name: str, labels: tuple = ()):
+    return next(sample for sample in samples if sample.name == name and sample.labels == labels)
+
+class TestMetrics:
+    registry = None
+
+    @pytest.fixture(autouse=True)
+    def before_tests(self):
+        self.registry = MetricsRegistry()
+        yield
+        disable_metrics()
+
+    def test_counters_gauges_and_timers(self):
+        # When
+        self.registry.increment("runs_total", (("status", "ok"),))
+        self.registry.increment("runs_total", (("status", "ok"),), 2)
+        self.registry.set_gauge("depth", 5)
+        self.registry.set_gauge("depth", 3)
+        self.registry.observe("run_seconds", 0.5)
+        with self.registry.timer("run_seconds"):
+            pass
+
+        samples = self.registry.snapshot()
+
+        # Then
+        assert(get_sample(samples, "runs_total", (("status", "ok"),)).value == 3)
+        assert(get_sample(samples, "depth").value == 3)
+        run_seconds = get_sample(samples, "run_seconds")
+        assert(run_seconds.type is MetricType.TIMER)
+        assert(run_seconds.count == 2)
+        assert(run_seconds.value >= 0.5)
+
+    def test_prometheus_text_format(self):
+        # Given
+        self.registry.increment("runs_total", (("template", "say \"hi\""),))
+        self.registry.observe("run_seconds", 0.25)
+
+        # When
+        text = self.registry.to_prometheus_text()
+
+        # Then
+        assert(text == "# TYPE run_seconds summary\n"
+                       "run_seconds_count 1\n"
+                       "run_seconds_sum 0.25\n"
+                       "# TYPE runs_total counter\n"
+                       "runs_total{template=\"say \\\"hi\\\"\"} 1.0\n")
+
+    def test_collectors_and_exporters_are_called_on_export(self):
+        # Given
+        exported_samples = []
+        self.registry.add_collector(lambda metrics: metrics.set_gauge("depth", 7))
+        self.registry.add_exporter(exported_samples.extend)
+
+        # When
+        self.registry.export()
+
+        # Then
+        assert([(sample.name, sample.value) for sample in exported_samples] == [("depth", 7)])
+
+    def test_disabled_metrics_record_nothing(self):
+        # Given
+        @timed("calls_seconds")
+        def call() -> int:
+            return 1
+
+        # When
+        result = call()
+
+        # Then
+        assert(result == 1)
+        assert(get_metrics() is NULL_METRICS)
+        assert(get_metrics().timer("calls_seconds") is get_metrics().timer("other_seconds"))
+        assert(self.registry.snapshot() == [])
+
+    def test_flow_runs_are_instrumented(self):
+        # Given
+        enable_metrics(self.registry)
+        flow_service = FlowService(PersistenceMode.TRANSIENT)
+        flow_runner = FlowRunner(flow_service)
+        self.registry.add_collector(flow_service.collect_metrics)
+
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(SuccessfulTask())
+        flow_template.add_task(FailingTask())
+        flow_runner.register_flow_template(flow_template)
+
+        flow_runner.schedule_flow("template", ExecutionContext())
+        flow_runner.schedule_flow("template", ExecutionContext())
+
+        # When
+        flow_runner.run_flow(FlowStatus.SCHEDULED)
+        samples = self.registry.snapshot()
+
+        # Then
+        assert(get_sample(samples, "flow_task_run_seconds", (("template", "template"),)).count == 2)
+        assert(get_sample(samples, "flow_tasks_total", (("template", "template"), ("status", "SUCCEEDED"))).value == 1)
+        assert(get_sample(samples, "flow_tasks_total", (("template", "template"), ("status", "FAILED"))).value == 1)
+        assert(get_sample(samples, "flow_repository_query_seconds", (("query", "save_flow"),)).count > 0)
+        assert(get_sample(samples, "flow_repository_commit_seconds").count > 0)
+        assert(get_sample(samples, "flow_context_encode_seconds").count > 0)
+        assert(get_sample(samples, "flow_status_flows", (("status", "SCHEDULED"),)).value == 1)
+        assert(get_sample(samples, "flow_status_flows", (("status", "FAILED"),)).value == 1)
+        assert(get_sample(samples, "flow_status_flows", (("status", "RUNNING"),)).value == 0)
+        assert(get_sample(samples, "flow_status_oldest_age_seconds", (("status", "SCHEDULED"),)).value >= 0)
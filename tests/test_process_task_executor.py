@@ -0,0 +1,129 @@
+from src.model.flow import ExecutionContext, FlowStatus, FlowTemplate, PersistenceMode, TaskStatus, TaskTimeoutError
+from src.model.codec import PICKLE_CODEC
+from src.runner.flow_runner import FlowRunner
+from src.runner.process_task_executor import ProcessTaskExecutor
+from src.services.flow_service import FlowService
+import hashlib
+import os
+import threading
+import time
+import pytest
+
+from tests.task_helper import ChecksumProcessTask, FailingProcessTask, SleepingChecksumProcessTask, SleepingProcessTask, SuccessfulTask
+
+class TestProcessTaskExecutor:
+    subject = None
+
+    @pytest.fixture(autouse=True)
+    def before_tests(self):
+        self.subject = ProcessTaskExecutor(workers=2, shared_memory_threshold=1024)
+        yield
+        self.subject.close()
+
+    def test_large_buffers_go_through_shared_memory(self):
+        # Given
+        payload = os.urandom(1024 * 1024)
+        execution_context = ExecutionContext()
+        execution_context.set("payload", payload)
+
+        # When
+        output_execution_context = self.subject.run(ChecksumProcessTask(), execution_context)
+
+        # Then
+        assert(output_execution_context.get("checksum") == hashlib.sha256(payload).hexdigest())
+        assert(output_execution_context.get("reversed_payload") == payload[::-1])
+        assert(output_execution_context.get("pid") != os.getpid())
+
+    def test_timed_out_task_does_not_keep_its_worker(self):
+        # Given
+        subject = ProcessTaskExecutor(workers=1, shared_memory_threshold=1024)
+        payload = os.urandom(1024 * 1024)
+        execution_context = ExecutionContext()
+        execution_context.set("payload", payload)
+
+        with pytest.raises(TaskTimeoutError):
+            subject.run(SleepingProcessTask(60), ExecutionContext(), timeout=0.2)
+
+        # When
+        output_execution_context = subject.run(ChecksumProcessTask(), execution_context, timeout=30)
+        start = time.monotonic()
+        subject.close()
+
+        # Then
+        assert(output_execution_context.get("checksum") == hashlib.sha256(payload).hexdigest())
+        assert(time.monotonic() - start < 5)
+
+    def test_other_tasks_of_a_retired_pool_are_completed(self):
+        # Given
+        payload = os.urandom(1024 * 1024)
+        execution_context = ExecutionContext()
+        execution_context.set("payload", payload)
+        outcome = {}
+
+        def run_slow_task():
+            outcome["execution_context"] = self.subject.run(SleepingChecksumProcessTask(0.5), execution_context)
+
+        slow_task = threading.Thread(target=run_slow_task)
+        slow_task.start()
+
+        # When
+        with pytest.raises(TaskTimeoutError):
+            self.subject.run(SleepingProcessTask(60), ExecutionContext(), timeout=0.1)
+        slow_task.join(30)
+
+        # Then
+        assert(outcome["execution_context"].get("checksum") == hashlib.sha256(payload).hexdigest())
+
+    def test_task_errors_are_raised_in_the_runner_process(self):
+        # When/Then
+        with pytest.raises(ValueError):
+            self.subject.run(FailingProcessTask(), ExecutionContext())
+
+class TestRunnerWithProcessTasks:
+    subject = None
+    flow_service = None
+
+    @pytest.fixture(autouse=True)
+    def before_tests(self):
+        self.flow_service = FlowService(PersistenceMode.TRANSIENT)
+        self.subject = FlowRunner(self.flow_service, process_workers=2)
+        yield
+        self.subject.close()
+
+    def test_run_flow_with_process_task(self):
+        # Given
+        flow_template = FlowTemplate("template", PICKLE_CODEC)
+        flow_template.add_task(ChecksumProcessTask())
+        flow_template.add_task(SuccessfulTask())
+
+        self.subject.register_flow_template(flow_template)
+
+        payload = os.urandom(256 * 1024)
+        execution_context = ExecutionContext()
+        execution_context.set("payload", payload)
+        flow_id = self.subject.schedule_flow("template", execution_context)
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+
+        # Then
+        assert(self.flow_service.get_flow_execution(flow_id).status == FlowStatus.SUCCEEDED)
+
+        checksum_step = [step for step in self.flow_service.get_flow_execution_history(flow_id) if step.execution_context.as_dict().get("checksum") is not None][0]
+        assert(checksum_step.execution_context.get("checksum") == hashlib.sha256(payload).hexdigest())
+        assert(bytes(checksum_step.execution_context.get("reversed_payload")) == payload[::-1])
+
+    def test_run_flow_with_failing_process_task(self):
+        # Given
+        flow_template = FlowTemplate("template")
+        flow_template.add_task(FailingProcessTask())
+
+        self.subject.register_flow_template(flow_template)
+        flow_id = self.subject.schedule_flow("template", ExecutionContext())
+
+        # When
+        self.subject.run_flow(FlowStatus.SCHEDULED)
+
+        # Then
+        assert(self.flow_service.get_flow_execution(flow_id).status == FlowStatus.FAILED)
+        assert(self.flow_service.get_flow_task_execution_history(flow_id)[-1].status == TaskStatus.FAILED)